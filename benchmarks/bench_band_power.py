@@ -0,0 +1,120 @@
+"""Cost of the band power features of the 'eeg' stream: BandPowerEngine vs a Welch PSD of the whole window per update.
+
+Both are fed the same synthetic EPOC+ session, sample by sample (as
+'new_eeg_data') and in blocks (as 'new_eeg_block'), and produce the same
+features: the largest relative difference is printed as a check. The cost
+is given per update and as the share of one core needed to keep up with
+the stream.
+
+Run from the repository root:
+    python benchmarks/bench_band_power.py [--seconds 60] [--update-rate 8] [--block 32]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'EEG-HUNTER-INTERFACE'))
+
+import telemetry
+from band_power import BandPowerEngine, DEFAULT_SAMPLING_RATE
+from mock_cortex import STREAM_COLS, MockCortex
+
+
+class FullWindowWelch():
+    # the direct approach: a Welch PSD of the last window, all segments transformed on every update
+    def __init__(self, engine, on_features):
+        self.engine = engine
+        self.window = engine.nperseg + (engine.n_segments - 1) * engine.step
+        self.hop = engine.update_steps * engine.step
+        self.on_features = on_features
+        self.samples = []
+        self.count = 0
+
+    def append(self, time, values):
+        self.samples.append(values)
+        self.count += 1
+        if len(self.samples) > self.window:
+            del self.samples[0]
+        if len(self.samples) == self.window and (self.count - self.window) % self.hop == 0:
+            e = self.engine
+            x = np.asarray(self.samples)[:, e._channel_idx]
+            segments = np.lib.stride_tricks.sliding_window_view(x, e.nperseg, axis=0)[::e.step]
+            segments = segments - segments.mean(axis=-1, keepdims=True)
+            spectrum = np.fft.rfft(segments * e._taper, axis=-1)
+            psd = (np.abs(spectrum) ** 2).mean(axis=0)
+            self.on_features(time, psd @ e._band_matrix)
+
+
+def session(seconds, seed):
+    mock = MockCortex(seed=seed)
+    n = int(seconds * DEFAULT_SAMPLING_RATE)
+    # the MARKERS column is removed by the decoder
+    samples = np.array([mock.make_eeg(i)[:-1] for i in range(n)], dtype=np.float64)
+    times = np.arange(n) / float(DEFAULT_SAMPLING_RATE)
+    return times, samples
+
+
+def run(name, feed, updates, seconds):
+    start = time.perf_counter()
+    feed()
+    elapsed = time.perf_counter() - start
+    print('{:<24}{:>9d}{:>14.1f}{:>12.3f}%'.format(name, len(updates), elapsed / max(len(updates), 1) * 1e6,
+                                                   100.0 * elapsed / seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=60.0, help='length of the session')
+    parser.add_argument('--update-rate', type=float, default=8.0, help='feature updates per second')
+    parser.add_argument('--block', type=int, default=32, help='samples per block')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    telemetry.configure(sink=None)
+    labels = STREAM_COLS['eeg'][:-1]
+    times, samples = session(args.seconds, args.seed)
+    rows = samples.tolist()
+
+    results = {}
+    def collector(name):
+        out = results[name] = []
+        return lambda t, powers: out.append(powers)
+
+    engine = BandPowerEngine(labels, update_rate=args.update_rate, on_features=collector('engine'))
+    block_engine = BandPowerEngine(labels, update_rate=args.update_rate, on_features=collector('engine, blocks'))
+    full = FullWindowWelch(engine, collector('full window'))
+
+    print('{} channels, {:g} s window, {} segments of {} samples, an update every {} samples'.format(
+        len(engine.channels), (full.window / float(DEFAULT_SAMPLING_RATE)), engine.n_segments,
+        engine.nperseg, full.hop))
+    print('{:<24}{:>9}{:>14}{:>13}'.format('', 'updates', 'us / update', 'of a core'))
+
+    def feed_samples(target):
+        def feed():
+            for t, row in zip(times, rows):
+                target.append(t, row)
+        return feed
+
+    def feed_blocks():
+        for start in range(0, len(times), args.block):
+            block_engine.append_block(times[start:start + args.block], samples[start:start + args.block])
+
+    run('full window', feed_samples(full), results['full window'], args.seconds)
+    run('engine', feed_samples(engine), results['engine'], args.seconds)
+    run('engine, blocks', feed_blocks, results['engine, blocks'], args.seconds)
+
+    reference = np.array(results['full window'])
+    for name in ('engine', 'engine, blocks'):
+        values = np.array(results[name])
+        if values.shape != reference.shape:
+            print('{}: {} updates, the full window gave {}'.format(name, len(values), len(reference)))
+            continue
+        print('{}: largest relative difference {:.2e}'.format(
+            name, np.max(np.abs(values - reference) / np.maximum(np.abs(reference), 1e-12))))
+
+
+if __name__ == '__main__':
+    main()
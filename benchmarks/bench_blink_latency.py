@@ -0,0 +1,197 @@
+"""Onset-to-decision latency of the blink detector on 'eeg' vs the Peak-Value-Hook on 'com', for the same blinks.
+
+A session is replayed into Cortex.on_message with SessionReplay, either a
+recorded one (--replay, subscribed to 'eeg' and 'com') or a synthetic one.
+In the synthetic session every blink of the mock 'eeg' (one every
+BLINK_PERIOD s) is also a 'com' detection: the power follows the blink's
+envelope, --com-delay s later, held --com-hold s longer, the time Cortex
+takes to detect the blink and to decay back to 0.0. For each blink the
+latency is measured in Cortex time from its onset to the decision of each
+path:
+    com    the packet where the power is back at 0.0 and the
+           Peak-Value-Hook decides on the held peak
+    blink  the sample where the signal falls back under the release
+           level and BlinkDetector emits its 'blink' event
+The onsets are the ones the synthetic session was made with. A recording
+has no ground truth, so the start of each detected blink is used and com
+is matched to the first decision after it. A blink without a decision of
+a path before the next one is counted as missed. The wall time spent in
+the detector per 'eeg' frame is printed as well.
+
+Run from the repository root:
+    python benchmarks/bench_blink_latency.py [--replay session.ctxlog] [--seconds 120] [--com-delay 0.3]
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'EEG-HUNTER-INTERFACE'))
+
+import telemetry
+from blink_detector import BlinkDetector
+from cortex import Cortex
+from mock_cortex import BLINK_AMPLITUDE, BLINK_DURATION, BLINK_PERIOD, DEFAULT_RATES, STREAM_COLS, MockCortex
+from peak_value_hook import PeakValueHook
+from session_log import SessionRecorder, SessionReplay
+
+# a blink of this amplitude is a 'com' power of 1.0, as BLINK_FULL_SCALE in the controllers
+BLINK_FULL_SCALE = 300.0
+
+
+def stimulus_com(t, delay, hold):
+    # the 'com' packet at time t for the blinks of the mock 'eeg', seen delay s later
+    if t < delay:
+        return ['neutral', 0.0]
+    phase = (t - delay) % BLINK_PERIOD
+    if phase >= BLINK_DURATION + hold:
+        return ['neutral', 0.0]
+    # the rise of the blink, its peak held for hold s, then its fall
+    envelope = math.sin(math.pi * min(phase, BLINK_DURATION / 2.0) / BLINK_DURATION)
+    if phase > BLINK_DURATION / 2.0 + hold:
+        envelope = math.sin(math.pi * (phase - hold) / BLINK_DURATION)
+    power = round(BLINK_AMPLITUDE / BLINK_FULL_SCALE * envelope, 2)
+    return ['left' if power else 'neutral', power]
+
+
+def synthetic_session(path, seconds, delay, hold, seed):
+    # a subscribe result for 'eeg' and 'com', then both streams in time order
+    mock = MockCortex(seed=seed)
+    frames = []
+    for n in range(int(seconds * DEFAULT_RATES['eeg'])):
+        t = n / float(DEFAULT_RATES['eeg'])
+        frames.append((t, json.dumps({'eeg': mock.make_eeg(n), 'sid': 'bench', 'time': t})))
+    for n in range(int(seconds * DEFAULT_RATES['com'])):
+        t = n / float(DEFAULT_RATES['com'])
+        frames.append((t, json.dumps({'com': stimulus_com(t, delay, hold), 'sid': 'bench', 'time': t})))
+    frames.sort(key=lambda frame: frame[0])
+    subscribed = {'id': 1, 'jsonrpc': '2.0',
+                  'result': {'success': [{'streamName': name, 'cols': STREAM_COLS[name], 'sid': 'bench'}
+                                         for name in ('eeg', 'com')],
+                             'failure': []}}
+    recorder = SessionRecorder(path)
+    recorder.record(json.dumps(subscribed), 0.0)
+    for t, message in frames:
+        recorder.record(message, t)
+    recorder.close()
+    # the blinks after the detector's first baseline, and before the end of the session
+    return list(np.arange(BLINK_PERIOD, seconds - BLINK_PERIOD / 2.0, BLINK_PERIOD))
+
+
+class ComPath():
+    # the Hunter rule on 'com': decide on the peak when the power falls back to 0.0
+    def __init__(self):
+        self.hook = PeakValueHook()
+        self.decisions = []
+
+    def on_new_com_data(self, *args, **kwargs):
+        data = kwargs.get('data')
+        # every packet at 0.0 decides, only the ones ending a rise are a detection
+        if self.hook.update(data.power) is not None and self.hook.last_value > 0.0:
+            self.decisions.append(data.time)
+
+
+class BlinkPath():
+    # the 'blink' events of a BlinkDetector bound to the Cortex
+    def __init__(self, c, sampling_rate):
+        self.detector = BlinkDetector(sampling_rate=sampling_rate)
+        self.detector.bind(c)
+        self.starts = []
+        self.decisions = []
+        self.frames = 0
+        self.busy = 0.0
+        # time every sample handed to the detector
+        append = self.detector.append
+        def timed_append(time_, values):
+            start = time.perf_counter()
+            append(time_, values)
+            self.busy += time.perf_counter() - start
+            self.frames += 1
+        self.detector.append = timed_append
+
+    def on_blink(self, *args, **kwargs):
+        event = kwargs.get('data')
+        self.starts.append(event.start)
+        self.decisions.append(event.time)
+
+
+def match(onsets, decisions):
+    # latency from each onset to the first decision before the next onset, NaN if none
+    onsets = np.asarray(onsets, dtype=np.float64)
+    decisions = np.sort(np.asarray(decisions, dtype=np.float64))
+    ends = np.append(onsets[1:], np.inf)
+    idx = np.searchsorted(decisions, onsets)
+    found = idx < len(decisions)
+    first = np.full(len(onsets), np.inf)
+    first[found] = decisions[idx[found]]
+    return np.where(first < ends, first - onsets, np.nan)
+
+
+def summary(name, latencies):
+    ms = latencies[~np.isnan(latencies)] * 1000.0
+    missed = int(np.isnan(latencies).sum())
+    if not len(ms):
+        print('{:<8}{:>8}{:>8}'.format(name, 0, missed))
+        return
+    print('{:<8}{:>8d}{:>8d}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}'.format(
+        name, len(ms), missed, np.percentile(ms, 50), np.percentile(ms, 95), np.max(ms), np.mean(ms)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--replay', help='session log recorded with Cortex(..., record=PATH)')
+    parser.add_argument('--seconds', type=float, default=120.0, help='length of the synthetic session')
+    parser.add_argument('--com-delay', type=float, default=0.3,
+                        help='seconds from a blink to its com power, in the synthetic session')
+    parser.add_argument('--com-hold', type=float, default=0.5,
+                        help='seconds the com power stays up after the blink, in the synthetic session')
+    parser.add_argument('--eeg-rate', type=float, default=DEFAULT_RATES['eeg'],
+                        help='eeg samples per second, a replay has no headset settings')
+    parser.add_argument('--speed', type=float, default=0.0, help='replay speed, 0 for as fast as possible')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    telemetry.configure(sink=None)
+    path = args.replay
+    tmp_dir = None
+    onsets = None
+    if path is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp_dir.name, 'synthetic.ctxlog')
+        onsets = synthetic_session(path, args.seconds, args.com_delay, args.com_hold, args.seed)
+
+    c = Cortex('bench_client_id', 'bench_client_secret', metrics=False)
+    com = ComPath()
+    blink = BlinkPath(c, args.eeg_rate)
+    c.bind(new_com_data=com.on_new_com_data, blink=blink.on_blink)
+    frames = SessionReplay(path).replay(c, speed=args.speed)
+    if onsets is None:
+        onsets = blink.starts
+
+    print('{} frames from {}, {} blinks'.format(
+        frames, args.replay or 'a synthetic session of {:g} s'.format(args.seconds), len(onsets)))
+    if not len(onsets):
+        return
+    com_latencies = match(onsets, com.decisions)
+    blink_latencies = match(onsets, blink.decisions)
+    print('{:<8}{:>8}{:>8}{:>10}{:>10}{:>10}{:>10}'.format(
+        'path', 'blinks', 'missed', 'p50 ms', 'p95 ms', 'max ms', 'mean ms'))
+    summary('com', com_latencies)
+    summary('blink', blink_latencies)
+    both = ~np.isnan(com_latencies) & ~np.isnan(blink_latencies)
+    if both.any():
+        print('blink decides {:.0f} ms sooner than com on the same blink (median of {})'.format(
+            np.median(com_latencies[both] - blink_latencies[both]) * 1000.0, int(both.sum())))
+    if blink.frames:
+        print('detector: {:.2f} us per eeg frame'.format(blink.busy / blink.frames * 1e6))
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""A slow classifier on the websocket thread vs in a ClassificationStage process pool.
+
+A Cortex with shared_streams=... is fed synthetic 'eeg' frames through
+Cortex.on_message at --rate frames per second. Every --hop samples a window
+of --window samples is classified by a stand-in model: the band power of
+every channel from an FFT, then a pure Python loop holding the GIL until
+--cost-ms have passed, as a model written in Python would.
+    inline   the classifier runs in the new_eeg_data listener, on the
+             websocket thread
+    pool N   a ClassificationStage with N workers reading the shared ring
+Printed per setup: how late frames are handled compared with when they
+arrive (the frames a slow listener holds up), the decisions delivered,
+skipped and stale, the latency from the last sample of a window to its
+decision, and the worker utilization. On a machine with fewer cores than
+workers the pool can only share the cores, not add to them.
+
+Run from the repository root:
+    python benchmarks/bench_classifier_pool.py [--workers 1 2 4] [--cost-ms 20] [--seconds 10]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'EEG-HUNTER-INTERFACE'))
+
+import telemetry
+from classifier_pool import ClassificationStage
+from cortex import Cortex
+from mock_cortex import STREAM_COLS, MockCortex
+
+
+class StandInModel():
+    # band power features, then Python work holding the GIL for cost seconds.
+    # A module-level class, so that the spawned workers can unpickle it
+    def __init__(self, cost):
+        self.cost = cost
+
+    def __call__(self, times, samples):
+        features = np.abs(np.fft.rfft(samples - samples.mean(axis=0), axis=0)).mean(axis=0)
+        end = time.perf_counter() + self.cost
+        n = 0
+        while time.perf_counter() < end:
+            n += 1
+        return 'push' if features[2] > features[3] else 'neutral'
+
+
+class Inline():
+    # the classifier in the new_eeg_data listener, on the window of the stream buffer, every hop samples
+    def __init__(self, buffer, classify, window, hop):
+        self.buffer = buffer
+        self.classify = classify
+        self.window = window
+        self.hop = hop
+        self.next_stop = window
+        self.latencies = []
+
+    def on_new_eeg_data(self, *args, **kwargs):
+        count = self.buffer.count
+        if count < self.next_stop:
+            return
+        self.next_stop = count + self.hop
+        arrived = time.perf_counter()
+        self.classify(*self.buffer.latest(self.window))
+        self.latencies.append(time.perf_counter() - arrived)
+
+
+def frames(count, seed):
+    mock = MockCortex(seed=seed)
+    return [json.dumps({'eeg': mock.make_eeg(n), 'sid': 'bench', 'time': n / 128.0}) for n in range(count)]
+
+
+def run(setup, workers, messages, args):
+    prefix = 'bench{}'.format(os.getpid())
+    c = Cortex('bench_client_id', 'bench_client_secret', metrics=False, shared_streams=prefix,
+               buffer_capacity=args.window if setup == 'inline' else 0)
+    classifier = StandInModel(args.cost_ms / 1000.0)
+    stage = inline = None
+    if setup == 'pool':
+        stage = ClassificationStage(classifier, window=args.window, hop=args.hop, workers=workers)
+        stage.start(c)
+    c.handle_sub_result({'success': [{'streamName': 'eeg', 'cols': STREAM_COLS['eeg'], 'sid': 'bench'}],
+                         'failure': []})
+    if setup == 'inline':
+        inline = Inline(c.get_stream_buffer('eeg'), classifier, args.window, args.hop)
+        c.bind(new_eeg_data=inline.on_new_eeg_data)
+
+    lateness = np.empty(len(messages))
+    period = 1.0 / args.rate
+    start = time.perf_counter()
+    for n, message in enumerate(messages):
+        due = start + n * period
+        wait = due - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        c.on_message(None, message)
+        lateness[n] = time.perf_counter() - due
+    elapsed = time.perf_counter() - start
+
+    if stage is not None:
+        # the decisions still in the pool
+        time.sleep(0.5)
+        stats = stage.stats()
+        stage.stop()
+        latencies = np.array([stats['latency'].get(key, np.nan) for key in ('p50', 'p95', 'max')])
+        counts = stats['delivered'], stats['skipped'], stats['stale'] + stats['overwritten']
+        utilization = stats['utilization']
+    else:
+        values = np.array(inline.latencies)
+        latencies = np.array([np.percentile(values, 50), np.percentile(values, 95), values.max()])
+        counts = len(values), 0, 0
+        utilization = values.sum() / elapsed
+    c.close_shared_rings()
+    lateness *= 1000.0
+    return {
+        'late_p50': np.percentile(lateness, 50),
+        'late_p99': np.percentile(lateness, 99),
+        'late_max': lateness.max(),
+        'delivered': counts[0],
+        'skipped': counts[1],
+        'stale': counts[2],
+        'latency': latencies * 1000.0,
+        'utilization': utilization,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='pool sizes')
+    parser.add_argument('--rate', type=float, default=128.0, help='eeg frames per second')
+    parser.add_argument('--seconds', type=float, default=10.0, help='length of each run')
+    parser.add_argument('--window', type=int, default=128, help='samples per window')
+    parser.add_argument('--hop', type=int, default=16, help='samples between two windows')
+    parser.add_argument('--cost-ms', type=float, default=20.0, help='time the classifier takes per window')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    telemetry.configure(sink=None)
+    messages = frames(int(args.seconds * args.rate), args.seed)
+    print('{} windows/s of {:g} ms each, {:.0f}% of a core'.format(
+        args.rate / args.hop, args.cost_ms, 100.0 * args.rate / args.hop * args.cost_ms / 1000.0))
+    print('{:<10}{:>11}{:>11}{:>11}{:>11}{:>9}{:>7}{:>10}{:>10}{:>10}{:>7}'.format(
+        'setup', 'late p50', 'late p99', 'late max', 'decisions', 'skipped', 'stale', 'p50 ms', 'p95 ms',
+        'max ms', 'util'))
+    runs = [('inline', 0)] + [('pool', workers) for workers in args.workers]
+    for setup, workers in runs:
+        r = run(setup, workers, messages, args)
+        name = setup if setup == 'inline' else 'pool {}'.format(workers)
+        print('{:<10}{:>11.2f}{:>11.2f}{:>11.2f}{:>11}{:>9}{:>7}{:>10.2f}{:>10.2f}{:>10.2f}{:>6.0f}%'.format(
+            name, r['late_p50'], r['late_p99'], r['late_max'], r['delivered'], r['skipped'], r['stale'],
+            r['latency'][0], r['latency'][1], r['latency'][2], 100.0 * r['utilization']))
+
+
+if __name__ == '__main__':
+    main()
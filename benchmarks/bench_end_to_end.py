@@ -0,0 +1,327 @@
+"""End-to-end latency from a 'com' frame entering Cortex.on_message to the robot command.
+
+Both controllers are driven by synthetic or replayed frames, with ROS and
+Webots replaced by timing stubs:
+    hunter           publisher.publish(twist) of the CommandExecutor thread
+    webots-callback  left_motor.setVelocity, stepping from on_new_com_data (start())
+    webots-loop      the MotorScheduler tick that applies the command (run())
+
+A decision is counted as dropped when a newer one replaces it before it
+reaches the robot. The results are printed and saved as JSON, so runs of
+different versions can be compared.
+
+Run from the repository root:
+    python benchmarks/bench_end_to_end.py [--rate HZ] [--seconds S] [--replay session.ctxlog] [--json PATH]
+"""
+import argparse
+import collections
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import types
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+HUNTER_DIR = os.path.join(ROOT, 'src', 'EEG-HUNTER-INTERFACE')
+WEBOTS_DIR = os.path.join(ROOT, 'src', 'EEG-WEBOTS-INTERFACE')
+sys.path.insert(0, HUNTER_DIR)
+sys.path.append(WEBOTS_DIR)
+
+import telemetry
+from mock_cortex import MockCortex
+from session_log import read_frames
+
+
+SCENARIOS = ('hunter', 'webots-callback', 'webots-loop')
+
+
+class Probe():
+    # timestamps of the frame being handled and of the decision waiting for the robot
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frame_in = 0.0
+        self.loop_frame_in = 0.0
+        self.pending = None
+        self.latencies = []
+        self.decisions = 0
+        self.dropped = 0
+
+    def decided(self, frame_in):
+        with self.lock:
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = frame_in
+            self.decisions += 1
+
+    def actuated(self):
+        now = time.perf_counter()
+        with self.lock:
+            if self.pending is not None:
+                self.latencies.append(now - self.pending)
+                self.pending = None
+
+    def drop(self):
+        with self.lock:
+            self.dropped += 1
+
+
+PROBE = Probe()
+STOP = threading.Event()
+
+
+# timing stubs of rospy, geometry_msgs and the Webots controller module
+class Vector3():
+    def __init__(self):
+        self.x = self.y = self.z = 0.0
+
+
+class Twist():
+    def __init__(self):
+        self.linear = Vector3()
+        self.angular = Vector3()
+
+
+class TimingPublisher():
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def publish(self, msg):
+        PROBE.actuated()
+
+
+class Rate():
+    def __init__(self, hz):
+        self.period = 1.0 / hz
+
+    def sleep(self):
+        time.sleep(self.period)
+
+
+class TimingMotor():
+    def __init__(self):
+        self.sensor = types.SimpleNamespace(enable=lambda period: None, getValue=lambda: 0.0)
+
+    def setPosition(self, position):
+        pass
+
+    def setVelocity(self, velocity):
+        PROBE.actuated()
+
+    def getPositionSensor(self):
+        return self.sensor
+
+
+class TimingRobot():
+    # robot.step costs step_ms of wall time, like Webots in real-time mode
+    def __init__(self, step_ms):
+        self.step_s = step_ms / 1000.0
+        self.motors = {}
+
+    def getDevice(self, name):
+        return self.motors.setdefault(name, TimingMotor())
+
+    def step(self, time_step):
+        if STOP.is_set():
+            return -1
+        if self.step_s:
+            time.sleep(self.step_s)
+        return 0
+
+
+class ProbeActuator():
+    # marks the decision, then hands it to the controller's actuator
+    def __init__(self, actuator, step_loop=False):
+        self.actuator = actuator
+        self.step_loop = step_loop
+
+    def actuate(self, decision, value):
+        PROBE.decided(PROBE.loop_frame_in if self.step_loop else PROBE.frame_in)
+        self.actuator.actuate(decision, value)
+
+
+class TimedMailbox(collections.deque):
+    # the run() mailbox, carrying the receive time of each command to the step loop
+    def append(self, item):
+        if len(self):
+            PROBE.drop()
+        super().append((item, PROBE.frame_in))
+
+    def pop(self):
+        item, frame_in = super().pop()
+        PROBE.loop_frame_in = frame_in
+        return item
+
+
+def install_stubs():
+    rospy = types.ModuleType('rospy')
+    rospy.init_node = lambda *args, **kwargs: None
+    rospy.Publisher = TimingPublisher
+    rospy.Rate = Rate
+    rospy.is_shutdown = STOP.is_set
+    geometry_msgs = types.ModuleType('geometry_msgs')
+    geometry_msgs.msg = types.ModuleType('geometry_msgs.msg')
+    geometry_msgs.msg.Twist = Twist
+    webots = types.ModuleType('controller')
+    webots.Robot = TimingRobot
+    sys.modules.update({'rospy': rospy, 'geometry_msgs': geometry_msgs, 'geometry_msgs.msg': geometry_msgs.msg,
+                        'controller': webots})
+
+
+def load_controller(name, path):
+    # by path, the two controllers only differ in the case of their file names
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_frames(count, seed):
+    mock = MockCortex(seed=seed)
+    return [json.dumps({'com': mock.make_com(n), 'sid': 'bench', 'time': n / 8.0}) for n in range(count)]
+
+
+def replayed_frames(path):
+    return [message for _, message in read_frames(path) if '"com"' in message and '"sid"' in message]
+
+
+def build(scenario, step_ms):
+    if scenario == 'hunter':
+        module = load_controller('bench_hunter_controller', os.path.join(HUNTER_DIR, 't7_controller.py'))
+        controller = module.LiveAdvance('bench_client_id', 'bench_client_secret')
+        controller.hook.actuator = ProbeActuator(controller.hook.actuator)
+        return controller, None
+
+    module = load_controller('bench_webots_controller', os.path.join(WEBOTS_DIR, 'T7_controller.py'))
+    robot = TimingRobot(step_ms)
+    controller = module.LiveAdvance('bench_client_id', 'bench_client_secret', robot)
+    if scenario == 'webots-callback':
+        controller.hook.actuator = ProbeActuator(controller.hook.actuator)
+        return controller, None
+
+    # run() without opening Cortex: the step loop of LiveAdvance.run on its own thread
+    controller.step_loop = True
+    controller.pending_command = TimedMailbox(maxlen=1)
+    controller.hook.actuator = ProbeActuator(module.ScheduledMotorActuator(controller.motors, module.WHEEL_SPEED,
+                                                                          module.RAMP_STEPS), step_loop=True)
+    # a command is in effect once the tick after it has run, even if the wheel speed is unchanged
+    motors = controller.motors
+    motors.left_motor = motors.right_motor = types.SimpleNamespace(setVelocity=lambda velocity: None)
+
+    def step_loop():
+        while robot.step(controller.time_step) != -1:
+            controller.apply_pending_command()
+            motors.tick()
+            PROBE.actuated()
+
+    loop = threading.Thread(target=step_loop, name='BenchStepLoop', daemon=True)
+    loop.start()
+    return controller, loop
+
+
+def run(scenario, frames, rate, step_ms):
+    global PROBE
+    PROBE = Probe()
+    STOP.clear()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        controller, loop = build(scenario, step_ms)
+        on_message = controller.c.on_message
+        period = 1.0 / rate if rate > 0 else 0.0
+        start = time.perf_counter()
+        for n, frame in enumerate(frames):
+            if period:
+                wait = start + n * period - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+            PROBE.frame_in = time.perf_counter()
+            on_message(None, frame)
+        elapsed = time.perf_counter() - start
+        # let the last command reach the robot
+        time.sleep(0.25)
+        STOP.set()
+        if loop is not None:
+            loop.join(1)
+        if scenario == 'hunter':
+            controller.executor.stop()
+
+    latencies = np.array(PROBE.latencies) * 1000.0
+    if len(latencies) == 0:
+        latencies = np.array([np.nan])
+    return {
+        'frames': len(frames),
+        'seconds': elapsed,
+        'throughput_fps': len(frames) / elapsed,
+        'decisions': PROBE.decisions,
+        'actuated': len(PROBE.latencies),
+        'dropped': PROBE.dropped,
+        'latency_ms': {
+            'p50': float(np.percentile(latencies, 50)),
+            'p95': float(np.percentile(latencies, 95)),
+            'p99': float(np.percentile(latencies, 99)),
+            'max': float(np.max(latencies)),
+            'mean': float(np.mean(latencies)),
+        },
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='controller path to measure (repeatable), all by default')
+    parser.add_argument('--rate', type=float, default=64.0, help='com frames per second, 0 for as fast as possible')
+    parser.add_argument('--seconds', type=float, default=5.0, help='length of the synthetic session')
+    parser.add_argument('--replay', help='session log recorded with Cortex(..., record=PATH) to use instead')
+    parser.add_argument('--step-ms', type=float, default=32.0,
+                        help='wall time of one Webots step, 0 for fast mode')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default='bench_end_to_end.json', help='where to save the results')
+    args = parser.parse_args()
+
+    install_stubs()
+    # the controllers still log every decision, but to the ring buffer only
+    telemetry.configure(sink=None)
+    if args.replay:
+        frames = replayed_frames(args.replay)
+    else:
+        frames = synthetic_frames(int(args.seconds * (args.rate or 64.0)), args.seed)
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'rate': args.rate,
+        'step_ms': args.step_ms,
+        'source': args.replay or 'synthetic',
+        'scenarios': {},
+    }
+    print('{:<16} {:>8} {:>9} {:>7} {:>8} {:>8} {:>8} {:>8}'.format(
+        'scenario', 'fps', 'decisions', 'dropped', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+    for scenario in args.scenario or SCENARIOS:
+        result = run(scenario, frames, args.rate, args.step_ms)
+        report['scenarios'][scenario] = result
+        latency = result['latency_ms']
+        print('{:<16} {:8.1f} {:9d} {:7d} {:8.2f} {:8.2f} {:8.2f} {:8.2f}'.format(
+            scenario, result['throughput_fps'], result['decisions'], result['dropped'],
+            latency['p50'], latency['p95'], latency['p99'], latency['max']))
+
+    with open(args.json, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('saved ' + args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Publish latency of one decision stream fanned out to a fleet of Hunters (RobotFleet) vs one publish thread.
+
+The Hunter controller is driven by synthetic 'com' frames fed into
+Cortex.on_message, with rospy replaced by timing stubs. Every publish()
+blocks for --publish-us, standing in for serializing and writing the
+message. Two setups are compared for each fleet size:
+    fleet   LiveAdvance(..., robots=...): a publisher and CommandExecutor
+            thread per robot, each with its own motion parameters
+    serial  the single CommandExecutor publishing to every robot's topic
+            in turn
+Latency is measured per robot, from the frame that made the decision to
+the first publish on the robot's /robot_i/cmd_vel after it. A decision a
+robot never published before the next one replaced it is counted as
+missed. The time the Cortex thread spends handing a decision over is
+printed as well.
+
+Run from the repository root:
+    python benchmarks/bench_fleet_fanout.py [--robots 1 4 16 64] [--seconds 10] [--publish-us 200]
+"""
+import argparse
+import contextlib
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+# the stubs of bench_end_to_end, which also puts the Hunter sources on sys.path
+from bench_end_to_end import HUNTER_DIR, STOP, install_stubs, load_controller, synthetic_frames
+
+import telemetry
+
+
+class FleetProbe():
+    # the decision waiting for the robots, and the latency of each robot's first publish of it
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frame_in = 0.0
+        self.decision = 0
+        self.decided_at = 0.0
+        self.latencies = []
+        self.handover = []
+
+    def decided(self):
+        with self.lock:
+            self.decision += 1
+            self.decided_at = self.frame_in
+
+    def published(self, publisher):
+        now = time.perf_counter()
+        with self.lock:
+            if publisher.seen != self.decision:
+                publisher.seen = self.decision
+                self.latencies.append(now - self.decided_at)
+
+
+PROBE = FleetProbe()
+
+
+class FleetPublisher():
+    # rospy.Publisher stub: publish() blocks for PUBLISH_COST seconds, then reports to the probe
+    PUBLISH_COST = 0.0
+
+    def __init__(self, topic, *args, **kwargs):
+        self.topic = topic
+        self.seen = 0
+
+    def publish(self, msg):
+        if self.PUBLISH_COST:
+            time.sleep(self.PUBLISH_COST)
+        PROBE.published(self)
+
+
+class SerialPublisher():
+    # the baseline: one executor thread publishing to every robot in turn
+    def __init__(self, publishers):
+        self.publishers = publishers
+
+    def publish(self, msg):
+        for publisher in self.publishers:
+            publisher.publish(msg)
+
+
+class ProbeActuator():
+    # marks the decision and times handing it to the actuator on the Cortex thread
+    def __init__(self, actuator):
+        self.actuator = actuator
+
+    def actuate(self, decision, value):
+        PROBE.decided()
+        start = time.perf_counter()
+        self.actuator.actuate(decision, value)
+        PROBE.handover.append(time.perf_counter() - start)
+
+
+def robot_params(count):
+    # one motion per decision, so that each robot is idle again before the next one
+    return {'robot_{}'.format(n): {'linear_speed': 0.1 + 0.01 * (n % 10), 'turn_speed': 0.5 + 0.05 * (n % 10),
+                                   'turn_ticks': 1, 'forward_ticks': 1}
+            for n in range(1, count + 1)}
+
+
+def build(module, setup, count):
+    robots = robot_params(count)
+    if setup == 'fleet':
+        controller = module.LiveAdvance('bench_client_id', 'bench_client_secret', robots=robots)
+        publishers = [executor.publisher for executor in controller.fleet.executors.values()]
+        stop = controller.fleet.stop
+    else:
+        controller = module.LiveAdvance('bench_client_id', 'bench_client_secret')
+        publishers = [FleetPublisher('/{}/cmd_vel'.format(name)) for name in robots]
+        controller.executor.publisher = SerialPublisher(publishers)
+        controller.hook.actuator = module.TwistActuator(controller.executor.submit, 0.1, 0.5, 1, 1)
+        stop = controller.executor.stop
+    controller.hook.actuator = ProbeActuator(controller.hook.actuator)
+    return controller, publishers, stop
+
+
+def run(module, setup, count, frames, rate):
+    global PROBE
+    PROBE = FleetProbe()
+    STOP.clear()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        controller, publishers, stop = build(module, setup, count)
+        on_message = controller.c.on_message
+        period = 1.0 / rate
+        start = time.perf_counter()
+        for n, frame in enumerate(frames):
+            wait = start + n * period - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            PROBE.frame_in = time.perf_counter()
+            on_message(None, frame)
+        # let the last decision reach every robot
+        time.sleep(0.25)
+        STOP.set()
+        stop()
+
+    latencies = np.array(PROBE.latencies) * 1000.0
+    if len(latencies) == 0:
+        latencies = np.array([np.nan])
+    return {
+        'decisions': PROBE.decision,
+        'missed': PROBE.decision * len(publishers) - len(PROBE.latencies),
+        'p50': np.percentile(latencies, 50),
+        'p95': np.percentile(latencies, 95),
+        'max': np.max(latencies),
+        'handover_us': np.mean(PROBE.handover) * 1e6 if PROBE.handover else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--robots', type=int, nargs='+', default=[1, 4, 16, 64], help='fleet sizes')
+    parser.add_argument('--seconds', type=float, default=10.0, help='length of the synthetic session')
+    parser.add_argument('--rate', type=float, default=8.0, help='com frames per second, the rate of Cortex')
+    parser.add_argument('--publish-us', type=float, default=200.0, help='time one publish() blocks')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    install_stubs()
+    sys.modules['rospy'].Publisher = FleetPublisher
+    FleetPublisher.PUBLISH_COST = args.publish_us / 1e6
+    telemetry.configure(sink=None)
+    module = load_controller('bench_fleet_controller', os.path.join(HUNTER_DIR, 't7_controller.py'))
+    frames = synthetic_frames(int(args.seconds * args.rate), args.seed)
+
+    print('{:<8}{:<8}{:>11}{:>8}{:>10}{:>10}{:>10}{:>14}'.format(
+        'robots', 'setup', 'decisions', 'missed', 'p50 ms', 'p95 ms', 'max ms', 'handover us'))
+    for count in args.robots:
+        for setup in ('fleet', 'serial'):
+            r = run(module, setup, count, frames, args.rate)
+            print('{:<8}{:<8}{:>11d}{:>8d}{:>10.2f}{:>10.2f}{:>10.2f}{:>14.1f}'.format(
+                count, setup, r['decisions'], r['missed'], r['p50'], r['p95'], r['max'], r['handover_us']))
+
+
+if __name__ == '__main__':
+    main()
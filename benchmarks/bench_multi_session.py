@@ -0,0 +1,119 @@
+"""Several headsets over one Cortex connection (add_session) vs one client per headset.
+
+For each number of headsets, the mock Cortex serves that many headsets and
+both setups are started until every session is subscribed to 'com' and
+'eeg', then stream for a while. Printed per setup: the time to get every
+session streaming, the requests and websockets used, and the range of the
+frames delivered per headset, which must all be about the same.
+
+The cost of routing a frame by 'sid' is measured separately, by feeding
+frames of every session straight into Cortex.on_message.
+
+Run from the repository root:
+    python benchmarks/bench_multi_session.py [--headsets 1 4 8 16] [--seconds 2]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'EEG-HUNTER-INTERFACE'))
+
+import telemetry
+from cortex import Cortex
+from mock_cortex import MockCortex
+
+
+class Headset():
+    # the listeners of one session: subscribe once created, count its frames
+    def __init__(self, session):
+        self.session = session
+        self.frames = 0
+        session.bind(create_session_done=self.on_create_session_done, new_com_data=self.on_data,
+                     new_eeg_data=self.on_data)
+
+    def on_create_session_done(self, *args, **kwargs):
+        self.session.sub_request(['com', 'eeg'])
+
+    def on_data(self, *args, **kwargs):
+        self.frames += 1
+
+
+def run(headsets, seconds, multiplexed):
+    mock = MockCortex(headsets=headsets)
+    url = mock.start_in_thread()
+    start = time.perf_counter()
+    if multiplexed:
+        clients = [Cortex('bench_client_id', 'bench_client_secret', url=url, headset_id=mock.headset_ids[0])]
+        sessions = clients[:1] + [clients[0].add_session(headset_id) for headset_id in mock.headset_ids[1:]]
+    else:
+        clients = [Cortex('bench_client_id', 'bench_client_secret', url=url, headset_id=headset_id)
+                   for headset_id in mock.headset_ids]
+        sessions = clients
+    listeners = [Headset(session) for session in sessions]
+    for c in clients:
+        c.open(block=False)
+    ready = all(session.subscribed.wait(30) for session in sessions)
+    setup = time.perf_counter() - start
+
+    # every session created, with its own id
+    sids = set(session.session_id for session in sessions)
+    counts_before = [listener.frames for listener in listeners]
+    time.sleep(seconds)
+    frames = [listener.frames - before for listener, before in zip(listeners, counts_before)]
+    requests = sum(c.request_count for c in clients)
+    for c in clients:
+        c.close()
+    mock.stop()
+    return {'ready': ready and len(sids) == headsets, 'setup': setup, 'requests': requests,
+            'websockets': len(clients), 'frames': frames}
+
+
+def routing_cost(headsets, number):
+    # on_message of frames spread over every session, without a socket
+    c = Cortex('bench_client_id', 'bench_client_secret', metrics=False)
+    sessions = [c] + [c.add_session('EPOCPLUS-{:08d}'.format(n)) for n in range(1, headsets)]
+    listeners = []
+    frames = []
+    for n, session in enumerate(sessions):
+        sid = 'bench-session-{}'.format(n)
+        session.session_id = sid
+        c.sessions_by_sid[sid] = session
+        listeners.append(Headset(session))
+        frames.append(json.dumps({'com': ['left', 0.5], 'sid': sid, 'time': 0.0}))
+    messages = [frames[n % headsets] for n in range(number)]
+    start = time.perf_counter()
+    for message in messages:
+        c.on_message(None, message)
+    elapsed = time.perf_counter() - start
+    misrouted = sum(abs(listener.frames - number // headsets) > 1 for listener in listeners)
+    return elapsed / number * 1e6, misrouted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--headsets', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--seconds', type=float, default=2.0, help='streaming time of each run')
+    parser.add_argument('--number', type=int, default=200000, help='frames fed for the routing cost')
+    args = parser.parse_args()
+
+    telemetry.configure(sink=None)
+    print('{:<10}{:<13}{:>7}{:>10}{:>10}{:>12}{:>24}'.format(
+        'headsets', 'setup', 'ready', 'setup s', 'requests', 'websockets', 'frames / headset'))
+    for headsets in args.headsets:
+        for name, multiplexed in (('one client', True), ('per headset', False)):
+            r = run(headsets, args.seconds, multiplexed)
+            print('{:<10}{:<13}{:>7}{:>10.3f}{:>10}{:>12}{:>24}'.format(
+                headsets, name, str(r['ready']), r['setup'], r['requests'], r['websockets'],
+                '{}-{}'.format(min(r['frames']), max(r['frames']))))
+
+    print()
+    print('{:<10}{:>12}{:>12}'.format('sessions', 'us / frame', 'misrouted'))
+    for headsets in args.headsets:
+        cost, misrouted = routing_cost(headsets, args.number)
+        print('{:<10}{:>12.2f}{:>12}'.format(headsets, cost, misrouted))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""Handing the decoded 'eeg' stream to other processes: shared memory rings (stream_bus) vs a multiprocessing.Queue.
+
+A Cortex with shared_streams=... is fed synthetic 'eeg' frames through
+Cortex.on_message at --rate frames per second, while reader processes
+follow the stream:
+    shared  SharedStreamReader on the segment, zero-copy views checked with
+            valid(), polling every --poll-us when there is nothing new
+    queue   the samples pickled into one multiprocessing.Queue per reader
+            from a new_eeg_data listener, as without the bus
+    none    neither, and no readers: the cost of on_message alone
+Every channel of sample n holds n % 4096, so a row mixing two samples
+(torn) is found by the readers. Printed per setup and number of readers:
+the time on_message takes per frame on the websocket thread, the latency
+from on_message to a reader seeing the sample (perf_counter is the same
+clock in every process), and the samples lost or torn.
+
+Run from the repository root:
+    python benchmarks/bench_shared_bus.py [--readers 1 4] [--rate 1024] [--seconds 5]
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'EEG-HUNTER-INTERFACE'))
+
+import telemetry
+from cortex import Cortex
+from mock_cortex import STREAM_COLS
+from stream_bus import SharedStreamReader, segment_name
+
+PATTERN = 4096
+
+
+def check(start, samples):
+    # rows whose channels are not all the value of their own sample
+    expected = (np.arange(start, start + len(samples)) % PATTERN).astype(np.float32)
+    return int(np.count_nonzero((samples.min(axis=1) != expected) | (samples.max(axis=1) != expected)))
+
+
+def shared_reader(name, poll, ready, results):
+    reader = SharedStreamReader(name)
+    ready.set()
+    cursor = reader.count
+    indices, seen = [], []
+    lost = torn = retries = 0
+    while True:
+        # whatever was written before the ring was closed is still read
+        closed = reader.closed
+        start, times, samples = reader.since(cursor)
+        if len(times) == 0:
+            if closed:
+                break
+            time.sleep(poll)
+            continue
+        now = time.perf_counter()
+        bad = check(start, samples)
+        if not reader.valid(start):
+            # overwritten while checking: read what is left again
+            retries += 1
+            continue
+        torn += bad
+        lost += start - cursor
+        indices.append(np.arange(start, start + len(times)))
+        seen.append(np.full(len(times), now))
+        cursor = start + len(times)
+    reader.close()
+    results.put((np.concatenate(indices) if indices else np.array([], dtype=int),
+                 np.concatenate(seen) if seen else np.array([]), lost, torn, retries))
+
+
+def queue_reader(samples, ready, results):
+    ready.set()
+    indices, seen = [], []
+    torn = 0
+    while True:
+        item = samples.get()
+        if item is None:
+            break
+        n, values = item
+        indices.append(n)
+        seen.append(time.perf_counter())
+        torn += check(n, np.array([values], dtype=np.float32))
+    results.put((np.array(indices, dtype=int), np.array(seen), 0, torn, 0))
+
+
+class QueueFanOut():
+    # the new_eeg_data listener of the queue setup, one put per reader and sample
+    def __init__(self, queues):
+        self.queues = queues
+        self.n = 0
+
+    def on_new_eeg_data(self, *args, **kwargs):
+        data = kwargs.get('data')
+        for q in self.queues:
+            q.put((self.n, data.eeg))
+        self.n += 1
+
+
+def frames(count):
+    columns = len(STREAM_COLS['eeg']) - 1
+    # the MARKERS column last, removed by the decoder
+    return [json.dumps({'eeg': [float(n % PATTERN)] * columns + [0], 'sid': 'bench', 'time': n / 128.0})
+            for n in range(count)]
+
+
+def run(setup, readers, messages, rate, poll):
+    prefix = 'bench{}'.format(os.getpid())
+    c = Cortex('bench_client_id', 'bench_client_secret', metrics=False,
+               shared_streams=prefix if setup == 'shared' else '', shared_capacity=4096)
+    c.handle_sub_result({'success': [{'streamName': 'eeg', 'cols': STREAM_COLS['eeg'], 'sid': 'bench'}],
+                         'failure': []})
+    results = mp.Queue()
+    processes, queues, events = [], [], []
+    for _ in range(readers):
+        ready = mp.Event()
+        if setup == 'shared':
+            p = mp.Process(target=shared_reader, args=(segment_name(prefix, 'eeg'), poll, ready, results))
+        else:
+            q = mp.Queue()
+            queues.append(q)
+            p = mp.Process(target=queue_reader, args=(q, ready, results))
+        p.start()
+        processes.append(p)
+        events.append(ready)
+    for ready in events:
+        ready.wait(10)
+    fan_out = QueueFanOut(queues)
+    if queues:
+        c.bind(new_eeg_data=fan_out.on_new_eeg_data)
+
+    stamps = np.empty(len(messages))
+    busy = 0.0
+    period = 1.0 / rate
+    start = time.perf_counter()
+    for n, message in enumerate(messages):
+        wait = start + n * period - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        t = stamps[n] = time.perf_counter()
+        c.on_message(None, message)
+        busy += time.perf_counter() - t
+
+    # let the readers catch up, then end them
+    time.sleep(0.2)
+    c.close_shared_rings()
+    for q in queues:
+        q.put(None)
+    collected = [results.get(timeout=30) for _ in processes]
+    for p in processes:
+        p.join(10)
+
+    latencies = np.concatenate([seen - stamps[indices] for indices, seen, _, _, _ in collected] + [[]]) * 1000.0
+    if len(latencies) == 0:
+        latencies = np.array([np.nan])
+    return {
+        'us_per_frame': busy / len(messages) * 1e6,
+        'p50': np.percentile(latencies, 50),
+        'p99': np.percentile(latencies, 99),
+        'max': np.max(latencies),
+        'received': sum(len(indices) for indices, _, _, _, _ in collected),
+        'lost': sum(r[2] for r in collected),
+        'torn': sum(r[3] for r in collected),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, nargs='+', default=[1, 4], help='reader processes')
+    parser.add_argument('--rate', type=float, default=1024.0, help='eeg frames per second')
+    parser.add_argument('--seconds', type=float, default=5.0, help='length of each run')
+    parser.add_argument('--poll-us', type=float, default=200.0, help='sleep of an idle shared reader')
+    args = parser.parse_args()
+
+    telemetry.configure(sink=None)
+    messages = frames(int(args.seconds * args.rate))
+    print('{:<8}{:>8}{:>14}{:>10}{:>10}{:>10}{:>11}{:>7}{:>7}'.format(
+        'setup', 'readers', 'us / frame', 'p50 ms', 'p99 ms', 'max ms', 'received', 'lost', 'torn'))
+    runs = [('none', 0)] + [(setup, readers) for readers in args.readers for setup in ('shared', 'queue')]
+    for setup, readers in runs:
+        r = run(setup, readers, messages, args.rate, args.poll_us / 1e6)
+        print('{:<8}{:>8}{:>14.1f}{:>10.2f}{:>10.2f}{:>10.2f}{:>11}{:>7}{:>7}'.format(
+            setup, readers, r['us_per_frame'], r['p50'], r['p99'], r['max'], r['received'], r['lost'], r['torn']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""Per-packet cost of Cortex.handle_stream_data, before and after the decoder registry,
+and with the hot path metrics on.
+
+Each packet is timed twice: with a real pydispatch emit to a no-op
+listener, and with emit stubbed out, which leaves the decode step alone.
+The setups are timed in turn within every round and the fastest round is
+kept, so that a slow stretch of a shared machine does not land on one
+setup only. The registry is about column-aware decoders and typed
+events, not speed: its decode step creates a StreamEvent where the old
+chain built a dict, which is about as fast, and either is small next to
+the emit.
+
+Run from the repository root:
+    python benchmarks/bench_stream_decode.py [--number N] [--rounds R]
+"""
+import argparse
+import os
+import sys
+import timeit
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'EEG-HUNTER-INTERFACE'))
+
+import telemetry
+from cortex import Cortex
+
+
+EEG_COLS = ['COUNTER', 'INTERPOLATED', 'AF3', 'F7', 'F3', 'FC5', 'T7', 'P7', 'O1', 'O2',
+            'P8', 'T8', 'FC6', 'F4', 'F8', 'AF4', 'RAW_CQ', 'MARKER_HARDWARE', 'MARKERS']
+
+# one representative frame and the 'cols' of each stream
+FRAMES = {
+    'com': ({'com': ['left', 0.42], 'sid': 'sid', 'time': 1647525819.0223}, ['act', 'pow']),
+    'fac': ({'fac': ['neutral', 'surprise', 0.3, 'smile', 0.5], 'sid': 'sid', 'time': 1647525819.0223},
+            ['eyeAct', 'uAct', 'uPow', 'lAct', 'lPow']),
+    'eeg': ({'eeg': [1.0] * (len(EEG_COLS) - 1) + [[]], 'sid': 'sid', 'time': 1647525819.0223}, EEG_COLS),
+    'mot': ({'mot': [1.0] * 12, 'sid': 'sid', 'time': 1647525819.0223}, ['COUNTER_MEMS'] + ['Q'] * 11),
+    'dev': ({'dev': [4, 2, [4, 4, 4, 4, 4], 90], 'sid': 'sid', 'time': 1647525819.0223},
+            ['Battery', 'Signal', ['AF3', 'T7', 'Pz', 'T8', 'AF4'], 'BatteryPercent']),
+    'met': ({'met': [True, 0.5] * 6, 'sid': 'sid', 'time': 1647525819.0223}, ['eng.isActive', 'eng'] * 6),
+    'pow': ({'pow': [1.0] * 70, 'sid': 'sid', 'time': 1647525819.0223}, ['AF3/theta'] * 70),
+    'sys': ({'sys': ['mentalCommand', 'MC_Succeeded'], 'sid': 'sid', 'time': 1647525819.0223}, []),
+}
+
+
+def legacy_handle_stream_data(self, result_dic):
+    # handle_stream_data as it was before the decoder registry
+    if result_dic.get('com') != None:
+        com_data = {}
+        com_data['action'] = result_dic['com'][0]
+        com_data['power'] = result_dic['com'][1]
+        com_data['time'] = result_dic['time']
+        self.emit('new_com_data', data=com_data)
+    elif result_dic.get('fac') != None:
+        fe_data = {}
+        fe_data['eyeAct'] = result_dic['fac'][0]
+        fe_data['uAct'] = result_dic['fac'][1]
+        fe_data['uPow'] = result_dic['fac'][2]
+        fe_data['lAct'] = result_dic['fac'][3]
+        fe_data['lPow'] = result_dic['fac'][4]
+        fe_data['time'] = result_dic['time']
+        self.emit('new_fe_data', data=fe_data)
+    elif result_dic.get('eeg') != None:
+        eeg_data = {}
+        eeg_data['eeg'] = result_dic['eeg']
+        eeg_data['eeg'].pop()
+        eeg_data['time'] = result_dic['time']
+        self.emit('new_eeg_data', data=eeg_data)
+    elif result_dic.get('mot') != None:
+        mot_data = {}
+        mot_data['mot'] = result_dic['mot']
+        mot_data['time'] = result_dic['time']
+        self.emit('new_mot_data', data=mot_data)
+    elif result_dic.get('dev') != None:
+        dev_data = {}
+        dev_data['signal'] = result_dic['dev'][1]
+        dev_data['dev'] = result_dic['dev'][2]
+        dev_data['batteryPercent'] = result_dic['dev'][3]
+        dev_data['time'] = result_dic['time']
+        self.emit('new_dev_data', data=dev_data)
+    elif result_dic.get('met') != None:
+        met_data = {}
+        met_data['met'] = result_dic['met']
+        met_data['time'] = result_dic['time']
+        self.emit('new_met_data', data=met_data)
+    elif result_dic.get('pow') != None:
+        pow_data = {}
+        pow_data['pow'] = result_dic['pow']
+        pow_data['time'] = result_dic['time']
+        self.emit('new_pow_data', data=pow_data)
+    elif result_dic.get('sys') != None:
+        sys_data = result_dic['sys']
+        self.emit('new_sys_data', data=sys_data)
+    else:
+        print(result_dic)
+
+
+def per_packet_us(handlers, frame, stream_name, number, rounds):
+    # the eeg decoder pops the marker column, so every call gets a fresh list
+    values = frame[stream_name]
+    def timer(handler):
+        def run():
+            result_dic = dict(frame)
+            result_dic[stream_name] = list(values)
+            handler(result_dic)
+        return timeit.Timer(run)
+    def copy_only():
+        result_dic = dict(frame)
+        result_dic[stream_name] = list(values)
+    timers = [timer(handler) for handler in handlers] + [timeit.Timer(copy_only)]
+    best = [float('inf')] * len(timers)
+    for _ in range(rounds):
+        for n, t in enumerate(timers):
+            best[n] = min(best[n], t.timeit(number))
+    overhead = best.pop()
+    return [(total - overhead) / number * 1e6 for total in best]
+
+
+def stub_emit(name, *args, **kwargs):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=20000, help='packets per timing run')
+    parser.add_argument('--rounds', type=int, default=15, help='timing runs per setup, the fastest is kept')
+    args = parser.parse_args()
+
+    telemetry.configure(sink=None)
+    # before/after without the hot path metrics, plus the same client with them
+    c = Cortex('bench_client_id', 'bench_client_secret', metrics=False)
+    m = Cortex('bench_client_id', 'bench_client_secret', metrics=True)
+    # and the decode step alone, the emit of both paths stubbed out
+    d = Cortex('bench_client_id', 'bench_client_secret', metrics=False)
+    d.emit = stub_emit
+    # a listener per stream, so both paths pay for a real dispatch. pydispatch
+    # only keeps weak references, so the listener must outlive the loop
+    def listener(*args, **kwargs):
+        pass
+    events = {event: listener
+              for event in ('new_com_data', 'new_fe_data', 'new_eeg_data', 'new_mot_data',
+                            'new_dev_data', 'new_met_data', 'new_pow_data', 'new_sys_data')}
+    c.bind(**events)
+    m.bind(**events)
+    legacy = types.MethodType(legacy_handle_stream_data, c)
+    legacy_decode = types.MethodType(legacy_handle_stream_data, d)
+
+    print('{:<6}{:>14}{:>14}{:>14}{:>14}{:>14}{:>14}'.format(
+        'stream', 'before (us)', 'after (us)', 'after/before', 'metrics (us)', 'decode before', 'decode after'))
+    for stream_name, (frame, cols) in FRAMES.items():
+        c.register_stream_decoder(stream_name, cols)
+        m.register_stream_decoder(stream_name, cols)
+        d.register_stream_decoder(stream_name, cols)
+        before, after, with_metrics, decode_before, decode_after = per_packet_us(
+            [legacy, c.handle_stream_data, m.handle_stream_data, legacy_decode, d.handle_stream_data],
+            frame, stream_name, args.number, args.rounds)
+        print('{:<6}{:>14.3f}{:>14.3f}{:>13.2f}x{:>14.3f}{:>14.3f}{:>14.3f}'.format(
+            stream_name, before, after, after / before, with_metrics, decode_before, decode_after))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""Memory held by the 'new_*_data' events of a session, dicts before and slotted events after.
+
+Every stream is generated at its EPOC+ rate with the mock Cortex, serialized
+to JSON and parsed again frame by frame, as the client does live. Each
+decoded event is kept, like a listener that stores the session, and
+tracemalloc measures everything the kept events hold: the event itself, the
+sample values and, for com and fac, the action names. The per-packet decode
+time is printed as well: building a slotted event costs more than a dict
+literal.
+
+Run from the repository root:
+    python benchmarks/bench_stream_memory.py [--seconds 60] [--number 100000]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'EEG-HUNTER-INTERFACE'))
+
+import telemetry
+from cortex import STREAM_DECODER_FACTORIES
+from mock_cortex import DEFAULT_RATES, STREAM_COLS, MockCortex
+
+
+# Cortex sends the facial expression stream at 32 Hz; the mock does not serve it
+FAC_RATE = 32
+FAC_COLS = ['eyeAct', 'uAct', 'uPow', 'lAct', 'lPow']
+EYE_ACTIONS = ['neutral', 'blink', 'winkL', 'winkR', 'horiEye']
+UPPER_ACTIONS = ['neutral', 'surprise', 'frown']
+LOWER_ACTIONS = ['neutral', 'smile', 'clench', 'laugh', 'smirkLeft', 'smirkRight']
+
+
+# the decoders as they were before the slotted events: a new dict per packet
+def legacy_com_decoder(emit, cols):
+    def decode(result_dic):
+        com = result_dic['com']
+        emit('new_com_data', data={'action': com[0], 'power': com[1], 'time': result_dic['time']})
+    return decode
+
+def legacy_fac_decoder(emit, cols):
+    def decode(result_dic):
+        fac = result_dic['fac']
+        emit('new_fe_data', data={'eyeAct': fac[0], 'uAct': fac[1], 'uPow': fac[2],
+                                  'lAct': fac[3], 'lPow': fac[4], 'time': result_dic['time']})
+    return decode
+
+def legacy_eeg_decoder(emit, cols):
+    def decode(result_dic):
+        eeg = result_dic['eeg']
+        eeg.pop()
+        emit('new_eeg_data', data={'eeg': eeg, 'time': result_dic['time']})
+    return decode
+
+def legacy_dev_decoder(emit, cols):
+    def decode(result_dic):
+        dev = result_dic['dev']
+        emit('new_dev_data', data={'signal': dev[1], 'dev': dev[2], 'batteryPercent': dev[3],
+                                   'time': result_dic['time']})
+    return decode
+
+def legacy_passthrough_decoder(stream_name):
+    def factory(emit, cols):
+        def decode(result_dic):
+            emit('new_' + stream_name + '_data', data={stream_name: result_dic[stream_name],
+                                                       'time': result_dic['time']})
+        return decode
+    return factory
+
+LEGACY_DECODER_FACTORIES = {
+    'com': legacy_com_decoder,
+    'fac': legacy_fac_decoder,
+    'eeg': legacy_eeg_decoder,
+    'dev': legacy_dev_decoder,
+    'mot': legacy_passthrough_decoder('mot'),
+    'met': legacy_passthrough_decoder('met'),
+    'pow': legacy_passthrough_decoder('pow'),
+}
+
+
+def make_frames(stream_name, seconds, seed):
+    # JSON text of every frame of the session, parsed again when decoded
+    mock = MockCortex(seed=seed)
+    if stream_name == 'fac':
+        rate = FAC_RATE
+        rnd = mock.random
+        make = lambda n: [rnd.choice(EYE_ACTIONS), rnd.choice(UPPER_ACTIONS), round(rnd.random(), 2),
+                          rnd.choice(LOWER_ACTIONS), round(rnd.random(), 2)]
+    else:
+        rate = DEFAULT_RATES[stream_name]
+        make = getattr(mock, 'make_' + stream_name)
+    count = max(1, int(rate * seconds))
+    return rate, [json.dumps({stream_name: make(n), 'sid': 'bench', 'time': n / rate}) for n in range(count)]
+
+
+def held_bytes(factory, stream_name, frames):
+    # bytes held by the events of all frames
+    cols = FAC_COLS if stream_name == 'fac' else STREAM_COLS[stream_name]
+    events = []
+    def emit(event_name, data):
+        events.append(data)
+    decode = factory(emit, cols)
+
+    gc.collect()
+    tracemalloc.start()
+    for frame in frames:
+        decode(json.loads(frame))
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return held
+
+
+def per_packet_us(factory, stream_name, frame, number):
+    cols = FAC_COLS if stream_name == 'fac' else STREAM_COLS[stream_name]
+    def emit(event_name, data):
+        pass
+    decode = factory(emit, cols)
+    parsed = json.loads(frame)
+    values = parsed[stream_name]
+    def run():
+        result_dic = dict(parsed)
+        result_dic[stream_name] = list(values)
+        decode(result_dic)
+    def copy_only():
+        result_dic = dict(parsed)
+        result_dic[stream_name] = list(values)
+    total = min(timeit.repeat(run, number=number, repeat=5))
+    overhead = min(timeit.repeat(copy_only, number=number, repeat=5))
+    return (total - overhead) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=60.0, help='length of the session')
+    parser.add_argument('--number', type=int, default=100000, help='packets per timing run')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    telemetry.configure(sink=None)
+    print('{:<6}{:>6}{:>9}{:>13}{:>13}{:>9}{:>12}{:>12}'.format(
+        'stream', 'Hz', 'events', 'dict B/ev', 'slots B/ev', 'saved', 'dict us', 'slots us'))
+    total_before = total_after = 0
+    for stream_name in ('com', 'fac', 'eeg', 'pow', 'mot', 'met', 'dev'):
+        rate, frames = make_frames(stream_name, args.seconds, args.seed)
+        before = held_bytes(LEGACY_DECODER_FACTORIES[stream_name], stream_name, frames)
+        after = held_bytes(STREAM_DECODER_FACTORIES[stream_name], stream_name, frames)
+        total_before += before
+        total_after += after
+        before_us = per_packet_us(LEGACY_DECODER_FACTORIES[stream_name], stream_name, frames[0], args.number)
+        after_us = per_packet_us(STREAM_DECODER_FACTORIES[stream_name], stream_name, frames[0], args.number)
+        print('{:<6}{:>6g}{:>9d}{:>13.1f}{:>13.1f}{:>8.0f}%{:>12.3f}{:>12.3f}'.format(
+            stream_name, rate, len(frames), before / len(frames), after / len(frames),
+            100.0 * (before - after) / before, before_us, after_us))
+
+    print('events of {0:g} s of all streams: {1:.1f} KiB as dicts, {2:.1f} KiB as slotted events'.format(
+        args.seconds, total_before / 1024.0, total_after / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Cold vs warm Cortex startup time, with and without a cached cortexToken.
+
+The Cortex service is simulated in process: every request is answered after a
+fixed round-trip time, so the result shows how many round trips the prepare
+steps take and what they cost at that latency.
+
+Run from the repository root:
+    python benchmarks/bench_token_cache.py [--rtt-ms MS] [--runs N]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'EEG-HUNTER-INTERFACE'))
+
+import telemetry
+from cortex import Cortex
+
+
+RESULTS = {
+    'hasAccessRight': {'accessGranted': True, 'message': ''},
+    'authorize': {'cortexToken': 'bench-token'},
+    'queryHeadsets': [{'id': 'INSIGHT-BENCH', 'status': 'connected', 'connectedBy': 'dongle'}],
+    'createSession': {'id': 'bench-session'},
+}
+
+
+class LoopbackSocket():
+    # stands in for the websocket: answers each request after rtt seconds
+    def __init__(self, cortex, rtt):
+        self.cortex = cortex
+        self.rtt = rtt
+        self.requests = []
+
+    def send(self, message):
+        request = json.loads(message)
+        self.requests.append(request['method'])
+        response = json.dumps({'jsonrpc': '2.0', 'id': request['id'], 'result': RESULTS[request['method']]})
+        timer = threading.Timer(self.rtt, self.cortex.on_message, args=(self, response))
+        timer.daemon = True
+        timer.start()
+
+    def close(self):
+        pass
+
+
+def startup(cache_path, rtt):
+    c = Cortex('bench_client_id', 'bench_client_secret', token_cache=cache_path)
+    c.ws = LoopbackSocket(c, rtt)
+    start = time.perf_counter()
+    c.on_open(c.ws)
+    if not c.session_ready.wait(10):
+        raise RuntimeError('no session after 10 s')
+    return time.perf_counter() - start, c.ws.requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rtt-ms', type=float, default=20.0, help='simulated round-trip time per request')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    telemetry.configure(sink=None)
+    rtt = args.rtt_ms / 1000.0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_path = os.path.join(tmp, 'token_cache.json')
+        results = {}
+        for name in ('cold', 'warm'):
+            times = []
+            for _ in range(args.runs):
+                if name == 'cold' and os.path.exists(cache_path):
+                    os.remove(cache_path)
+                elapsed, requests = startup(cache_path, rtt)
+                times.append(elapsed)
+            results[name] = (min(times), sorted(times)[len(times) // 2], requests)
+
+    print('round-trip time: {:.1f} ms'.format(args.rtt_ms))
+    for name, (best, median, requests) in results.items():
+        print('{:<5} best {:7.1f} ms  median {:7.1f} ms  {} requests: {}'.format(
+            name, best * 1000, median * 1000, len(requests), ' -> '.join(requests)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,544 @@
+"""A local mock of the Emotiv Cortex service, for load and integration testing.
+
+It answers the JSON-RPC methods the Cortex client uses and, once subscribed,
+synthesizes com, eeg, pow, mot, met and dev streams at configurable rates, far
+above what a real headset produces. Faults can be injected: slow, dropped or
+failing responses, a headset that takes a while to connect, expiring tokens,
+dropped connections and CORTEX_STOP_ALL_STREAMS warnings. Several headsets
+can be served, each with its own session on the same connection.
+
+The mock speaks plain ws://, point the client at it with the url keyword:
+    Cortex(client_id, client_secret, url='ws://localhost:6868')
+
+Run from the repository root:
+    python benchmarks/mock_cortex.py [--port 6868] [--rate eeg=2048 --rate com=64] [--drop-rate 0.1] ...
+
+or start it in process with MockCortex(...).start_in_thread().
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+import websockets #'pip install websockets' for install
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'EEG-HUNTER-INTERFACE'))
+
+from cortex import (CORTEX_STOP_ALL_STREAMS, HEADSET_CONNECTED, ERR_INVALID_CORTEX_TOKEN,
+                    ERR_CORTEX_TOKEN_EXPIRED)
+
+
+HEADSET_ID = 'EPOCPLUS-MOCK0001'
+EEG_CHANNELS = ['AF3', 'F7', 'F3', 'FC5', 'T7', 'P7', 'O1', 'O2', 'P8', 'T8', 'FC6', 'F4', 'F8', 'AF4']
+BANDS = ['theta', 'alpha', 'betaL', 'betaH', 'gamma']
+
+STREAM_COLS = {
+    'com': ['act', 'pow'],
+    'eeg': ['COUNTER', 'INTERPOLATED'] + EEG_CHANNELS + ['RAW_CQ', 'MARKER_HARDWARE', 'MARKERS'],
+    'pow': ['{0}/{1}'.format(ch, band) for ch in EEG_CHANNELS for band in BANDS],
+    'mot': ['COUNTER_MEMS', 'INTERPOLATED_MEMS', 'Q0', 'Q1', 'Q2', 'Q3', 'ACCX', 'ACCY', 'ACCZ', 'MAGX', 'MAGY', 'MAGZ'],
+    'met': ['eng.isActive', 'eng', 'exc.isActive', 'exc', 'lex', 'str.isActive', 'str', 'rel.isActive', 'rel',
+            'int.isActive', 'int', 'foc.isActive', 'foc'],
+    'dev': ['Battery', 'Signal', EEG_CHANNELS + ['OVERALL'], 'BatteryPercent'],
+}
+
+# samples per second of a real EPOC+
+DEFAULT_RATES = {'com': 8, 'eeg': 128, 'pow': 8, 'mot': 64, 'met': 2, 'dev': 2}
+
+# the blinks in the synthetic 'eeg': one every BLINK_PERIOD s for BLINK_DURATION s,
+# peaking at BLINK_AMPLITUDE uV on AF3 and AF4
+BLINK_PERIOD = 4.0
+BLINK_DURATION = 0.25
+BLINK_AMPLITUDE = 150.0
+
+# shortest sleep of a stream task, faster streams send several samples per wakeup
+MIN_TICK = 0.002
+
+# JSON-RPC error returned by error_rate
+ERR_INTERNAL = -32603
+
+
+class MockError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class MockConnection():
+    # state of one client connection
+    def __init__(self, ws):
+        self.ws = ws
+        self.sessions = {}
+        self.tasks = []
+        self.loaded_profiles = {}
+        self.headset_queries = 0
+
+
+class MockSession():
+    # state of one session of a connection
+    def __init__(self, connection, session_id, headset_id):
+        self.connection = connection
+        self.ws = connection.ws
+        self.session_id = session_id
+        self.headset_id = headset_id
+        self.streams = {}
+        self.tasks = connection.tasks
+        self.record = None
+
+
+class MockCortex():
+    """
+    A mock Cortex service.
+
+    Parameters
+    ----------
+    rates : dict, optional
+        samples per second of each stream, merged into DEFAULT_RATES
+    profiles : list, optional
+        names of the existing profiles
+    latency : float, optional
+        seconds before each response is sent
+    drop_rate : float, optional
+        fraction of requests that are never answered
+    error_rate : float, optional
+        fraction of requests answered with a JSON-RPC error
+    connecting_queries : int, optional
+        number of queryHeadsets answered with status 'connecting' before the
+        headset connects and HEADSET_CONNECTED is sent
+    token_ttl : float, optional
+        seconds after which a cortexToken is rejected as expired, 0 for never
+    disconnect_after : float, optional
+        seconds after createSession to drop the connection, 0 for never
+    stop_streams_after : float, optional
+        seconds after subscribe to send CORTEX_STOP_ALL_STREAMS and stop the
+        streams, 0 for never
+    headsets : int, optional
+        number of headsets, HEADSET_ID and the next ids
+    seed : int, optional
+        seed of the synthesized data and of the injected faults
+
+    Attributes
+    ----------
+    sent : dict
+        number of samples sent per stream
+    requests : dict
+        number of requests received per method
+    """
+    def __init__(self, rates=None, profiles=(), latency=0.0, drop_rate=0.0, error_rate=0.0,
+                 connecting_queries=0, token_ttl=0.0, disconnect_after=0.0, stop_streams_after=0.0, seed=0,
+                 headsets=1):
+        self.rates = dict(DEFAULT_RATES)
+        self.rates.update(rates or {})
+        self.profiles = set(profiles)
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.error_rate = error_rate
+        self.connecting_queries = connecting_queries
+        self.token_ttl = token_ttl
+        self.disconnect_after = disconnect_after
+        self.stop_streams_after = stop_streams_after
+        self.random = random.Random(seed)
+        self._com_peak = 0.0
+        self.headset_ids = [HEADSET_ID[:-4] + '{:04d}'.format(int(HEADSET_ID[-4:]) + n) for n in range(headsets)]
+
+        self.sent = dict.fromkeys(STREAM_COLS, 0)
+        self.requests = {}
+        self.tokens = {}
+        self.ids = itertools.count(1)
+        self.port = None
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+        self.methods = {
+            'getCortexInfo': self.get_cortex_info,
+            'hasAccessRight': self.access_right,
+            'requestAccess': self.access_right,
+            'authorize': self.authorize,
+            'queryHeadsets': self.query_headsets,
+            'controlDevice': self.control_device,
+            'createSession': self.create_session,
+            'updateSession': self.update_session,
+            'subscribe': self.subscribe,
+            'unsubscribe': self.unsubscribe,
+            'queryProfile': self.query_profile,
+            'getCurrentProfile': self.get_current_profile,
+            'setupProfile': self.setup_profile,
+            'mentalCommandActiveAction': self.mc_active_action,
+            'mentalCommandActionSensitivity': self.mc_action_sensitivity,
+            'mentalCommandBrainMap': self.mc_brain_map,
+            'mentalCommandTrainingThreshold': self.mc_training_threshold,
+            'training': self.training,
+            'createRecord': self.create_record,
+            'stopRecord': self.stop_record,
+            'exportRecord': self.export_record,
+            'injectMarker': self.inject_marker,
+            'updateMarker': self.update_marker,
+        }
+
+    # server
+    async def serve(self, host='localhost', port=6868, ready=None):
+        async with websockets.serve(self.handler, host, port, max_size=None) as server:
+            self._server = server
+            self.port = next(iter(server.sockets)).getsockname()[1]
+            print('mock Cortex listening on ws://{0}:{1}'.format(host, self.port))
+            if ready is not None:
+                ready.set()
+            await server.wait_closed()
+
+    def start_in_thread(self, host='localhost', port=0):
+        """
+        To run the service on a daemon thread, e.g. inside a benchmark.
+
+        Returns
+        -------
+        str
+            ws:// url to pass to Cortex
+        """
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.serve(host, port, ready))
+
+        self._thread = threading.Thread(target=run, name='MockCortex', daemon=True)
+        self._thread.start()
+        if not ready.wait(10):
+            raise RuntimeError('mock Cortex did not start')
+        return 'ws://{0}:{1}'.format(host, self.port)
+
+    def stop(self):
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._thread.join(5)
+
+    async def handler(self, ws, path=None):
+        connection = MockConnection(ws)
+        try:
+            async for message in ws:
+                request = json.loads(message)
+                method = request.get('method')
+                self.requests[method] = self.requests.get(method, 0) + 1
+                if self.drop_rate and self.random.random() < self.drop_rate:
+                    continue
+                asyncio.ensure_future(self.respond(connection, request))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for task in connection.tasks:
+                task.cancel()
+
+    async def respond(self, connection, request):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        method = request.get('method')
+        params = request.get('params', {})
+        response = {'jsonrpc': '2.0', 'id': request.get('id')}
+        try:
+            if method not in self.methods:
+                raise MockError(-32601, 'Method not found: {}'.format(method))
+            if self.error_rate and self.random.random() < self.error_rate:
+                raise MockError(ERR_INTERNAL, 'Injected error.')
+            if 'cortexToken' in params:
+                self.check_token(params['cortexToken'])
+            response['result'] = self.methods[method](connection, params)
+        except MockError as e:
+            response.pop('result', None)
+            response['error'] = {'code': e.code, 'message': e.message}
+        await self.send(connection, response)
+
+    async def send(self, connection, message):
+        try:
+            await connection.ws.send(json.dumps(message))
+        except websockets.ConnectionClosed:
+            pass
+
+    def send_later(self, connection, delay, message):
+        asyncio.get_running_loop().call_later(delay, lambda: asyncio.ensure_future(self.send(connection, message)))
+
+    def check_token(self, token):
+        issued = self.tokens.get(token)
+        if issued is None:
+            raise MockError(ERR_INVALID_CORTEX_TOKEN, 'Invalid cortex token.')
+        if self.token_ttl and time.monotonic() - issued > self.token_ttl:
+            raise MockError(ERR_CORTEX_TOKEN_EXPIRED, 'The cortex token has expired.')
+
+    def find_session(self, connection, params):
+        session = connection.sessions.get(params.get('session'))
+        if session is None:
+            raise MockError(-32005, 'Session does not exist.')
+        return session
+
+    # JSON-RPC methods
+    def get_cortex_info(self, connection, params):
+        return {'buildDate': '', 'buildNumber': 'mock', 'version': 'mock'}
+
+    def access_right(self, connection, params):
+        return {'accessGranted': True, 'message': 'The user has granted access right to this application.'}
+
+    def authorize(self, connection, params):
+        token = 'mock-token-{}'.format(next(self.ids))
+        self.tokens[token] = time.monotonic()
+        return {'cortexToken': token}
+
+    def query_headsets(self, connection, params):
+        connection.headset_queries += 1
+        status = 'connected'
+        if connection.headset_queries <= self.connecting_queries:
+            status = 'connecting'
+            if connection.headset_queries == self.connecting_queries:
+                # connected right after this answer
+                for headset_id in self.headset_ids:
+                    self.send_later(connection, 0.05, {'jsonrpc': '2.0', 'warning': {
+                        'code': HEADSET_CONNECTED,
+                        'message': {'headsetId': headset_id, 'behavior': 'Headset connected.'}}})
+        return [{'id': headset_id, 'status': status, 'connectedBy': 'dongle', 'dongle': '6ff',
+                 'firmware': '625', 'motionSensors': STREAM_COLS['mot'][2:], 'sensors': EEG_CHANNELS,
+                 'settings': {'mode': 'EPOCPLUS', 'eegRate': self.rates['eeg'], 'eegRes': 16,
+                              'memsRate': self.rates['mot'], 'memsRes': 16}}
+                for headset_id in self.headset_ids]
+
+    def control_device(self, connection, params):
+        command = params.get('command')
+        return {'command': command, 'message': 'Mock ' + command + ' done.'}
+
+    def create_session(self, connection, params):
+        headset_id = params.get('headset') or HEADSET_ID
+        if headset_id not in self.headset_ids:
+            raise MockError(-32004, 'Headset {} is not available.'.format(headset_id))
+        for other in connection.sessions.values():
+            if other.headset_id == headset_id:
+                raise MockError(-32018, 'There is already a session for the headset {}.'.format(headset_id))
+        session = MockSession(connection, 'mock-session-{}'.format(next(self.ids)), headset_id)
+        connection.sessions[session.session_id] = session
+        if self.disconnect_after:
+            asyncio.get_running_loop().call_later(
+                self.disconnect_after, lambda: asyncio.ensure_future(connection.ws.close(1011, 'injected disconnect')))
+        return {'id': session.session_id, 'status': 'activated', 'owner': 'mock',
+                'headset': {'id': headset_id}}
+
+    def update_session(self, connection, params):
+        session = self.find_session(connection, params)
+        if params.get('status') == 'close':
+            self.stop_streams(session)
+            del connection.sessions[session.session_id]
+            return {'id': session.session_id, 'status': 'closed'}
+        return {'id': session.session_id, 'status': params.get('status')}
+
+    def subscribe(self, connection, params):
+        session = self.find_session(connection, params)
+        success, failure = [], []
+        for name in params.get('streams', []):
+            if name not in STREAM_COLS:
+                failure.append({'streamName': name, 'code': -32016, 'message': 'Invalid stream name.'})
+                continue
+            if name not in session.streams:
+                task = asyncio.ensure_future(self.run_stream(session, name, self.rates[name]))
+                session.streams[name] = task
+                session.tasks.append(task)
+            success.append({'streamName': name, 'cols': STREAM_COLS[name], 'sid': session.session_id})
+        if success and self.stop_streams_after:
+            self.send_later(connection, self.stop_streams_after, {'jsonrpc': '2.0', 'warning': {
+                'code': CORTEX_STOP_ALL_STREAMS,
+                'message': {'sessionId': session.session_id, 'behavior': 'All subscriptions were stopped.'}}})
+            asyncio.get_running_loop().call_later(self.stop_streams_after, self.end_session, session)
+        return {'success': success, 'failure': failure}
+
+    def unsubscribe(self, connection, params):
+        session = self.find_session(connection, params)
+        success = []
+        for name in params.get('streams', []):
+            task = session.streams.pop(name, None)
+            if task is not None:
+                task.cancel()
+            success.append({'streamName': name, 'message': 'Unsubscribe successfully'})
+        return {'success': success, 'failure': []}
+
+    def stop_streams(self, session):
+        for task in session.streams.values():
+            task.cancel()
+        session.streams.clear()
+
+    def end_session(self, session):
+        # after CORTEX_STOP_ALL_STREAMS the session is gone, a new one can be created for the headset
+        self.stop_streams(session)
+        session.connection.sessions.pop(session.session_id, None)
+
+    def query_profile(self, connection, params):
+        return [{'name': name, 'readOnly': False} for name in sorted(self.profiles)]
+
+    def get_current_profile(self, connection, params):
+        name = connection.loaded_profiles.get(params.get('headset'))
+        return {'name': name, 'loadedByThisApp': name is not None}
+
+    def setup_profile(self, connection, params):
+        action = params.get('status')
+        name = params.get('profile')
+        if action == 'create':
+            self.profiles.add(name)
+        elif action == 'load':
+            connection.loaded_profiles[params.get('headset')] = name
+        elif action == 'unload':
+            connection.loaded_profiles.pop(params.get('headset'), None)
+        return {'action': action, 'name': name, 'message': 'Mock ' + action + ' done.'}
+
+    def mc_active_action(self, connection, params):
+        if params.get('status') == 'set':
+            return {'action': 'set', 'message': 'Set active actions successfully.'}
+        return ['neutral', 'left']
+
+    def mc_action_sensitivity(self, connection, params):
+        if params.get('status') == 'set':
+            return {'action': 'set', 'message': 'Set sensitivity successfully.'}
+        return [7, 7, 5, 5]
+
+    def mc_brain_map(self, connection, params):
+        return [{'action': 'neutral', 'coordinates': [0.0, 0.0]}, {'action': 'left', 'coordinates': [1.0, 0.5]}]
+
+    def mc_training_threshold(self, connection, params):
+        return {'currentThreshold': 0.5, 'lastTrainingScore': 0.6}
+
+    def training(self, connection, params):
+        return {'action': params.get('detection'), 'status': params.get('status'), 'message': ''}
+
+    def create_record(self, connection, params):
+        session = self.find_session(connection, params)
+        record = {'uuid': 'mock-record-{}'.format(next(self.ids)), 'title': params.get('title', ''),
+                  'startDatetime': time.time()}
+        session.record = record
+        return {'record': record, 'sessionId': session.session_id}
+
+    def stop_record(self, connection, params):
+        session = self.find_session(connection, params)
+        record = dict(session.record or {'uuid': ''}, endDatetime=time.time())
+        return {'record': record, 'sessionId': session.session_id}
+
+    def export_record(self, connection, params):
+        return {'success': [{'recordId': r} for r in params.get('recordIds', [])], 'failure': []}
+
+    def inject_marker(self, connection, params):
+        return {'marker': {'uuid': 'mock-marker-{}'.format(next(self.ids)), 'type': 'instance',
+                           'label': params.get('label'), 'value': params.get('value'), 'startDatetime': time.time()}}
+
+    def update_marker(self, connection, params):
+        return {'marker': {'uuid': params.get('markerId'), 'type': 'interval', 'endDatetime': time.time()}}
+
+    # streams
+    async def run_stream(self, session, name, rate):
+        if rate <= 0:
+            return
+        make = getattr(self, 'make_' + name)
+        loop = asyncio.get_running_loop()
+        tick = max(1.0 / rate, MIN_TICK)
+        start = loop.time()
+        n = 0
+        try:
+            while True:
+                due = int((loop.time() - start) * rate) + 1 - n
+                for _ in range(due):
+                    frame = {name: make(n), 'sid': session.session_id, 'time': time.time()}
+                    await session.ws.send(json.dumps(frame))
+                    n += 1
+                self.sent[name] += due
+                await asyncio.sleep(tick)
+        except websockets.ConnectionClosed:
+            pass
+
+    def make_com(self, n):
+        # a burst of rising and falling power every 16 samples, then back to 0.0,
+        # the pattern the Peak-Value-Hook method decides on
+        phase = n % 16
+        if phase == 0:
+            self._com_peak = round(self.random.uniform(0.1, 1.0), 2)
+        if phase < 5:
+            power = round(self._com_peak * (1.0 - abs(phase - 2) / 3.0), 2)
+            return ['left', power]
+        return ['neutral', 0.0]
+
+    def make_eeg(self, n):
+        rate = self.rates['eeg']
+        t = n / rate
+        # a blink every BLINK_PERIOD s, strongest on the frontal channels
+        blink = 0.0
+        phase = t % BLINK_PERIOD
+        if phase < BLINK_DURATION:
+            blink = BLINK_AMPLITUDE * math.sin(math.pi * phase / BLINK_DURATION)
+        values = [n % 128, 0]
+        for idx, ch in enumerate(EEG_CHANNELS):
+            v = 4200.0 + 15.0 * math.sin(2 * math.pi * 10.0 * t + idx) + self.random.gauss(0.0, 5.0)
+            if ch in ('AF3', 'AF4'):
+                v += blink
+            elif ch in ('F7', 'F8'):
+                v += 0.5 * blink
+            values.append(round(v, 3))
+        values += [0, 0, []]
+        return values
+
+    def make_pow(self, n):
+        return [round(self.random.uniform(0.5, 5.0), 3) for _ in STREAM_COLS['pow']]
+
+    def make_mot(self, n):
+        values = [n % 128, 0, 1.0, 0.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0]
+        for idx in range(2, 12):
+            values[idx] = round(values[idx] + self.random.gauss(0.0, 0.01), 4)
+        return values
+
+    def make_met(self, n):
+        values = []
+        for col in STREAM_COLS['met']:
+            values.append(True if col.endswith('isActive') else round(self.random.uniform(0.0, 1.0), 3))
+        return values
+
+    def make_dev(self, n):
+        return [4, 1.0, [4] * (len(EEG_CHANNELS) + 1), 100]
+
+
+def parse_rates(values):
+    rates = {}
+    for value in values or []:
+        name, _, rate = value.partition('=')
+        if name not in STREAM_COLS:
+            raise argparse.ArgumentTypeError('unknown stream ' + name)
+        rates[name] = float(rate)
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6868)
+    parser.add_argument('--rate', action='append', metavar='STREAM=HZ',
+                        help='samples per second of a stream, e.g. --rate eeg=2048 (repeatable)')
+    parser.add_argument('--profile', action='append', default=[], help='existing profile name (repeatable)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before each response')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='fraction of requests not answered')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with an error')
+    parser.add_argument('--connecting-queries', type=int, default=0,
+                        help='queryHeadsets answered with "connecting" before the headset connects')
+    parser.add_argument('--token-ttl', type=float, default=0.0, help='seconds until a cortexToken expires')
+    parser.add_argument('--disconnect-after', type=float, default=0.0,
+                        help='seconds after createSession to drop the connection')
+    parser.add_argument('--stop-streams-after', type=float, default=0.0,
+                        help='seconds after subscribe to send CORTEX_STOP_ALL_STREAMS')
+    parser.add_argument('--headsets', type=int, default=1, help='number of headsets, each with its own session')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    mock = MockCortex(parse_rates(args.rate), args.profile, args.latency, args.drop_rate, args.error_rate,
+                      args.connecting_queries, args.token_ttl, args.disconnect_after, args.stop_streams_after,
+                      args.seed, args.headsets)
+    try:
+        asyncio.run(mock.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print('samples sent: {}'.format(mock.sent))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+import numpy as np
+
+from stream_events import BlinkEvent
+import telemetry
+
+
+# electrodes closest to the eyes, where a blink shows as a large positive deflection
+FRONTAL_CHANNELS = ('AF3', 'AF4', 'F7', 'F8')
+
+
+class BlinkDetector():
+    """
+    Finds eye blinks in the raw 'eeg' stream, as a faster control input than
+    the 'com' power, which only falls back to 0.0 once the Cortex detection
+    has decayed.
+
+    The frontal channels are averaged after subtracting their mean over the
+    last baseline seconds. A blink is an excursion of that signal above
+    release_ratio * amplitude_threshold which
+        - reaches amplitude_threshold (uV) while rising faster than
+          slope_threshold (uV/s), so that slow drifts are not blinks,
+        - lasts between min_duration and max_duration seconds,
+        - starts at least refractory seconds after the previous blink ended.
+    It is reported as soon as the signal falls back below the release level,
+    as a BlinkEvent passed to on_blink and, once bound, emitted as the
+    'blink' event of the Cortex or CortexSession.
+
+    The thresholds depend on the sampling rate of the headset, which is
+    taken from the headset settings of the bound session, or else from
+    sampling_rate. Without either, set_labels() raises ValueError, and a
+    bound detector logs the error and ignores the stream.
+
+    A block of samples is handled with array operations: the baseline from
+    a cumulative sum, the slope and the thresholds for all samples at once.
+
+    Attributes
+    ----------
+    labels : list
+        'eeg' column labels, as emitted by extract_data_labels
+    sampling_rate : float
+        samples per second of the 'eeg' stream, None until known
+    channels : list
+        frontal channels found in labels
+    count : int
+        blinks reported
+
+    Methods
+    -------
+    append(time, values):
+        To add one 'eeg' sample
+    append_block(times, samples):
+        To add a block of 'eeg' samples
+    bind(cortex):
+        To follow the 'eeg' stream of a Cortex and emit its 'blink' events
+    set_sampling_rate(rate):
+        To set the samples per second of the 'eeg' stream
+    reset():
+        To drop the baseline and any blink in progress
+    """
+    def __init__(self, labels=None, sampling_rate=None, channels=FRONTAL_CHANNELS,
+                 amplitude_threshold=50.0, slope_threshold=500.0, release_ratio=0.5, baseline=2.0,
+                 min_duration=0.05, max_duration=0.5, refractory=0.25, on_blink=None):
+        self.wanted_channels = tuple(channels)
+        self.amplitude_threshold = amplitude_threshold
+        self.slope_threshold = slope_threshold
+        self.release = release_ratio * amplitude_threshold
+        self.baseline = baseline
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.refractory = refractory
+        self.on_blink = on_blink
+        self.count = 0
+        self.session = None
+        self.log = telemetry.get_logger('blink')
+
+        self.labels = None
+        self.sampling_rate = None
+        if sampling_rate is not None:
+            self.set_sampling_rate(sampling_rate)
+        if labels is not None:
+            self.set_labels(labels)
+
+    def set_sampling_rate(self, rate):
+        """
+        To set the samples per second of the 'eeg' stream, which the baseline
+        length and the slope depend on. A blink in progress is dropped.
+
+        Returns
+        -------
+        None
+        """
+        if rate <= 0:
+            raise ValueError('The sampling rate must be positive.')
+        self.sampling_rate = float(rate)
+        self.baseline_samples = max(1, int(round(self.baseline * self.sampling_rate)))
+        if self.labels is not None:
+            self.reset()
+
+    def set_labels(self, labels):
+        """
+        To (re)configure the detector for the columns of the 'eeg' stream, e.g.
+        the labels of a 'new_data_labels' event.
+
+        Returns
+        -------
+        None
+        """
+        if self.sampling_rate is None:
+            raise ValueError('The sampling rate of the eeg stream is unknown, pass sampling_rate=... '
+                             'or bind the detector to a session whose headset reports it.')
+        self.labels = list(labels)
+        idx = [self.labels.index(ch) for ch in self.wanted_channels if ch in self.labels]
+        if not idx:
+            raise ValueError('None of the channels {} in the labels.'.format(', '.join(self.wanted_channels)))
+        self.channels = [self.labels[i] for i in idx]
+        self._channel_idx = np.array(idx)
+        self._channel_list = idx
+        self.reset()
+
+    def reset(self):
+        # channel mean of the last baseline_samples samples, as a ring with its running sum
+        self._ring = np.zeros(self.baseline_samples)
+        self._ring_idx = 0
+        self._filled = 0
+        self._sum = 0.0
+        # the last two values of the signal, for the slope
+        self._last = (0.0, 0.0)
+        # excursion in progress
+        self._start = None
+        self._peak = 0.0
+        self._qualified = False
+        self._last_end = -np.inf
+
+    def append(self, time, values):
+        """
+        To add one sample. Handled without array operations, so that a
+        blink is reported as soon as the sample that ends it arrives.
+
+        Parameters
+        ----------
+        time : float, required
+            Cortex time of the sample
+        values : list, required
+            one 'eeg' sample with all columns of labels
+
+        Returns
+        -------
+        None
+        """
+        raw = sum([values[i] for i in self._channel_list]) / len(self._channel_list)
+        n = self.baseline_samples
+        ready = self._filled == n
+        if ready:
+            signal = raw - self._sum / n
+            self._sum += raw - self._ring[self._ring_idx]
+        else:
+            self._sum += raw
+            self._filled += 1
+        self._ring[self._ring_idx] = raw
+        self._ring_idx = (self._ring_idx + 1) % n
+        if self._ring_idx == 0:
+            # drop the rounding errors the running sum has picked up
+            self._sum = float(self._ring.sum())
+        if not ready:
+            return
+
+        slope = (signal - self._last[0]) * (self.sampling_rate / 2.0)
+        self._last = (self._last[1], signal)
+        if signal >= self.release:
+            if self._start is None:
+                self._start = time
+                self._peak = signal
+                self._qualified = False
+            elif signal > self._peak:
+                self._peak = signal
+            if signal >= self.amplitude_threshold and slope >= self.slope_threshold:
+                self._qualified = True
+        elif self._start is not None:
+            self._finish(time)
+
+    def append_block(self, times, samples):
+        """
+        To add a block of samples, e.g. of a 'new_eeg_block' event.
+
+        Parameters
+        ----------
+        times : numpy array, required
+            Cortex time of each sample, shape (n,)
+        samples : numpy array, required
+            shape (n, len(labels))
+
+        Returns
+        -------
+        None
+        """
+        if len(times) == 0:
+            return
+        times = np.asarray(times)
+        raw = np.asarray(samples, dtype=np.float64)[:, self._channel_idx].mean(axis=1)
+        n = self.baseline_samples
+
+        # the mean of the n samples before each sample, from a cumulative sum
+        if self._filled < n:
+            history = self._ring[:self._filled]
+        else:
+            history = np.concatenate((self._ring[self._ring_idx:], self._ring[:self._ring_idx]))
+        h = len(history)
+        joined = np.concatenate((history, raw))
+        total = np.concatenate(((0.0,), np.cumsum(joined)))
+        tail = joined[-n:]
+        self._filled = len(tail)
+        self._ring[:self._filled] = tail
+        self._ring_idx = self._filled % n
+        self._sum = float(tail.sum())
+
+        # samples without a full baseline before them are skipped
+        first = max(0, n - h)
+        if first >= len(raw):
+            return
+        ends = np.arange(h + first, h + len(raw))
+        signal = raw[first:] - (total[ends] - total[ends - n]) / n
+        times = times[first:]
+
+        # slope over two samples, which is less noisy than the sample-to-sample difference
+        padded = np.concatenate((self._last, signal))
+        slope = (padded[2:] - padded[:-2]) * (self.sampling_rate / 2.0)
+        self._last = (float(padded[-2]), float(padded[-1]))
+        rising = (signal >= self.amplitude_threshold) & (slope >= self.slope_threshold)
+
+        above = signal >= self.release
+        prev = np.concatenate(((self._start is not None,), above[:-1]))
+        ups = np.flatnonzero(above & ~prev)
+        downs = np.flatnonzero(~above & prev)
+
+        # only the start and end of each excursion are handled one by one
+        pos = 0
+        count = len(signal)
+        while True:
+            if self._start is None:
+                ups = ups[ups >= pos]
+                if not len(ups):
+                    return
+                pos = int(ups[0])
+                self._start = times[pos]
+                self._peak = -np.inf
+                self._qualified = False
+            downs = downs[downs >= pos]
+            end = int(downs[0]) if len(downs) else count
+            if end > pos:
+                self._peak = max(self._peak, float(signal[pos:end].max()))
+                self._qualified = self._qualified or bool(rising[pos:end].any())
+            if end == count:
+                # still above the release level at the end of the block
+                return
+            self._finish(times[end])
+            pos = end
+
+    def _finish(self, end_time):
+        start = self._start
+        self._start = None
+        duration = end_time - start
+        if (not self._qualified or duration < self.min_duration or duration > self.max_duration
+                or start < self._last_end + self.refractory):
+            return
+        self._last_end = end_time
+        self.count += 1
+        event = BlinkEvent(float(end_time), float(start), float(duration), float(self._peak))
+        if self.on_blink is not None:
+            self.on_blink(event)
+        if self.session is not None:
+            self.session.emit('blink', data=event)
+
+    def bind(self, cortex):
+        """
+        To follow the 'eeg' stream of cortex, a Cortex or CortexSession: the
+        labels are taken from its 'new_data_labels' event, the sampling rate
+        from its headset settings, and the samples from 'new_eeg_block' if the
+        stream is batched, 'new_eeg_data' otherwise. Blinks are emitted as its
+        'blink' event, e.g. cortex.bind(blink=on_blink). Cortex only keeps
+        weak references to the listeners, so keep a reference to the detector.
+
+        Returns
+        -------
+        None
+        """
+        self.session = cortex
+        cortex.bind(new_data_labels=self.on_new_data_labels,
+                    new_eeg_data=self.on_new_eeg_data,
+                    new_eeg_block=self.on_new_eeg_block)
+
+    def on_new_data_labels(self, *args, **kwargs):
+        data = kwargs.get('data')
+        if data['streamName'] != 'eeg':
+            return
+        rate = self.session.get_sampling_rate('eeg') if self.session is not None else None
+        if rate is not None and rate != self.sampling_rate:
+            self.set_sampling_rate(rate)
+        if data['labels'] == self.labels:
+            return
+        try:
+            self.set_labels(data['labels'])
+        except ValueError as e:
+            # raised in a listener it would only end up in the websocket thread's
+            # error log: report it once and ignore the samples instead
+            self.labels = None
+            self.log.error('blink detector disabled', error=str(e))
+
+    def on_new_eeg_data(self, *args, **kwargs):
+        data = kwargs.get('data')
+        if self.labels is not None:
+            self.append(data.time, data.eeg)
+
+    def on_new_eeg_block(self, *args, **kwargs):
+        data = kwargs.get('data')
+        if self.labels is not None:
+            self.append_block(data['time'], data['eeg'])
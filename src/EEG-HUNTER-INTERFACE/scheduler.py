@@ -0,0 +1,98 @@
+import heapq
+import itertools
+import threading
+import time
+
+import telemetry
+
+
+class TimerHandle():
+    """
+    A callback scheduled by Scheduler.call_later. cancel() stops it from running.
+    """
+    __slots__ = ('when', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler():
+    """
+    Runs delayed callbacks on one background thread, like asyncio's call_later,
+    so that retries and timeouts never sleep on the websocket thread.
+
+    Callbacks run one after another on the scheduler thread and should be
+    short. The thread is a daemon and starts with the first call_later().
+
+    Methods
+    -------
+    call_later(delay, callback, *args):
+        To run callback(*args) after delay seconds
+    stop():
+        To stop the scheduler thread. Pending callbacks are dropped
+    """
+    def __init__(self, name='CortexScheduler'):
+        self.name = name
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def call_later(self, delay, callback, *args):
+        """
+        To run callback(*args) on the scheduler thread after delay seconds.
+
+        Returns
+        -------
+        TimerHandle
+            call its cancel() to stop the callback from running
+        """
+        handle = TimerHandle(time.monotonic() + delay, callback, args)
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError('The scheduler is stopped.')
+            heapq.heappush(self._heap, (handle.when, next(self._seq), handle))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return handle
+
+    def __len__(self):
+        # number of scheduled callbacks, cancelled ones included until they are due
+        return len(self._heap)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._heap.clear()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    if self._heap:
+                        wait = self._heap[0][0] - time.monotonic()
+                        if wait <= 0:
+                            handle = heapq.heappop(self._heap)[2]
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+
+            if handle.cancelled:
+                continue
+            try:
+                handle.callback(*handle.args)
+            except Exception as e:
+                telemetry.get_logger('scheduler').error('callback failed', callback=handle.callback, error=repr(e))
@@ -0,0 +1,382 @@
+import json
+import os
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+# prefix of the segments when Cortex is created with shared_streams=True
+DEFAULT_BUS_PREFIX = 'cortex'
+# samples kept per stream, about 30 s of 'eeg' at 128 Hz
+DEFAULT_SHARED_CAPACITY = 4096
+
+# Segment layout: a header of int64 fields, the column labels as JSON, then
+# the times (float64) and samples (float32) written twice, like StreamRingBuffer
+MAGIC = 0x43545842  # 'CTXB'
+HEADER_FIELDS = 8
+MAGIC_IDX, CAPACITY_IDX, COLUMNS_IDX, SEQ_IDX, CLOSED_IDX, LABELS_IDX, PID_IDX = range(7)
+HEADER_BYTES = HEADER_FIELDS * 8
+LABELS_BYTES = 4096
+
+
+def segment_name(prefix, stream_name, headset_id=''):
+    """
+    To get the name of the shared memory segment of a stream, as created by
+    Cortex(..., shared_streams=prefix). The sessions added with add_session()
+    have the headset id in their segment names.
+
+    Returns
+    -------
+    str
+    """
+    if headset_id:
+        return '{0}_{1}_{2}'.format(prefix, headset_id, stream_name)
+    return '{0}_{1}'.format(prefix, stream_name)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # alive, but owned by another user
+        return True
+    return True
+
+
+def _remove_stale(name):
+    # unlink a segment of the same name if its writer closed it or is gone, raise otherwise
+    shm = _attach(name)
+    try:
+        if shm.size < HEADER_BYTES:
+            raise FileExistsError('The shared memory segment {} exists and is not a stream ring.'.format(name))
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        magic, closed, pid = int(header[MAGIC_IDX]), int(header[CLOSED_IDX]), int(header[PID_IDX])
+        del header
+    finally:
+        shm.close()
+    if magic != MAGIC:
+        raise FileExistsError('The shared memory segment {} exists and is not a stream ring.'.format(name))
+    if not closed and pid > 0 and _process_alive(pid):
+        raise FileExistsError('The stream ring {0} is in use by the process {1}.'.format(name, pid))
+    # registered, so that unlink() leaves the resource tracker as it was
+    stale = shared_memory.SharedMemory(name=name)
+    stale.close()
+    stale.unlink()
+
+
+def _layout(buf, capacity, columns):
+    header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=buf)
+    offset = HEADER_BYTES + LABELS_BYTES
+    times = np.ndarray((2 * capacity,), dtype=np.float64, buffer=buf, offset=offset)
+    offset += times.nbytes
+    data = np.ndarray((2 * capacity, columns), dtype=np.float32, buffer=buf, offset=offset)
+    return header, times, data
+
+
+# held while resource_tracker.register is swapped out by _attach, and while a
+# ring is created, so that the segment of a ring is always registered
+_tracker_lock = threading.RLock()
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    # Before Python 3.13 an attached segment is registered with the resource
+    # tracker too, which unlinks it when the reader exits. Unregistering it
+    # afterwards would drop the writer's registration if both processes share
+    # a tracker (multiprocessing children), so it is not registered at all
+    with _tracker_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class SharedStreamRing():
+    """
+    The writing side of a ring buffer of one numeric Cortex stream ('eeg',
+    'mot', 'pow' or 'met') in a multiprocessing.shared_memory segment, so that
+    other local processes (loggers, classifiers, dashboards) can read the
+    decoded samples with a SharedStreamReader, without a Cortex session of
+    their own and without anything being pickled.
+
+    Samples are stored like in StreamRingBuffer: float32 values written twice,
+    so any window of the newest samples is one contiguous slice. The header
+    holds a sequence counter, 2 * count while idle and odd while sample count
+    is being written, which is all a reader needs to tell whether the window
+    it read has been overwritten since. The writer never waits for a reader.
+
+    There is a single writer, the websocket thread. The segment is unlinked
+    by close(); readers still attached see it marked as closed, and later
+    appends are dropped. A segment of the same name is only taken over if
+    its ring was closed or its writer process is gone, FileExistsError is
+    raised otherwise.
+
+    Attributes
+    ----------
+    name : str
+        name of the shared memory segment
+    capacity : int
+        maximum number of samples kept
+    labels : list
+        column labels, in order
+    count : int
+        total number of samples appended so far
+
+    Methods
+    -------
+    append(time, values):
+        To add one sample
+    close():
+        To mark the ring as closed and unlink the segment
+    """
+    def __init__(self, name, capacity, labels):
+        if capacity <= 0:
+            raise ValueError('The capacity of a stream ring must be positive.')
+        self.name = name
+        self.capacity = capacity
+        self.labels = list(labels)
+        encoded = json.dumps(self.labels).encode()
+        if len(encoded) > LABELS_BYTES:
+            raise ValueError('The labels of {} do not fit in the segment header.'.format(name))
+
+        size = HEADER_BYTES + LABELS_BYTES + 2 * capacity * (8 + 4 * len(self.labels))
+        with _tracker_lock:
+            try:
+                self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:
+                # only taken over if left behind by a closed ring or a process that is gone
+                _remove_stale(name)
+                self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        buf = self._shm.buf
+        buf[HEADER_BYTES:HEADER_BYTES + len(encoded)] = encoded
+        self._header, self._times, self._data = _layout(buf, capacity, len(self.labels))
+        self._data.fill(np.nan)
+        self._header[CAPACITY_IDX] = capacity
+        self._header[COLUMNS_IDX] = len(self.labels)
+        self._header[LABELS_IDX] = len(encoded)
+        self._header[SEQ_IDX] = 0
+        self._header[CLOSED_IDX] = 0
+        self._header[PID_IDX] = os.getpid()
+        # readers check the magic number last, once the rest of the header is set
+        self._header[MAGIC_IDX] = MAGIC
+        self.count = 0
+        self._idx = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, time, values):
+        """
+        To add one sample, overwriting the oldest one once the ring is full.
+
+        Parameters
+        ----------
+        time : float, required
+            Cortex timestamp of the sample
+        values : list, required
+            one value per label. None (e.g. an inactive 'met' detection) is stored as NaN
+
+        Returns
+        -------
+        None
+        """
+        header = self._header
+        if header is None:
+            # closed: a frame still being decoded is dropped
+            return
+        count = self.count
+        idx = self._idx
+        data = self._data
+        header[SEQ_IDX] = 2 * count + 1
+        try:
+            data[idx] = values
+        except TypeError:
+            data[idx] = [np.nan if v is None else v for v in values]
+        data[idx + self.capacity] = data[idx]
+        self._times[idx] = time
+        self._times[idx + self.capacity] = time
+        header[SEQ_IDX] = 2 * count + 2
+        self._idx = idx + 1 if idx + 1 < self.capacity else 0
+        self.count = count + 1
+
+    def close(self):
+        if self._shm is None:
+            return
+        self._header[CLOSED_IDX] = 1
+        # the arrays hold the buffer, which has to be released before closing
+        self._header = self._times = self._data = None
+        self._shm.close()
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+        self._shm = None
+
+
+class SharedStreamReader():
+    """
+    Reads a SharedStreamRing of another process, e.g.
+
+        reader = SharedStreamReader(segment_name('cortex', 'eeg'))
+        cursor = reader.count
+        while not reader.closed:
+            start, times, samples = reader.since(cursor)
+            ... use the views ...
+            if reader.valid(start):
+                cursor = start + len(times)
+
+    since() and latest() return views into the segment, without copying. A
+    view is only guaranteed to hold what the writer wrote if valid(start) is
+    still True after it was used: until then the writer may have wrapped
+    around and overwritten it. read() returns copies, taken again until they
+    are consistent.
+
+    A cursor is a sample count: the samples after cursor are the ones with
+    an index >= cursor. If a reader falls more than capacity samples behind,
+    the oldest samples are lost and since() starts at the oldest one left.
+
+    Attributes
+    ----------
+    name : str
+        name of the shared memory segment
+    capacity : int
+        maximum number of samples kept
+    labels : list
+        column labels, in order
+
+    Methods
+    -------
+    since(cursor):
+        To get views of the samples after cursor
+    latest(n):
+        To get views of the newest n samples
+    valid(start):
+        To check that the samples from start on have not been overwritten
+    read(cursor):
+        To get copies of the samples after cursor
+    close():
+        To detach from the segment
+    """
+    def __init__(self, name):
+        self.name = name
+        self._shm = _attach(name)
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=self._shm.buf)
+        if header[MAGIC_IDX] != MAGIC:
+            del header
+            self._shm.close()
+            raise ValueError('{} is not a Cortex stream ring.'.format(name))
+        self.capacity = int(header[CAPACITY_IDX])
+        labels_len = int(header[LABELS_IDX])
+        self.labels = json.loads(bytes(self._shm.buf[HEADER_BYTES:HEADER_BYTES + labels_len]).decode())
+        del header
+        self._header, self._times, self._data = _layout(self._shm.buf, self.capacity, len(self.labels))
+
+    @property
+    def count(self):
+        # samples completely written so far
+        return int(self._header[SEQ_IDX]) // 2
+
+    @property
+    def closed(self):
+        return bool(self._header[CLOSED_IDX])
+
+    def _window(self, start, stop):
+        end = stop % self.capacity + self.capacity
+        return self._times[end - (stop - start):end], self._data[end - (stop - start):end]
+
+    def since(self, cursor):
+        """
+        To get the samples after cursor, oldest first, without copying.
+
+        Parameters
+        ----------
+        cursor : int, required
+            number of samples already read
+
+        Returns
+        -------
+        (start, times, samples) : tuple
+            index of the first sample returned, greater than cursor if samples
+            were lost, and views of shape (n,) and (n, len(labels))
+        """
+        stop = self.count
+        start = min(max(cursor, stop - self.capacity), stop)
+        times, samples = self._window(start, stop)
+        return start, times, samples
+
+    def latest(self, n=None):
+        """
+        To get the newest n samples, oldest first, without copying.
+
+        Parameters
+        ----------
+        n : int, optional
+            number of samples, all samples in the ring if None or larger
+
+        Returns
+        -------
+        (start, times, samples) : tuple
+            see since()
+        """
+        stop = self.count
+        size = min(stop, self.capacity)
+        if n is None or n > size:
+            n = size
+        times, samples = self._window(stop - n, stop)
+        return stop - n, times, samples
+
+    def valid(self, start):
+        """
+        To check that no sample from start on has been overwritten, i.e. that
+        views returned by since() or latest() still hold what was written.
+
+        Returns
+        -------
+        bool
+        """
+        # samples written or being written so far, each overwrites the one capacity before it
+        return (int(self._header[SEQ_IDX]) + 1) // 2 <= start + self.capacity
+
+    def read(self, cursor, retries=100):
+        """
+        To get copies of the samples after cursor, consistent with what was
+        written. The copy is taken again if the writer overwrote part of it
+        meanwhile.
+
+        Parameters
+        ----------
+        cursor : int, required
+            number of samples already read
+        retries : int, optional
+            copies taken before giving up
+
+        Returns
+        -------
+        (start, times, samples) : tuple
+            see since(), with arrays the caller owns
+        """
+        for _ in range(retries):
+            start, times, samples = self.since(cursor)
+            times, samples = times.copy(), samples.copy()
+            if self.valid(start):
+                return start, times, samples
+            # lapped while copying: continue from what is still there
+            cursor = start
+            time.sleep(0)
+        raise RuntimeError('The writer of {} overwrote every copy.'.format(self.name))
+
+    def close(self):
+        if self._shm is None:
+            return
+        self._header = self._times = self._data = None
+        self._shm.close()
+        self._shm = None
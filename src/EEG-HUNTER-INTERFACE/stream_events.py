@@ -0,0 +1,188 @@
+import sys
+
+
+# actions of the 'com' stream
+MENTAL_COMMAND_ACTIONS = ('neutral', 'push', 'pull', 'lift', 'drop', 'left', 'right',
+                          'rotateLeft', 'rotateRight', 'rotateClockwise', 'rotateCounterClockwise',
+                          'rotateForwards', 'rotateReverse', 'disappear')
+# eye, upper face and lower face actions of the 'fac' stream
+FACIAL_EXPRESSION_ACTIONS = ('neutral', 'blink', 'winkL', 'winkR', 'lookL', 'lookR', 'horiEye',
+                             'surprise', 'frown', 'smile', 'clench', 'laugh', 'smirkLeft', 'smirkRight')
+
+# names outside the two lists are interned as they arrive, up to this many
+MAX_ACTIONS = 256
+
+_ACTIONS = {name: sys.intern(name) for name in MENTAL_COMMAND_ACTIONS + FACIAL_EXPRESSION_ACTIONS}
+
+
+def intern_action(name):
+    """
+    To get the one shared str object of an action name, so that the events
+    of a session do not each keep their own copy of 'neutral' and the
+    controllers can compare actions by identity.
+
+    Parameters
+    ----------
+    name : str, required
+        action name as decoded from the frame
+
+    Returns
+    -------
+    str
+        the interned name, or name itself once the vocabulary is full
+    """
+    action = _ACTIONS.get(name)
+    if action is None:
+        if len(_ACTIONS) >= MAX_ACTIONS or not isinstance(name, str):
+            return name
+        action = _ACTIONS[name] = sys.intern(name)
+    return action
+
+
+class StreamEvent():
+    """
+    Base of the 'data' of the 'new_*_data' events: a fixed set of fields in
+    __slots__, read as attributes (data.power).
+
+    For listeners written against the dict events, a StreamEvent can also
+    be read like a read-only dict: data['power'], data.get('power'), 'power'
+    in data, keys(), items() and dict(data) all work, and an event compares
+    equal to the dict it replaces.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key in self.__slots__:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in self.__slots__:
+            return getattr(self, key)
+        return default
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def keys(self):
+        return self.__slots__
+
+    def values(self):
+        return [getattr(self, key) for key in self.__slots__]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.__slots__]
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __eq__(self, other):
+        if isinstance(other, StreamEvent):
+            return type(self) is type(other) and self.values() == other.values()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{0}({1})'.format(type(self).__name__,
+                                 ', '.join('{0}={1!r}'.format(key, getattr(self, key)) for key in self.__slots__))
+
+
+class ComEvent(StreamEvent):
+    # mental command: interned action name and its power, 0.0 - 1.0
+    __slots__ = ('action', 'power', 'time')
+
+    def __init__(self, action, power, time):
+        self.action = action
+        self.power = power
+        self.time = time
+
+
+class FacEvent(StreamEvent):
+    # facial expression: eye action, upper and lower face actions with their power
+    __slots__ = ('eyeAct', 'uAct', 'uPow', 'lAct', 'lPow', 'time')
+
+    def __init__(self, eyeAct, uAct, uPow, lAct, lPow, time):
+        self.eyeAct = eyeAct
+        self.uAct = uAct
+        self.uPow = uPow
+        self.lAct = lAct
+        self.lPow = lPow
+        self.time = time
+
+
+class EegEvent(StreamEvent):
+    # one EEG sample, without the MARKERS column
+    __slots__ = ('eeg', 'time')
+
+    def __init__(self, eeg, time):
+        self.eeg = eeg
+        self.time = time
+
+
+class MotEvent(StreamEvent):
+    __slots__ = ('mot', 'time')
+
+    def __init__(self, mot, time):
+        self.mot = mot
+        self.time = time
+
+
+class MetEvent(StreamEvent):
+    __slots__ = ('met', 'time')
+
+    def __init__(self, met, time):
+        self.met = met
+        self.time = time
+
+
+class PowEvent(StreamEvent):
+    __slots__ = ('pow', 'time')
+
+    def __init__(self, pow, time):
+        self.pow = pow
+        self.time = time
+
+
+class DevEvent(StreamEvent):
+    # signal strength, contact quality per sensor and battery level
+    __slots__ = ('signal', 'dev', 'batteryPercent', 'time')
+
+    def __init__(self, signal, dev, batteryPercent, time):
+        self.signal = signal
+        self.dev = dev
+        self.batteryPercent = batteryPercent
+        self.time = time
+
+
+class BlinkEvent(StreamEvent):
+    # a blink found in the 'eeg' stream by BlinkDetector: Cortex times of its end
+    # (when it was reported) and start, and its peak in uV over the baseline
+    __slots__ = ('time', 'start', 'duration', 'amplitude')
+
+    def __init__(self, time, start, duration, amplitude):
+        self.time = time
+        self.start = start
+        self.duration = duration
+        self.amplitude = amplitude
+
+
+class ClassifierDecision(StreamEvent):
+    # the result of a ClassificationStage: sequence number of its window, what the
+    # classifier returned, Cortex time of the last sample of the window, and the
+    # seconds from that sample's arrival to the decision
+    __slots__ = ('seq', 'decision', 'time', 'latency')
+
+    def __init__(self, seq, decision, time, latency):
+        self.seq = seq
+        self.decision = decision
+        self.time = time
+        self.latency = latency
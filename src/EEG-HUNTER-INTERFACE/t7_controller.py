@@ -2,13 +2,169 @@
 
 import rospy
 from geometry_msgs.msg import Twist
+import sys
+import threading
 import cortex
+import telemetry
 from cortex import Cortex
+from peak_value_hook import PeakValueHook, TwistActuator
+from blink_detector import BlinkDetector
 
 rospy.init_node('eeg_laptop_node')
-pub = rospy.Publisher('cmd_vel', Twist, queue_size=1)
-hunter = Twist()
-current_peak = 0.0
+
+# topic of the single robot, advertised only when no fleet is driven
+CMD_VEL_TOPIC = 'cmd_vel'
+
+# Motion parameters
+PUBLISH_RATE_HZ = 20    # cmd_vel publish rate while a motion runs
+TURN_TICKS = 30         # a turn is published for 30 ticks, 1.5 seconds at 20 Hz
+FORWARD_TICKS = 1
+LINEAR_SPEED = 0.2
+TURN_SPEED = 1.0
+
+# Peak-Value-Hook thresholds
+HIGH_PEAK_THRESHOLD = 0.7   # a peak above it turns left
+LOW_PEAK_THRESHOLD = 0.3    # a peak below it moves forward, in between turns right
+
+# Control input: 'com' for the mental command power, 'blink' for the blinks found in the
+# raw 'eeg' stream, which are decided on as soon as they end
+CONTROL_INPUT = 'com'
+BLINK_FULL_SCALE = 300.0    # uV, a blink of this amplitude counts as a peak of 1.0
+
+# Fan-out mode: motion parameters of each robot of a fleet, any left out are the ones above
+ROBOT_DEFAULTS = {'linear_speed': LINEAR_SPEED, 'turn_speed': TURN_SPEED, 'turn_ticks': TURN_TICKS,
+                  'forward_ticks': FORWARD_TICKS, 'publish_rate': PUBLISH_RATE_HZ}
+
+# events logged before an error that are printed with it
+ERROR_DUMP_EVENTS = 50
+
+log = telemetry.get_logger('hunter')
+
+class CommandExecutor():
+    """
+    Publishes Hunter motions from its own thread, so that the Cortex callbacks
+    only decide on a motion and hand it over.
+
+    The executor holds a single latest-command mailbox: a new command replaces
+    the running one at the next tick, it never queues behind it.
+
+    Methods
+    -------
+    submit(linear_x, angular_z, ticks):
+        To start a motion, preempting the running one
+    stop():
+        To stop the publish thread
+    """
+    def __init__(self, publisher, rate_hz=PUBLISH_RATE_HZ, name='HunterCommandExecutor'):
+        self.publisher = publisher
+        self.rate_hz = rate_hz
+        self._cond = threading.Condition()
+        self._linear_x = 0.0
+        self._angular_z = 0.0
+        self._remaining = 0
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, linear_x, angular_z, ticks):
+        """
+        To publish a velocity command for a number of ticks of the publish rate.
+
+        Parameters
+        ----------
+        linear_x : float, required
+            linear velocity in m/s
+        angular_z : float, required
+            angular velocity in rad/s
+        ticks : int, required
+            number of times the command is published
+
+        Returns
+        -------
+        None
+        """
+        with self._cond:
+            self._linear_x = linear_x
+            self._angular_z = angular_z
+            self._remaining = ticks
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _run(self):
+        rate = rospy.Rate(self.rate_hz)
+        twist = Twist()
+        while not rospy.is_shutdown():
+            with self._cond:
+                while self._remaining == 0 and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                twist.linear.x = self._linear_x
+                twist.angular.z = self._angular_z
+                self._remaining -= 1
+            self.publisher.publish(twist)
+            rate.sleep()
+
+class RobotFleet():
+    """
+    Fans one decision stream out to several Hunters, one per ROS namespace:
+    the robot 'robot_1' is driven on /robot_1/cmd_vel. Every robot has its
+    own motion parameters, publisher and CommandExecutor thread, so handing
+    a decision over only costs the Cortex thread one submit() per robot, and
+    a slow publisher does not hold up the other robots.
+
+    Parameters
+    ----------
+    robots : dict or list, required
+        namespace -> dict of motion parameters (the keys of ROBOT_DEFAULTS),
+        or a list of namespaces that use the default parameters
+
+    Attributes
+    ----------
+    executors : dict
+        namespace -> CommandExecutor of the robot
+    actuators : dict
+        namespace -> TwistActuator of the robot
+
+    Methods
+    -------
+    actuate(decision, value):
+        To hand a decision to every robot, as the actuator of a PeakValueHook
+    stop():
+        To stop the publish threads
+    """
+    def __init__(self, robots):
+        if not isinstance(robots, dict):
+            robots = {namespace: {} for namespace in robots}
+        if not robots:
+            raise ValueError('A fleet needs at least one robot.')
+        self.executors = {}
+        self.actuators = {}
+        for namespace, params in robots.items():
+            params = params or {}
+            unknown = sorted(set(params) - set(ROBOT_DEFAULTS))
+            if unknown:
+                raise ValueError('Unknown parameters {0} of the robot {1}.'.format(', '.join(unknown), namespace))
+            params = dict(ROBOT_DEFAULTS, **params)
+            name = namespace.strip('/')
+            publisher = rospy.Publisher('/{}/cmd_vel'.format(name), Twist, queue_size=1)
+            executor = CommandExecutor(publisher, params['publish_rate'], name='HunterCommandExecutor-' + name)
+            self.executors[name] = executor
+            self.actuators[name] = TwistActuator(executor.submit, params['linear_speed'], params['turn_speed'],
+                                                 params['turn_ticks'], params['forward_ticks'])
+        self._actuate = [actuator.actuate for actuator in self.actuators.values()]
+
+    def actuate(self, decision, value):
+        for actuate in self._actuate:
+            actuate(decision, value)
+
+    def stop(self):
+        for executor in self.executors.values():
+            executor.stop()
 
 class LiveAdvance():
     """
@@ -19,6 +175,10 @@ class LiveAdvance():
     ----------
     c : Cortex
         Cortex communicate with Emotiv Cortex Service
+    control_input : str
+        'com' to decide on the mental command power, 'blink' on blinks in the 'eeg' stream
+    fleet : RobotFleet
+        the robots driven in fan-out mode, None when driving the single cmd_vel topic
 
     Methods
     -------
@@ -35,18 +195,38 @@ class LiveAdvance():
     set_sensitivity(profile_name):
         To set the sensitivity of the 4 active mental command actions.
     """
-    def __init__(self, app_client_id, app_client_secret, **kwargs):
+    def __init__(self, app_client_id, app_client_secret, control_input=CONTROL_INPUT, robots=None, **kwargs):
+        if control_input not in ('com', 'blink'):
+            raise ValueError("control_input must be 'com' or 'blink'.")
+        self.control_input = control_input
         self.c = Cortex(app_client_id, app_client_secret, debug_mode=False, **kwargs)# CHANGED THIS
+        if robots:
+            # fan-out mode: every decision goes to each robot of the fleet, see RobotFleet
+            self.fleet = RobotFleet(robots)
+            self.executor = None
+            actuator = self.fleet
+        else:
+            self.fleet = None
+            self.executor = CommandExecutor(rospy.Publisher(CMD_VEL_TOPIC, Twist, queue_size=1))
+            actuator = TwistActuator(self.executor.submit, LINEAR_SPEED, TURN_SPEED, TURN_TICKS, FORWARD_TICKS)
+        self.hook = PeakValueHook(HIGH_PEAK_THRESHOLD, LOW_PEAK_THRESHOLD, actuator=actuator)
         self.c.bind(create_session_done=self.on_create_session_done)
         self.c.bind(query_profile_done=self.on_query_profile_done)
         self.c.bind(load_unload_profile_done=self.on_load_unload_profile_done)
         self.c.bind(save_profile_done=self.on_save_profile_done)
-        self.c.bind(new_com_data=self.on_new_com_data)
+        if control_input == 'blink':
+            # kept here, Cortex only holds weak references to its listeners. The
+            # sampling rate comes from the settings of the session's headset
+            self.blinks = BlinkDetector()
+            self.blinks.bind(self.c)
+            self.c.bind(blink=self.on_blink)
+        else:
+            self.c.bind(new_com_data=self.on_new_com_data)
         self.c.bind(get_mc_active_action_done=self.on_get_mc_active_action_done)
         self.c.bind(mc_action_sensitivity_done=self.on_mc_action_sensitivity_done)
         self.c.bind(inform_error=self.on_inform_error)
 
-    def start(self, profile_name, headsetId=''):
+    def start(self, profile_name, headsetId='', block=True):
         """
         To start live process as below workflow
         (1) check access right -> authorize -> connect headset->create session
@@ -60,6 +240,9 @@ class LiveAdvance():
         headsetId: string , optional
              id of wanted headet which you want to work with it.
              If the headsetId is empty, the first headset in list will be set as wanted headset
+        block: bool, optional
+             If False, return right after opening the websocket. Wait on
+             self.c.subscribed (or the other Cortex readiness events) instead
         Returns
         -------
         None
@@ -73,7 +256,7 @@ class LiveAdvance():
         if headsetId != '':
             self.c.set_wanted_headset(headsetId)
 
-        self.c.open()
+        self.c.open(block=block)
 
     def load_profile(self, profile_name):
         """
@@ -194,11 +377,11 @@ class LiveAdvance():
 
     # callbacks functions
     def on_create_session_done(self, *args, **kwargs):
-        print('on_create_session_done')
+        log.info('create session done')
         self.c.query_profile()
 
     def on_query_profile_done(self, *args, **kwargs):
-        print('on_query_profile_done')
+        log.info('query profile done')
         self.profile_lists = kwargs.get('data')
         if self.profile_name in self.profile_lists:
             # the profile is existed
@@ -209,92 +392,57 @@ class LiveAdvance():
 
     def on_load_unload_profile_done(self, *args, **kwargs):
         is_loaded = kwargs.get('isLoaded')
-        print("on_load_unload_profile_done: " + str(is_loaded))
+        log.info('load unload profile done', is_loaded=is_loaded)
         
         if is_loaded == True:
-            # get active action
+            # get active action and sensitivity, both requests in flight at once
             self.get_active_action(self.profile_name)
+            self.get_sensitivity(self.profile_name)
         else:
-            print('The profile ' + self.profile_name + ' is unloaded')
+            log.info('profile unloaded', profile=self.profile_name)
             self.profile_name = ''
 
     def on_save_profile_done (self, *args, **kwargs):
-        print('Save profile ' + self.profile_name + " successfully")
-        # subscribe mental command data
-        stream = ['com']
+        log.info('profile saved', profile=self.profile_name)
+        # subscribe mental command data, or the raw EEG for the blink detector
+        stream = ['eeg'] if self.control_input == 'blink' else ['com']
         self.c.sub_request(stream)
     
     # FINAL PROJECT CODE-----------------------------------------------------------------------------------------------------------
     # With the Peak-Value-Hook control method, the code effectively leverages the peak EEG power level resulting from user blinking to 
     # control the AgileX Hunter 2 Robot.
+    # This runs on the Cortex websocket thread: the hook only decides on a motion and hands it to the
+    # command executor, which publishes it.
     def on_new_com_data(self, *args, **kwargs):
         
         # Extract power data from incoming headset packets
-        global current_peak
         data = kwargs.get('data')
-        power = data['power']
+        power = data.power
 
-        # Check if the incoming power is greater than the current peak
-        if power > current_peak:
-            current_peak = power
-            print("TEMP ", current_peak)
-            pass
-        
-        # If the power is 0.0, determine the action based on the current_peak value
-        elif power == 0.0:
-            # Move left
-            if current_peak > 0.7:
-                hunter.linear.x = 0.2
-                hunter.angular.z = 1.0
-
-                # Publish the movement command for 1.5 seconds
-                c = 0
-                while (c < 30):
-                    print("LEFT ", current_peak)
-                    pub.publish(hunter)
-                    c = c + 1
-                    rospy.sleep(0.05)
-                pass
-            
-            # Move forward
-            elif current_peak < 0.3:
-                print("FORWARD ", power)
-                hunter.linear.x = 0.2
-                hunter.angular.z = 0.0
-                pub.publish(hunter)
-                rospy.sleep(0.05)
-                pass
-            
-            # Move Right
-            else:
-                hunter.linear.x = 0.2
-                hunter.angular.z = -1.0
-
-                # Publish the movement command for 1.5 seconds
-                c = 0
-                while (c < 30):
-                    print("RIGHT ", current_peak)
-                    pub.publish(hunter)
-                    c = c + 1
-                    rospy.sleep(0.05)
-                pass
-
-            # Reset the peak value variable after completing a movement
-            current_peak = 0.0
-            pass
-
-        # For smaller non-zero power values just print the power
+        # The hook keeps the peak power and, once the power drops back to 0.0, moves
+        # left (peak > 0.7), forward (peak < 0.3) or right, then resets the peak
+        decision = self.hook.update(power)
+        if decision is None:
+            log.debug('power', power=power)
         else:
-            print("TEMP ", power)
+            log.info('decision', decision=decision, peak=self.hook.last_value)
+
+    # The blink input: a blink is decided on when it ends, scaled to the peak power range,
+    # without waiting for the 'com' power to decay back to 0.0
+    def on_blink(self, *args, **kwargs):
+        event = kwargs.get('data')
+        value = min(event.amplitude / BLINK_FULL_SCALE, 1.0)
+        decision = self.hook.decide(value)
+        log.info('decision', decision=decision, peak=round(value, 2), blink=round(event.amplitude, 1),
+                 duration=round(event.duration, 3))
 
     def on_get_mc_active_action_done(self, *args, **kwargs):
         data = kwargs.get('data')
-        print('on_get_mc_active_action_done: {}'.format(data))
-        self.get_sensitivity(self.profile_name)
+        log.info('active action', data=data)
 
     def on_mc_action_sensitivity_done(self, *args, **kwargs):
         data = kwargs.get('data')
-        print('on_mc_action_sensitivity_done: {}'.format(data))
+        log.info('action sensitivity', data=data)
         if isinstance(data, list):
             # get sensivity
             new_values = [7,7,5,5]# Left, null, null, null
@@ -308,11 +456,13 @@ class LiveAdvance():
         error_code = error_data['code']
         error_message = error_data['message']
 
-        print(error_data)
+        log.error('cortex error', code=error_code, message=error_message)
+        # what led up to it
+        telemetry.dump(ERROR_DUMP_EVENTS, sys.stderr)
 
         if error_code == cortex.ERR_PROFILE_ACCESS_DENIED:
             # disconnect headset for next use
-            print('Get error ' + error_message + ". Disconnect headset to fix this issue for next use.")
+            log.warning('disconnect headset to fix the profile access for next use')
             self.c.disconnect_headset()
 
 # -----------------------------------------------------------
@@ -339,8 +489,13 @@ def main():
     your_app_client_secret = 'app_client_secret'
     trained_profile_name = 'profile_name'
 
+    # Fan-out mode: the robots of the private ~robots parameter, e.g.
+    #   robots: {robot_1: {}, robot_2: {linear_speed: 0.3, turn_ticks: 20}}
+    # Without it the robot on cmd_vel is driven
+    robots = rospy.get_param('~robots', None)
+
     # Init live advance
-    l = LiveAdvance(your_app_client_id, your_app_client_secret)
+    l = LiveAdvance(your_app_client_id, your_app_client_secret, robots=robots)
 
     l.start(trained_profile_name)
 
@@ -3,14 +3,42 @@
 from controller import Robot
 from datetime import datetime
 import math
+import collections
+import sys
 import numpy as np
 #>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
 
 import cortex
+import telemetry
 from cortex import Cortex
+import peak_value_hook
+from peak_value_hook import PeakValueHook, MotorActuator
+from motor_scheduler import MotorScheduler, ScheduledMotorActuator
+from blink_detector import BlinkDetector
+
+WHEEL_SPEED = 3.0       # rad/s
+RAMP_STEPS = 4          # steps to reach a new wheel speed in run() mode
+TURN_THRESHOLD = 0.7    # a 'left' command below it turns left, otherwise right
+
+# Control input: 'com' for the mental command packets, 'blink' for the blinks found in the
+# raw 'eeg' stream. A blink is scaled to 0.0 - 1.0 and turns left above BLINK_HIGH_THRESHOLD,
+# moves forward below BLINK_LOW_THRESHOLD and turns right in between
+CONTROL_INPUT = 'com'
+BLINK = 'blink'
+BLINK_FULL_SCALE = 300.0    # uV, a blink of this amplitude counts as 1.0
+BLINK_HIGH_THRESHOLD = 0.7
+BLINK_LOW_THRESHOLD = 0.3
+
+# events logged before an error that are printed with it
+ERROR_DUMP_EVENTS = 50
+
+log = telemetry.get_logger('webots')
 
 class LiveAdvance():
-    def __init__(self, app_client_id, app_client_secret, robot, **kwargs):
+    def __init__(self, app_client_id, app_client_secret, robot, control_input=CONTROL_INPUT, **kwargs):
+        if control_input not in ('com', BLINK):
+            raise ValueError("control_input must be 'com' or 'blink'.")
+        self.control_input = control_input
         #>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
         # # Robot Parameters
         self.robot = robot
@@ -26,6 +54,24 @@ class LiveAdvance():
         self.right_motor.setVelocity(0.0)
         self.velocity_left = 0
         self.velocity_right = 0
+        self.left_sensor = self.left_motor.getPositionSensor()
+        self.right_sensor = self.right_motor.getPositionSensor()
+        self.left_sensor.enable(self.time_step)
+        self.right_sensor.enable(self.time_step)
+        # timed motor actions and a log of commanded vs actual wheel velocities, driven by run()
+        self.motors = MotorScheduler(self.left_motor, self.right_motor, self.time_step,
+                                     self.left_sensor, self.right_sensor)
+        # decide on every 'com' packet: 'neutral' moves forward, 'left' turns by its power
+        self.hook = PeakValueHook(high_threshold=TURN_THRESHOLD, low_threshold=0.0, hold_peak=False,
+                                  high_decision=peak_value_hook.RIGHT, mid_decision=peak_value_hook.LEFT,
+                                  inclusive_high=True,
+                                  actuator=MotorActuator(self.left_motor, self.right_motor, WHEEL_SPEED))
+        # decide on every blink, with the same actuator
+        self.blink_hook = PeakValueHook(BLINK_HIGH_THRESHOLD, BLINK_LOW_THRESHOLD, actuator=self.hook.actuator)
+        # set by run(): the main thread steps the simulation and the callbacks only
+        # leave the latest (action, power) here
+        self.step_loop = False
+        self.pending_command = collections.deque(maxlen=1)
         #>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
         
         self.c = Cortex(app_client_id, app_client_secret, debug_mode=False, **kwargs)
@@ -33,7 +79,14 @@ class LiveAdvance():
         self.c.bind(query_profile_done=self.on_query_profile_done)
         self.c.bind(load_unload_profile_done=self.on_load_unload_profile_done)
         self.c.bind(save_profile_done=self.on_save_profile_done)
-        self.c.bind(new_com_data=self.on_new_com_data)
+        if control_input == BLINK:
+            # kept here, Cortex only holds weak references to its listeners. The
+            # sampling rate comes from the settings of the session's headset
+            self.blinks = BlinkDetector()
+            self.blinks.bind(self.c)
+            self.c.bind(blink=self.on_blink)
+        else:
+            self.c.bind(new_com_data=self.on_new_com_data)
         self.c.bind(get_mc_active_action_done=self.on_get_mc_active_action_done)
         self.c.bind(mc_action_sensitivity_done=self.on_mc_action_sensitivity_done)
         self.c.bind(inform_error=self.on_inform_error)
@@ -42,13 +95,7 @@ class LiveAdvance():
         if (self.robot.step(self.time_step) == -1):
             exit()
 
-    def delay(self, time):
-        i = 0
-        while(i < time):
-            self.sim_check()
-            i = i + 1
-
-    def start(self, profile_name, headsetId=''):
+    def start(self, profile_name, headsetId='', block=True):
         if profile_name == '':
             raise ValueError('Empty profile_name. The profile_name cannot be empty.')
 
@@ -58,7 +105,39 @@ class LiveAdvance():
         if headsetId != '':
             self.c.set_wanted_headset(headsetId)
 
-        self.c.open()
+        self.c.open(block=block)
+
+    def run(self, profile_name, headsetId=''):
+        # Start Cortex on its own thread and step the simulation here at a steady
+        # rate, applying the latest mental command at each step. The simulation no
+        # longer waits for headset packets, so it can also run in fast mode.
+        # Decisions become motor scheduler actions, see self.motors.log() afterwards.
+        self.step_loop = True
+        self.hook.actuator = self.blink_hook.actuator = ScheduledMotorActuator(self.motors, WHEEL_SPEED, RAMP_STEPS)
+        self.start(profile_name, headsetId, block=False)
+        try:
+            while self.robot.step(self.time_step) != -1:
+                self.apply_pending_command()
+                self.motors.tick()
+        finally:
+            self.c.close()
+
+    def apply_pending_command(self):
+        try:
+            action, power = self.pending_command.pop()
+        except IndexError:
+            return
+        self.drive(action, power)
+
+    def drive(self, action, power):
+        # Move forward on 'neutral', left on 'left' below the threshold and right above it.
+        # A blink is decided on by its scaled amplitude
+        if action == BLINK:
+            decision = self.blink_hook.decide(power)
+        else:
+            decision = self.hook.update(power, action)
+        if decision is not None:
+            log.info('decision', decision=decision, action=action, power=power)
 
     def load_profile(self, profile_name):
         self.c.setup_profile(profile_name, 'load')
@@ -83,11 +162,11 @@ class LiveAdvance():
 
     # callbacks functions
     def on_create_session_done(self, *args, **kwargs):
-        print('on_create_session_done')
+        log.info('create session done')
         self.c.query_profile()
 
     def on_query_profile_done(self, *args, **kwargs):
-        print('on_query_profile_done')
+        log.info('query profile done')
         self.profile_lists = kwargs.get('data')
         if self.profile_name in self.profile_lists:
             # the profile is existed
@@ -98,63 +177,58 @@ class LiveAdvance():
 
     def on_load_unload_profile_done(self, *args, **kwargs):
         is_loaded = kwargs.get('isLoaded')
-        print("on_load_unload_profile_done: " + str(is_loaded))
+        log.info('load unload profile done', is_loaded=is_loaded)
         
         if is_loaded == True:
-            # get active action
+            # get active action and sensitivity, both requests in flight at once
             self.get_active_action(self.profile_name)
+            self.get_sensitivity(self.profile_name)
         else:
-            print('The profile ' + self.profile_name + ' is unloaded')
+            log.info('profile unloaded', profile=self.profile_name)
             self.profile_name = ''
 
     def on_save_profile_done (self, *args, **kwargs):
-        print('Save profile ' + self.profile_name + " successfully")
-        # subscribe mental command data
-        stream = ['com']
+        log.info('profile saved', profile=self.profile_name)
+        # subscribe mental command data, or the raw EEG for the blink detector
+        stream = ['eeg'] if self.control_input == BLINK else ['com']
         self.c.sub_request(stream)
 
     # This script interprets EEG commands to guide the movements of an 
     # E-Puck robot within the Webots simulation environment.
     def on_new_com_data(self, *args, **kwargs):
         
-        # Check simulation status
-        self.sim_check()
-        
         # Extract action and power data from incoming headset packets
         data = kwargs.get('data')
-        action = data['action']
-        power = data['power']
-
-        # Move forward if received command is 'neutral'
-        if action == 'neutral':
-            print("FORWARD  ", power)
-            self.left_motor.setVelocity(3.0)
-            self.right_motor.setVelocity(3.0)
-            pass
-
-        elif action == 'left':
-            # Move left if received command is 'left' and the power level is below 0.7
-            if power < 0.7:           
-                print("LEFT     ", power)
-                self.left_motor.setVelocity(-3.0)
-                self.right_motor.setVelocity(3.0)   
-                pass
-
-            # Move right if received command is 'left' and the power level is above 0.7
-            else:
-                print("RIGHT    ", power)
-                self.left_motor.setVelocity(3.0)
-                self.right_motor.setVelocity(-3.0) 
-                pass
+        action = data.action
+        power = data.power
+
+        # In run() mode hand the command over to the step loop, which drops all but the newest
+        if self.step_loop:
+            self.pending_command.append((action, power))
+            return
+
+        # Check simulation status
+        self.sim_check()
+        self.drive(action, power)
+
+    # The blink input, on the Cortex thread like on_new_com_data. Without run() the
+    # simulation only steps on each blink, so use run() with this input
+    def on_blink(self, *args, **kwargs):
+        event = kwargs.get('data')
+        value = min(event.amplitude / BLINK_FULL_SCALE, 1.0)
+        if self.step_loop:
+            self.pending_command.append((BLINK, value))
+            return
+        self.sim_check()
+        self.drive(BLINK, value)
 
     def on_get_mc_active_action_done(self, *args, **kwargs):
         data = kwargs.get('data')
-        print('on_get_mc_active_action_done: {}'.format(data))
-        self.get_sensitivity(self.profile_name)
+        log.info('active action', data=data)
 
     def on_mc_action_sensitivity_done(self, *args, **kwargs):
         data = kwargs.get('data')
-        print('on_mc_action_sensitivity_done: {}'.format(data))
+        log.info('action sensitivity', data=data)
         if isinstance(data, list):
             # get sensivity
             new_values = [7,7,5,5]
@@ -168,11 +242,13 @@ class LiveAdvance():
         error_code = error_data['code']
         error_message = error_data['message']
 
-        print(error_data)
+        log.error('cortex error', code=error_code, message=error_message)
+        # what led up to it
+        telemetry.dump(ERROR_DUMP_EVENTS, sys.stderr)
 
         if error_code == cortex.ERR_PROFILE_ACCESS_DENIED:
             # disconnect headset for next use
-            print('Get error ' + error_message + ". Disconnect headset to fix this issue for next use.")
+            log.warning('disconnect headset to fix the profile access for next use')
             self.c.disconnect_headset()
 
 
@@ -203,7 +279,7 @@ def main():
     my_robot = Robot()
     l = LiveAdvance(your_app_client_id, your_app_client_secret, my_robot)# Added my_robot
 
-    l.start(trained_profile_name)
+    l.run(trained_profile_name)
 
 if __name__ =='__main__':
     main()
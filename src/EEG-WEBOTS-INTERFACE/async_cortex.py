@@ -0,0 +1,399 @@
+import websockets #'pip install websockets' for install
+import asyncio
+import itertools
+import json
+import ssl
+import warnings
+
+import telemetry
+from cortex import (CORTEX_URL, CortexError, STREAM_DECODER_FACTORIES, ACCESS_RIGHT_GRANTED, HEADSET_CONNECTED,
+                    CORTEX_STOP_ALL_STREAMS, CORTEX_AUTO_UNLOAD_PROFILE)
+
+
+class AsyncCortex():
+    """
+    An asyncio sibling of Cortex. Every request is a coroutine that returns the
+    'result' of its response, so the prepare steps read top to bottom instead
+    of being chained through handle_result:
+
+        c = AsyncCortex(client_id, client_secret)
+        await c.open()
+        await c.authorize()
+        await c.create_session()
+        await c.subscribe(['com'])
+        async for data in c.stream('com'):
+            ...
+
+    Stream data has the same layout as the 'new_*_data' events of Cortex.
+    Everything runs on the event loop that called open(), so ROS publishing or
+    Webots stepping can share that loop with the Cortex I/O.
+
+    Attributes
+    ----------
+    auth : str
+        cortexToken, set by authorize()
+    headset_id : str
+        wanted headset. If empty, the first headset found is used
+    session_id : str
+        id of the session created by create_session()
+
+    Methods
+    -------
+    open(url):
+        To connect to the Cortex service
+    close():
+        To close the connection
+    call(method, params):
+        To send any JSON-RPC request and wait for its result
+    authorize():
+        To check or request the access right and get a cortexToken
+    query_headset():
+        To list the headsets
+    connect_headset(headset_id):
+        To connect a headset and wait until it is connected
+    create_session():
+        To create a session with the wanted headset
+    subscribe(streams):
+        To subscribe to data streams
+    unsubscribe(streams):
+        To unsubscribe from data streams
+    stream(stream_name):
+        To iterate over the data of a subscribed stream
+    """
+    def __init__(self, client_id, client_secret, debug_mode=False, **kwargs):
+        self.session_id = ''
+        self.headset_id = ''
+        self.auth = ''
+        self.debug = debug_mode
+        self.log = telemetry.get_logger('async_cortex', telemetry.DEBUG if debug_mode else None)
+        self.debit = 10
+        self.license = ''
+
+        if client_id == '':
+            raise ValueError('Empty your_app_client_id. Please fill in your_app_client_id before running the example.')
+        self.client_id = client_id
+
+        if client_secret == '':
+            raise ValueError('Empty your_app_client_secret. Please fill in your_app_client_secret before running the example.')
+        self.client_secret = client_secret
+
+        for key, value in kwargs.items():
+            if key == 'license':
+                self.license = value
+            elif key == 'debit':
+                self.debit = value
+            elif key == 'headset_id':
+                self.headset_id = value
+
+        self.ws = None
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._warning_waiters = {}
+        self._stream_decoders = {}
+        self._stream_queues = {}
+        self._reader = None
+
+    async def open(self, url=CORTEX_URL):
+        # same as Cortex: the Emotiv self-signed certificate is not verified
+        sslopt = None
+        if url.startswith('wss'):
+            sslopt = ssl.create_default_context()
+            sslopt.check_hostname = False
+            sslopt.verify_mode = ssl.CERT_NONE
+        self.ws = await websockets.connect(url, ssl=sslopt, max_size=None)
+        self._reader = asyncio.ensure_future(self._read_loop())
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        if self.ws is not None:
+            await self.ws.close()
+            self.ws = None
+        self._fail_pending(ConnectionError('The Cortex connection is closed.'))
+        self._end_streams()
+
+    async def call(self, method, params=None, timeout=None):
+        """
+        To send a JSON-RPC request and wait for its response.
+
+        Parameters
+        ----------
+        method : str, required
+            Cortex API method, for example 'queryProfile'
+        params : dict, optional
+            request parameters
+        timeout : float, optional
+            seconds to wait for the response. None waits forever
+
+        Returns
+        -------
+        the 'result' of the response. A CortexError is raised for an 'error' response
+        """
+        req_id = next(self._ids)
+        request = {"jsonrpc": "2.0", "id": req_id, "method": method, "params": params or {}}
+        self.log.info('request', method=method, id=req_id)
+        self.log.debug('request body', request=request)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = (method, future)
+        try:
+            await self.ws.send(json.dumps(request))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(req_id, None)
+
+    async def authorize(self):
+        """
+        To authorize the application: hasAccessRight, then requestAccess if the
+        access is not granted yet (waiting for the user to approve it in the
+        EMOTIV Launcher), then authorize.
+
+        Returns
+        -------
+        the cortexToken
+        """
+        credentials = {"clientId": self.client_id, "clientSecret": self.client_secret}
+        result = await self.call('hasAccessRight', credentials)
+        if not result['accessGranted']:
+            result = await self.call('requestAccess', credentials)
+            if not result['accessGranted']:
+                warnings.warn(result['message'])
+                await self._wait_warning(ACCESS_RIGHT_GRANTED)
+
+        result = await self.call('authorize', {"clientId": self.client_id,
+                                               "clientSecret": self.client_secret,
+                                               "license": self.license,
+                                               "debit": self.debit})
+        self.log.info('authorized')
+        self.auth = result['cortexToken']
+        return self.auth
+
+    async def query_headset(self):
+        headsets = await self.call('queryHeadsets')
+        for ele in headsets:
+            self.log.info('headset', id=ele['id'], status=ele['status'], connected_by=ele['connectedBy'])
+        return headsets
+
+    async def connect_headset(self, headset_id='', retry_interval=3.0):
+        """
+        To connect a headset and wait until Cortex reports it as connected.
+        If headset_id is empty, the wanted headset or else the first headset in the list is used.
+
+        Returns
+        -------
+        the headset id
+        """
+        if headset_id != '':
+            self.headset_id = headset_id
+
+        while True:
+            headsets = await self.query_headset()
+            if len(headsets) == 0:
+                raise RuntimeError('No headset available. Please turn on a headset.')
+            if self.headset_id == '':
+                self.headset_id = headsets[0]['id']
+
+            status = None
+            for ele in headsets:
+                if ele['id'] == self.headset_id:
+                    status = ele['status']
+            if status is None:
+                raise RuntimeError('Can not found the headset ' + self.headset_id + '. Please make sure the id is correct.')
+            if status == 'connected':
+                return self.headset_id
+            if status == 'discovered':
+                await self.call('controlDevice', {"command": "connect", "headset": self.headset_id})
+            elif status != 'connecting':
+                raise RuntimeError('query_headset resp: Invalid connection status ' + status)
+
+            # query again on HEADSET_CONNECTED or after retry_interval, without blocking the loop
+            try:
+                await asyncio.wait_for(self._wait_warning(HEADSET_CONNECTED), retry_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def create_session(self):
+        if self.session_id != '':
+            warnings.warn("There is existed session " + self.session_id)
+            return self.session_id
+
+        await self.connect_headset()
+        result = await self.call('createSession', {"cortexToken": self.auth,
+                                                   "headset": self.headset_id,
+                                                   "status": "active"})
+        self.session_id = result['id']
+        self.log.info('session created', session=self.session_id)
+        return self.session_id
+
+    async def close_session(self):
+        await self.call('updateSession', {"cortexToken": self.auth, "session": self.session_id, "status": "close"})
+        self.session_id = ''
+
+    async def query_profile(self):
+        result = await self.call('queryProfile', {"cortexToken": self.auth})
+        return [ele['name'] for ele in result]
+
+    async def setup_profile(self, profile_name, status):
+        return await self.call('setupProfile', {"cortexToken": self.auth,
+                                                "headset": self.headset_id,
+                                                "profile": profile_name,
+                                                "status": status})
+
+    async def subscribe(self, streams):
+        """
+        To subscribe to one or more data streams.
+
+        Returns
+        -------
+        dict of stream name -> 'cols' for the streams subscribed successfully
+        """
+        result = await self.call('subscribe', {"cortexToken": self.auth,
+                                               "session": self.session_id,
+                                               "streams": streams})
+        # the decoders are already registered by handle_response
+        subscribed = {}
+        for stream in result['success']:
+            self.log.info('subscribed', stream=stream['streamName'])
+            subscribed[stream['streamName']] = stream['cols']
+
+        for stream in result['failure']:
+            self.log.warning('subscribe failed', stream=stream['streamName'], reason=stream['message'])
+        return subscribed
+
+    async def unsubscribe(self, streams):
+        result = await self.call('unsubscribe', {"cortexToken": self.auth,
+                                                 "session": self.session_id,
+                                                 "streams": streams})
+        for stream in result['success']:
+            self._stream_decoders.pop(stream['streamName'], None)
+            self._end_streams(stream['streamName'])
+        return result
+
+    def stream(self, stream_name, maxsize=0):
+        """
+        To iterate over the data of a stream with 'async for'. Every iterator
+        gets its own queue, registered as soon as stream() is called, so it is
+        safe to call it before subscribe(). With maxsize set, the oldest item is
+        dropped when a slow consumer falls behind, so it always sees the latest
+        data. Iteration ends on unsubscribe or close().
+        """
+        queue = asyncio.Queue(maxsize)
+        self._stream_queues.setdefault(stream_name, []).append(queue)
+
+        async def iterate():
+            try:
+                while True:
+                    data = await queue.get()
+                    if data is None:
+                        return
+                    yield data
+            finally:
+                queues = self._stream_queues.get(stream_name, [])
+                if queue in queues:
+                    queues.remove(queue)
+        return iterate()
+
+    def _make_publisher(self, stream_name):
+        def publish(event_name, data):
+            for queue in self._stream_queues.get(stream_name, ()):
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(data)
+        return publish
+
+    def _end_streams(self, stream_name=None):
+        names = [stream_name] if stream_name is not None else list(self._stream_queues)
+        for name in names:
+            for queue in self._stream_queues.pop(name, []):
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    def _fail_pending(self, exc):
+        for method, future in self._pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self._pending.clear()
+
+    async def _wait_warning(self, warning_code):
+        future = asyncio.get_running_loop().create_future()
+        self._warning_waiters.setdefault(warning_code, []).append(future)
+        try:
+            return await future
+        finally:
+            waiters = self._warning_waiters.get(warning_code, [])
+            if future in waiters:
+                waiters.remove(future)
+
+    async def _read_loop(self):
+        try:
+            async for message in self.ws:
+                self.on_message(message)
+        except websockets.ConnectionClosed as e:
+            self.log.info('websocket closed', status=e)
+        finally:
+            self._fail_pending(ConnectionError('The Cortex connection is closed.'))
+            self._end_streams()
+
+    def on_message(self, message):
+        recv_dic = json.loads(message)
+        if 'sid' in recv_dic:
+            self.handle_stream_data(recv_dic)
+        elif 'result' in recv_dic or 'error' in recv_dic:
+            self.handle_response(recv_dic)
+        elif 'warning' in recv_dic:
+            self.handle_warning(recv_dic['warning'])
+        else:
+            raise KeyError
+
+    def handle_stream_data(self, result_dic):
+        for key in result_dic:
+            decoder = self._stream_decoders.get(key)
+            if decoder is not None:
+                decoder(result_dic)
+                return
+
+    def handle_response(self, recv_dic):
+        self.log.debug('result', response=recv_dic)
+        pending = self._pending.pop(recv_dic.get('id'), None)
+        if pending is None:
+            self.log.warning('no pending request for response', id=recv_dic.get('id'))
+            return
+        method, future = pending
+        if 'error' in recv_dic:
+            if not future.done():
+                future.set_exception(CortexError(method, recv_dic['error']))
+            return
+
+        result = recv_dic['result']
+        if method == 'subscribe':
+            # register the decoders right away: data frames can follow in the
+            # same read batch, before the awaiting subscribe() resumes
+            for stream in result['success']:
+                factory = STREAM_DECODER_FACTORIES.get(stream['streamName'])
+                if factory is not None:
+                    self._stream_decoders[stream['streamName']] = factory(
+                        self._make_publisher(stream['streamName']), stream['cols'])
+        if not future.done():
+            future.set_result(result)
+
+    def handle_warning(self, warning_dic):
+        self.log.debug('warning', warning=warning_dic)
+        warning_code = warning_dic['code']
+        warning_msg = warning_dic['message']
+        if warning_code == CORTEX_AUTO_UNLOAD_PROFILE:
+            warnings.warn('Cortex unloaded the profile of headset ' + self.headset_id)
+        elif warning_code == CORTEX_STOP_ALL_STREAMS:
+            if warning_msg['sessionId'] == self.session_id:
+                self.session_id = ''
+                self._stream_decoders.clear()
+                self._end_streams()
+
+        for future in self._warning_waiters.pop(warning_code, []):
+            if not future.done():
+                future.set_result(warning_msg)
+
+# -------------------------------------------------------------------
+# -------------------------------------------------------------------
+# -------------------------------------------------------------------
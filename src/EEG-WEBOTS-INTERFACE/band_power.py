@@ -0,0 +1,245 @@
+import operator
+import numpy as np
+
+
+# sampling rate of the EPOC+ 'eeg' stream
+DEFAULT_SAMPLING_RATE = 128
+
+# (name, low Hz, high Hz), a bin belongs to a band if low <= f < high
+BANDS = (('delta', 1.0, 4.0),
+         ('theta', 4.0, 8.0),
+         ('alpha', 8.0, 13.0),
+         ('beta', 13.0, 30.0),
+         ('gamma', 30.0, 45.0))
+
+# columns of the 'eeg' stream that are not electrodes
+NON_CHANNEL_LABELS = ('COUNTER', 'INTERPOLATED', 'RAW_CQ', 'MARKER_HARDWARE', 'MARKERS')
+
+
+def channel_indices(labels):
+    # positions of the electrode columns in the labels of extract_data_labels
+    return [idx for idx, label in enumerate(labels)
+            if isinstance(label, str) and label not in NON_CHANNEL_LABELS]
+
+
+class BandPowerEngine():
+    """
+    Per-channel band power of the raw 'eeg' stream over a sliding window,
+    estimated with Welch's method.
+
+    The window is covered by Welch segments of segment seconds, overlapping
+    by overlap. Each segment is transformed once, for all channels in one
+    FFT, when its last sample arrives, and reduced to its band powers right
+    away. A feature update then only averages the band powers of the
+    segments in the window, which gives the same result as a Welch PSD of
+    the whole window integrated over the bands.
+
+    Features are handed to on_features every 1 / update_rate seconds of
+    samples, once the first window is full. Updates fall on segment
+    boundaries, so the update rate is rounded to a whole number of segment
+    steps and is at most 1 / (segment * (1 - overlap)).
+
+    Feed it with append() / append_block(), or let bind() subscribe it to the
+    'new_eeg_data' or 'new_eeg_block' events of a Cortex.
+
+    Attributes
+    ----------
+    labels : list
+        'eeg' column labels, as emitted by extract_data_labels
+    channels : list
+        electrode names, in the order of the feature rows
+    bands : tuple
+        (name, low, high) of each band, in the order of the feature columns
+    feature_labels : list
+        'channel/band' name of each value of latest.ravel(), like the 'pow' stream
+    latest : numpy array
+        last features, shape (channels, bands) in uV^2, None before the first update
+    latest_time : float
+        Cortex time of the newest sample of the last update
+
+    Methods
+    -------
+    append(time, values):
+        To add one 'eeg' sample
+    append_block(times, samples):
+        To add a block of 'eeg' samples
+    bind(cortex):
+        To follow the 'eeg' stream of a Cortex
+    reset():
+        To drop the samples and segments collected so far
+    """
+    def __init__(self, labels=None, sampling_rate=DEFAULT_SAMPLING_RATE, window=2.0, segment=1.0,
+                 overlap=0.875, update_rate=8.0, bands=BANDS, on_features=None):
+        self.sampling_rate = sampling_rate
+        self.bands = tuple(bands)
+        self.on_features = on_features
+
+        self.nperseg = int(round(segment * sampling_rate))
+        self.step = max(1, self.nperseg - int(round(self.nperseg * overlap)))
+        window_samples = int(round(window * sampling_rate))
+        if window_samples < self.nperseg:
+            raise ValueError('The window must be at least one segment long.')
+        self.n_segments = 1 + (window_samples - self.nperseg) // self.step
+        # segment steps between two updates
+        self.update_steps = max(1, int(round(sampling_rate / update_rate / self.step)))
+
+        # periodic Hann window, as scipy.signal.welch, and the one-sided PSD scaling of each bin
+        self._taper = np.hanning(self.nperseg + 1)[:-1]
+        freqs = np.fft.rfftfreq(self.nperseg, 1.0 / sampling_rate)
+        scale = np.full(len(freqs), 2.0 / (sampling_rate * np.sum(self._taper ** 2)))
+        scale[0] /= 2.0
+        if self.nperseg % 2 == 0:
+            scale[-1] /= 2.0
+        # (bins, bands): PSD times bin width summed over each band, in one matmul
+        df = freqs[1] - freqs[0]
+        self._band_matrix = np.zeros((len(freqs), len(self.bands)))
+        for col, (_, low, high) in enumerate(self.bands):
+            self._band_matrix[(freqs >= low) & (freqs < high), col] = df
+        self._band_matrix *= scale[:, np.newaxis]
+
+        self.labels = None
+        self.latest = None
+        self.latest_time = None
+        if labels is not None:
+            self.set_labels(labels)
+
+    def set_labels(self, labels):
+        """
+        To (re)configure the engine for the columns of the 'eeg' stream, e.g.
+        the labels of a 'new_data_labels' event. Collected samples are dropped.
+
+        Returns
+        -------
+        None
+        """
+        self.labels = list(labels)
+        idx = channel_indices(self.labels)
+        if not idx:
+            raise ValueError('No EEG channels in the labels.')
+        self.channels = [self.labels[i] for i in idx]
+        self.feature_labels = ['{0}/{1}'.format(ch, band[0]) for ch in self.channels for band in self.bands]
+        self._channel_idx = np.array(idx)
+        self._pick = operator.itemgetter(*idx) if len(idx) > 1 else (lambda values: (values[idx[0]],))
+        self.reset()
+
+    def reset(self):
+        n_channels = len(self.channels)
+        # samples not yet in a complete segment, plus the overlap with the next one
+        self._tail = np.empty((0, n_channels))
+        # per-sample appends are collected into one step before being processed
+        self._pending = np.empty((self.step, n_channels))
+        self._pending_n = 0
+        # band powers of the last n_segments segments, as a ring
+        self._segments = np.zeros((self.n_segments, n_channels, len(self.bands)))
+        self._seg_idx = 0
+        self._seg_count = 0
+        self._steps_since_update = 0
+        self.latest = None
+        self.latest_time = None
+
+    def append(self, time, values):
+        """
+        To add one sample.
+
+        Parameters
+        ----------
+        time : float, required
+            Cortex time of the sample
+        values : list, required
+            one 'eeg' sample with all columns of labels
+
+        Returns
+        -------
+        None
+        """
+        n = self._pending_n
+        try:
+            self._pending[n] = self._pick(values)
+        except TypeError:
+            self._pending[n] = [np.nan if v is None else v for v in self._pick(values)]
+        self._pending_n = n = n + 1
+        if n == self.step:
+            self._pending_n = 0
+            self._process(self._pending, time)
+
+    def append_block(self, times, samples):
+        """
+        To add a block of samples, e.g. of a 'new_eeg_block' event.
+
+        Parameters
+        ----------
+        times : numpy array, required
+            Cortex time of each sample, shape (n,)
+        samples : numpy array, required
+            shape (n, len(labels))
+
+        Returns
+        -------
+        None
+        """
+        if len(times) == 0:
+            return
+        data = np.asarray(samples)[:, self._channel_idx]
+        if self._pending_n:
+            # samples of earlier append() calls come first
+            data = np.concatenate((self._pending[:self._pending_n], data))
+            self._pending_n = 0
+        self._process(data, times[-1])
+
+    def _process(self, chunk, time):
+        x = np.concatenate((self._tail, chunk)) if len(self._tail) else chunk
+        if len(x) < self.nperseg:
+            self._tail = x.copy()
+            return
+        k = 1 + (len(x) - self.nperseg) // self.step
+        # all new segments of all channels in one FFT: (k, channels, nperseg)
+        segments = np.lib.stride_tricks.sliding_window_view(x, self.nperseg, axis=0)[:k * self.step:self.step]
+        segments = segments - segments.mean(axis=-1, keepdims=True)
+        spectrum = np.fft.rfft(segments * self._taper, axis=-1)
+        powers = (spectrum.real ** 2 + spectrum.imag ** 2) @ self._band_matrix
+        self._tail = x[k * self.step:].copy()
+
+        # a block may complete several updates: hand over each of them
+        samples_after = len(x) - self.nperseg - (k - 1) * self.step
+        for n in range(k):
+            self._segments[self._seg_idx] = powers[n]
+            self._seg_idx = (self._seg_idx + 1) % self.n_segments
+            self._seg_count += 1
+            self._steps_since_update += 1
+            if self._seg_count >= self.n_segments and self._steps_since_update >= self.update_steps:
+                self._steps_since_update = 0
+                self.latest = self._segments.mean(axis=0)
+                # the time of the last sample of this segment, approximated for earlier segments of a block
+                self.latest_time = time - (samples_after + (k - 1 - n) * self.step) / self.sampling_rate
+                if self.on_features is not None:
+                    self.on_features(self.latest_time, self.latest)
+
+    def bind(self, cortex):
+        """
+        To follow the 'eeg' stream of cortex: the labels are taken from its
+        'new_data_labels' event and the samples from 'new_eeg_block' if the
+        stream is batched, 'new_eeg_data' otherwise. Cortex only keeps weak
+        references to the listeners, so keep a reference to the engine.
+
+        Returns
+        -------
+        None
+        """
+        cortex.bind(new_data_labels=self.on_new_data_labels,
+                    new_eeg_data=self.on_new_eeg_data,
+                    new_eeg_block=self.on_new_eeg_block)
+
+    def on_new_data_labels(self, *args, **kwargs):
+        data = kwargs.get('data')
+        if data['streamName'] == 'eeg' and data['labels'] != self.labels:
+            self.set_labels(data['labels'])
+
+    def on_new_eeg_data(self, *args, **kwargs):
+        data = kwargs.get('data')
+        if self.labels is not None:
+            self.append(data.time, data.eeg)
+
+    def on_new_eeg_block(self, *args, **kwargs):
+        data = kwargs.get('data')
+        if self.labels is not None:
+            self.append_block(data['time'], data['eeg'])
@@ -0,0 +1,258 @@
+import collections
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from stream_bus import SharedStreamReader, segment_name
+from stream_events import ClassifierDecision
+import telemetry
+
+
+# state of a worker process: the classifier and its reader of the shared ring
+_worker = {}
+
+
+def _init_worker(segment, classify):
+    _worker['segment'] = segment
+    _worker['classify'] = classify
+    _worker['reader'] = None
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _classify_window(seq, start, stop):
+    # runs in a worker: classify samples start to stop of the ring, without copying them
+    begin = time.perf_counter()
+    reader = _worker['reader']
+    if reader is None or reader.closed:
+        # not attached yet, or the stream was subscribed again with other columns
+        if reader is not None:
+            reader.close()
+        try:
+            reader = _worker['reader'] = SharedStreamReader(_worker['segment'])
+        except (FileNotFoundError, ValueError):
+            _worker['reader'] = None
+            return seq, None, False, os.getpid(), time.perf_counter() - begin
+    first, times, samples = reader.since(start)
+    n = stop - start
+    if first != start or len(times) < n:
+        return seq, None, False, os.getpid(), time.perf_counter() - begin
+    decision = _worker['classify'](times[:n], samples[:n])
+    # the window must not have been overwritten while it was classified
+    ok = reader.valid(start)
+    return seq, decision if ok else None, ok, os.getpid(), time.perf_counter() - begin
+
+
+class ClassificationStage():
+    """
+    Runs a classifier that is too slow for the websocket thread in a pool of
+    worker processes, on windows of a numeric stream ('eeg', 'pow', ...).
+
+    The samples are not sent to the workers: the Cortex has to be created
+    with shared_streams=..., and every worker reads its window straight from
+    the stream's SharedStreamRing. The websocket thread only counts samples
+    and, every hop samples, submits the sequence number and the sample range
+    of the newest window. At most max_in_flight windows are in the pool; a
+    window that would exceed it is skipped rather than queued, so decisions
+    do not lag further and further behind.
+
+    classify(times, samples) is called in a worker with read-only views of
+    shape (window,) and (window, len(labels)), and returns the decision,
+    anything picklable. Workers are spawned, not forked, since the client
+    runs threads, so classify has to be a module-level function.
+
+    Decisions are ClassifierDecision events, put on the results queue and
+    passed to on_decision, which is called on the pool's result thread. A
+    decision older than one already delivered is stale and dropped, as is a
+    window the ring overwrote before it was classified.
+
+    Attributes
+    ----------
+    results : queue.Queue
+        ClassifierDecision events, in increasing seq order
+    segment : str
+        name of the shared ring the workers read
+
+    Methods
+    -------
+    start(session):
+        To start the workers and follow the stream of a Cortex or CortexSession
+    stop():
+        To stop following the stream and shut the workers down
+    stats():
+        To get the counts, worker utilization and decision latency
+    """
+    def __init__(self, classify, stream_name='eeg', window=128, hop=32, workers=2, max_in_flight=None,
+                 on_decision=None, latency_window=1000):
+        if window <= 0 or hop <= 0:
+            raise ValueError('The window and hop of a classification stage must be positive.')
+        self.classify = classify
+        self.stream_name = stream_name
+        self.window = window
+        self.hop = hop
+        self.workers = workers
+        self.max_in_flight = max_in_flight or 2 * workers
+        self.on_decision = on_decision
+        self.results = queue.Queue()
+        self.segment = ''
+        self.log = telemetry.get_logger('classifier')
+
+        self._session = None
+        self._executor = None
+        self._ring = None
+        self._next_stop = window
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._last_seq = 0
+        self._busy = collections.Counter()
+        self._latencies = collections.deque(maxlen=latency_window)
+        self._counts = collections.Counter()
+        self._started = 0.0
+
+    def start(self, session, timeout=30.0):
+        """
+        To start the worker processes and follow the stream of session, a
+        Cortex or a CortexSession. Call it before subscribing, e.g. before
+        open(). Cortex only keeps weak references to the listeners, so keep a
+        reference to the stage.
+
+        Returns
+        -------
+        None
+        """
+        client = session.cortex
+        if not client.shared_prefix:
+            raise ValueError('A classification stage reads the shared stream rings, '
+                             'create the Cortex with shared_streams=...')
+        self.segment = segment_name(client.shared_prefix, self.stream_name,
+                                    '' if session is client else session.headset_id)
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker, initargs=(self.segment, self.classify))
+        # spawn the workers now rather than on the websocket thread at the first window
+        warm_up = [self._executor.submit(_warm_up) for _ in range(self.workers)]
+        concurrent.futures.wait(warm_up, timeout)
+        self._session = session
+        self._ring = session.get_shared_ring(self.stream_name)
+        self._started = time.perf_counter()
+        session.bind(new_data_labels=self.on_new_data_labels,
+                     **{'new_{}_data'.format(self.stream_name): self.on_new_data,
+                        'new_{}_block'.format(self.stream_name): self.on_new_block})
+        self.log.info('classification stage started', stream=self.stream_name, segment=self.segment,
+                      workers=self.workers, window=self.window, hop=self.hop)
+
+    def stop(self):
+        if self._executor is None:
+            return
+        self._session.unbind(self.on_new_data_labels, self.on_new_data, self.on_new_block)
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
+        self._ring = None
+        with self._lock:
+            self._pending.clear()
+        self.log.info('classification stage stopped', **self._counts)
+
+    def on_new_data_labels(self, *args, **kwargs):
+        data = kwargs.get('data')
+        if data['streamName'] != self.stream_name:
+            return
+        # a new ring after subscribing with other columns: sample indices start again from 0
+        self._ring = self._session.get_shared_ring(self.stream_name)
+        if self._ring is not None:
+            self._next_stop = self._ring.count + self.window
+
+    def on_new_data(self, *args, **kwargs):
+        ring = self._ring
+        if ring is not None and ring.count >= self._next_stop:
+            self.submit(ring.count, kwargs.get('data').time)
+
+    def on_new_block(self, *args, **kwargs):
+        ring = self._ring
+        if ring is not None and ring.count >= self._next_stop:
+            self.submit(ring.count, float(kwargs.get('data')['time'][-1]))
+
+    def submit(self, stop, sample_time):
+        # on the websocket thread: hand the window ending at sample stop to the pool
+        self._next_stop = stop + self.hop
+        with self._lock:
+            if len(self._pending) >= self.max_in_flight:
+                self._counts['skipped'] += 1
+                return
+            seq = next(self._seq)
+            self._pending[seq] = (time.perf_counter(), sample_time)
+            self._counts['submitted'] += 1
+        future = self._executor.submit(_classify_window, seq, stop - self.window, stop)
+        future.add_done_callback(lambda future: self._on_done(seq, future))
+
+    def _on_done(self, seq, future):
+        # on the pool's result thread
+        if future.cancelled():
+            return
+        try:
+            seq, decision, ok, pid, busy = future.result()
+        except Exception as e:
+            with self._lock:
+                self._counts['failed'] += 1
+                self._pending.pop(seq, None)
+            self.log.error('classification failed', seq=seq, error=e)
+            return
+        now = time.perf_counter()
+        with self._lock:
+            pending = self._pending.pop(seq, None)
+            if pending is None:
+                # finished after stop() dropped the pending windows
+                return
+            submitted, sample_time = pending
+            self._busy[pid] += busy
+            if not ok:
+                self._counts['overwritten'] += 1
+                return
+            if seq < self._last_seq:
+                self._counts['stale'] += 1
+                return
+            self._last_seq = seq
+            self._counts['delivered'] += 1
+            self._latencies.append(now - submitted)
+        event = ClassifierDecision(seq, decision, sample_time, now - submitted)
+        self.results.put(event)
+        if self.on_decision is not None:
+            self.on_decision(event)
+
+    def stats(self):
+        """
+        To get a snapshot of the stage: windows submitted, delivered, skipped
+        (too many in flight), stale, overwritten and failed; the share of the
+        time since start() each worker spent classifying; and the latency from
+        the arrival of a window's last sample to its decision, in seconds,
+        over the last latency_window decisions.
+
+        Returns
+        -------
+        dict
+        """
+        with self._lock:
+            elapsed = time.perf_counter() - self._started if self._started else 0.0
+            counts = {key: self._counts[key] for key in
+                      ('submitted', 'delivered', 'skipped', 'stale', 'overwritten', 'failed')}
+            counts['in_flight'] = len(self._pending)
+            busy = dict(self._busy)
+            latencies = np.array(self._latencies)
+        utilization = {pid: value / elapsed for pid, value in busy.items()} if elapsed else {}
+        counts['worker_utilization'] = utilization
+        counts['utilization'] = sum(busy.values()) / (elapsed * self.workers) if elapsed else 0.0
+        if len(latencies):
+            counts['latency'] = {'p50': float(np.percentile(latencies, 50)),
+                                 'p95': float(np.percentile(latencies, 95)),
+                                 'max': float(latencies.max())}
+        else:
+            counts['latency'] = {}
+        return counts
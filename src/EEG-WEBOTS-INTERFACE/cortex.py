@@ -1,15 +1,32 @@
 import websocket #'pip install websocket-client' for install
 from datetime import datetime
 import json
+import os
 import ssl
 import time
 import sys
 from pydispatch import Dispatcher
 import warnings
 import threading
-
-
-# define request id
+import itertools
+from collections import namedtuple
+from concurrent.futures import Future
+from stream_buffer import StreamRingBuffer, StreamBlockBatcher
+from stream_bus import DEFAULT_BUS_PREFIX, DEFAULT_SHARED_CAPACITY, SharedStreamRing, segment_name
+from stream_events import (intern_action, ComEvent, FacEvent, EegEvent, MotEvent, MetEvent, PowEvent,
+                           DevEvent)
+from scheduler import Scheduler
+from session_log import SessionRecorder
+from metrics import CortexMetrics
+import telemetry
+
+
+# default Cortex service, replace with the url keyword, e.g. to use a mock service
+CORTEX_URL = "wss://localhost:6868"
+
+# define request type
+# Every request is sent with its own increasing JSON-RPC id; these values only
+# tell handle_result what kind of request a response belongs to.
 QUERY_HEADSET_ID                    =   1
 CONNECT_HEADSET_ID                  =   2
 REQUEST_ACCESS_ID                   =   3
@@ -34,9 +51,32 @@ GET_CURRENT_PROFILE_ID              =   21
 GET_CORTEX_INFO_ID                  =   22
 UPDATE_MARKER_REQUEST_ID            =   23
 UNSUB_REQUEST_ID                    =   24
+CLOSE_SESSION_ID                    =   25
 
 #define error_code
 ERR_PROFILE_ACCESS_DENIED = -32046
+ERR_INVALID_CORTEX_TOKEN = -32014
+ERR_CORTEX_TOKEN_EXPIRED = -32015
+# client side, reported through inform_error when a response does not arrive in time
+ERR_REQUEST_TIMEOUT = -1
+
+# seconds a cached cortexToken is reused before authorizing again
+DEFAULT_TOKEN_TTL = 24 * 3600
+
+# bounds of the exponential backoff between queryHeadsets while a headset connects
+HEADSET_RETRY_MIN_DELAY = 0.5
+HEADSET_RETRY_MAX_DELAY = 8.0
+
+# bounds of the exponential backoff between websocket reconnect attempts
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 8.0
+
+# seconds close() waits for the websocket thread to exit, and between its checks for close()
+CLOSE_TIMEOUT = 5.0
+CLOSE_POLL_INTERVAL = 0.5
+
+# seconds between two metrics dumps
+DEFAULT_METRICS_INTERVAL = 10.0
 
 # define warning code
 CORTEX_STOP_ALL_STREAMS = 0
@@ -58,61 +98,264 @@ HEADSET_CANNOT_WORK_WITH_BTLE = 112
 HEADSET_CANNOT_CONNECT_DISABLE_MOTION = 113
 
 
-class Cortex(Dispatcher):
+class CortexError(Exception):
+    """
+    Error response of a Cortex JSON-RPC request
+
+    Attributes
+    ----------
+    code : int
+        Cortex error code, for example ERR_PROFILE_ACCESS_DENIED
+    message : str
+        Cortex error message
+    method : str
+        the JSON-RPC method that failed
+    """
+    def __init__(self, method, error_data):
+        self.method = method
+        self.code = error_data.get('code')
+        self.message = error_data.get('message', '')
+        super().__init__('{0} failed ({1}): {2}'.format(method, self.code, self.message))
+
+
+class TokenCache():
+    """
+    A JSON file that keeps the cortexToken of each application between runs,
+    so that a restart can skip hasAccessRight and authorize.
+
+    Tokens are stored per client id and license together with an expiry time.
+    The file is only readable by its owner.
+
+    Methods
+    -------
+    load(client_id, license):
+        To get a cached token, or None if there is none or it has expired
+    store(client_id, license, token):
+        To cache a token
+    clear(client_id, license):
+        To drop a token that Cortex rejected
+    """
+    def __init__(self, path, ttl=DEFAULT_TOKEN_TTL):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, entries):
+        tmp_path = self.path + '.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+    def load(self, client_id, license=''):
+        entry = self._read().get(client_id + ':' + license)
+        if entry is None or entry['expires'] <= time.time():
+            return None
+        return entry['cortexToken']
+
+    def store(self, client_id, license, token):
+        entries = self._read()
+        entries[client_id + ':' + license] = {'cortexToken': token, 'expires': time.time() + self.ttl}
+        self._write(entries)
+
+    def clear(self, client_id, license=''):
+        entries = self._read()
+        if entries.pop(client_id + ':' + license, None) is not None:
+            self._write(entries)
+
+
+# a request waiting for its response, and the session its response is handled by
+PendingRequest = namedtuple('PendingRequest', ['request_type', 'method', 'future', 'timeout_handle', 'sent_time',
+                                               'session'])
+
+# numeric streams that can be kept in a StreamRingBuffer, batched into blocks or shared with other processes
+BUFFERED_STREAMS = ('eeg', 'mot', 'pow', 'met')
+
+# Stream decoders
+# Each factory takes the emit function, the 'cols' of the stream from the
+# subscribe response (None before subscribing), the stream buffer, the block
+# batcher and the shared ring (None if the stream is not buffered / batched /
+# shared), and returns a function that turns one data frame into a
+# 'new_*_data' event, whose data is a StreamEvent. A batched stream emits
+# 'new_*_block' events from its batcher instead.
+def make_com_decoder(emit, cols, buffer=None, batcher=None, shared=None):
+    def decode(result_dic):
+        com = result_dic['com']
+        emit('new_com_data', data=ComEvent(intern_action(com[0]), com[1], result_dic['time']))
+    return decode
+
+def make_fac_decoder(emit, cols, buffer=None, batcher=None, shared=None):
+    def decode(result_dic):
+        fac = result_dic['fac']
+        emit('new_fe_data', data=FacEvent(intern_action(fac[0]), intern_action(fac[1]), fac[2],
+                                          intern_action(fac[3]), fac[4], result_dic['time']))
+    return decode
+
+def make_eeg_decoder(emit, cols, buffer=None, batcher=None, shared=None):
+    # the MARKERS column is always the last one
+    def decode(result_dic):
+        eeg = result_dic['eeg']
+        eeg.pop() # remove markers
+        time = result_dic['time']
+        if buffer is not None:
+            buffer.append(time, eeg)
+        if shared is not None:
+            shared.append(time, eeg)
+        if batcher is not None:
+            batcher.append(time, eeg)
+        else:
+            emit('new_eeg_data', data=EegEvent(eeg, time))
+    return decode
+
+def make_dev_decoder(emit, cols, buffer=None, batcher=None, shared=None):
+    signal_idx, cq_idx, battery_idx = 1, 2, 3
+    if cols:
+        for idx, col in enumerate(cols):
+            if col == 'Signal':
+                signal_idx = idx
+            elif col == 'BatteryPercent':
+                battery_idx = idx
+            elif isinstance(col, list):
+                cq_idx = idx
+    def decode(result_dic):
+        dev = result_dic['dev']
+        emit('new_dev_data', data=DevEvent(dev[signal_idx], dev[cq_idx], dev[battery_idx], result_dic['time']))
+    return decode
+
+def make_passthrough_decoder(stream_name, event_name, event_class):
+    def factory(emit, cols, buffer=None, batcher=None, shared=None):
+        def decode(result_dic):
+            values = result_dic[stream_name]
+            time = result_dic['time']
+            if buffer is not None:
+                buffer.append(time, values)
+            if shared is not None:
+                shared.append(time, values)
+            if batcher is not None:
+                batcher.append(time, values)
+            else:
+                emit(event_name, data=event_class(values, time))
+        return decode
+    return factory
+
+def make_sys_decoder(emit, cols, buffer=None, batcher=None, shared=None):
+    def decode(result_dic):
+        emit('new_sys_data', data=result_dic['sys'])
+    return decode
+
+STREAM_DECODER_FACTORIES = {
+    'com': make_com_decoder,
+    'fac': make_fac_decoder,
+    'eeg': make_eeg_decoder,
+    'mot': make_passthrough_decoder('mot', 'new_mot_data', MotEvent),
+    'dev': make_dev_decoder,
+    'met': make_passthrough_decoder('met', 'new_met_data', MetEvent),
+    'pow': make_passthrough_decoder('pow', 'new_pow_data', PowEvent),
+    'sys': make_sys_decoder,
+}
+
+
+class CortexSession(Dispatcher):
+    """
+    A Cortex session: one headset, its profile, its subscriptions and the
+    events of its data streams.
+
+    A Cortex is itself the session of its wanted headset. Cortex.add_session()
+    adds the session of another headset, which shares the websocket and the
+    cortexToken of the client: its data frames are routed to it by their
+    'sid' and the responses to its requests are emitted on it, so the
+    listeners of each headset are bound to its own session, e.g.
+
+        c = Cortex(client_id, client_secret, headset_id='EPOCPLUS-0001')
+        lab = c.add_session('EPOCPLUS-0002', profile_name='subject-2')
+        lab.bind(create_session_done=..., new_com_data=...)
+        c.open()
+
+    A session has the session methods of Cortex: sub_request, unsub_request,
+    setup_profile, get_current_profile, create_record, inject_marker_request,
+    the mental command requests, ...
+
+    Attributes
+    ----------
+    cortex : Cortex
+        the client whose connection the session uses
+    headset_id : str
+        the headset of the session
+    session_id : str
+        id of the Cortex session, '' until it is created
+    headset_info : dict
+        the queryHeadsets entry of the headset, with its 'settings'
+    profile_name : str
+        the wanted profile, loaded_profile once it is loaded
+    subscribed_streams : set
+        the streams subscribed in this session
+    session_ready, subscribed : threading.Event
+        set once the session is created / a stream is subscribed
+    """
 
     _events_ = ['inform_error','create_session_done', 'query_profile_done', 'load_unload_profile_done', 
                 'save_profile_done', 'get_mc_active_action_done','mc_brainmap_done', 'mc_action_sensitivity_done', 
                 'mc_training_threshold_done', 'create_record_done', 'stop_record_done','warn_cortex_stop_all_sub', 
                 'inject_marker_done', 'update_marker_done', 'export_record_done', 'new_data_labels', 
                 'new_com_data', 'new_fe_data', 'new_eeg_data', 'new_mot_data', 'new_dev_data', 
-                'new_met_data', 'new_pow_data', 'new_sys_data']
-    def __init__(self, client_id, client_secret, debug_mode=False, **kwargs):
-        
+                'new_met_data', 'new_pow_data', 'new_sys_data', 'new_eeg_block', 'new_mot_block',
+                'new_met_block', 'new_pow_block', 'session_recovered', 'blink']
+
+    def __init__(self, cortex, headset_id='', profile_name=''):
+        self.cortex = cortex
+        self.log = cortex.log
+        # counters and timers are shared with the client, per stream over all sessions
+        self.metrics = cortex.metrics
+        if self.metrics is not None:
+            # time the listeners of every event; without metrics emit stays Dispatcher.emit
+            self.emit = self.timed_emit
         self.session_id = ''
-        self.headset_id = ''
-        self.debug = debug_mode
-        self.debit = 10
-        self.license = ''
-
-        if client_id == '':
-            raise ValueError('Empty your_app_client_id. Please fill in your_app_client_id before running the example.')
-        else:
-            self.client_id = client_id
-
-        if client_secret == '':
-            raise ValueError('Empty your_app_client_secret. Please fill in your_app_client_secret before running the example.')
-        else:
-            self.client_secret = client_secret
-
-        for key, value in kwargs.items():
-            print('init {0} - {1}'.format(key, value))
-            if key == 'license':
-                self.license = value
-            elif key == 'debit':
-                self.debit == value
-            elif  key == 'headset_id':
-                self.headset_id = value
-
-    def open(self):
-        url = "wss://localhost:6868"
-        # websocket.enableTrace(True)
-        self.ws = websocket.WebSocketApp(url, 
-                                        on_message=self.on_message,
-                                        on_open = self.on_open,
-                                        on_error=self.on_error,
-                                        on_close=self.on_close)
-        threadName = "WebsockThread:-{:%Y%m%d%H%M%S}".format(datetime.utcnow())
-        
-        # As default, a Emotiv self-signed certificate is required.
-        # If you don't want to use the certificate, please replace by the below line  by sslopt={"cert_reqs": ssl.CERT_NONE}
-        sslopt = {"cert_reqs": ssl.CERT_NONE}
-        
-        self.websock_thread  = threading.Thread(target=self.ws.run_forever, args=(None, sslopt), name=threadName)
-        self.websock_thread .start()
-        self.websock_thread.join()
-
-    def close(self):
-        self.ws.close()
+        self.headset_id = headset_id
+        self.headset_info = {}
+        self.profile_name = profile_name
+        self.buffers = {}
+        self.batch_settings = {}
+        self.batchers = {}
+        self.shared_rings = {}
+        self.subscribed_streams = set()
+        self.creating_session = False
+        self.headset_retry = None
+        self.headset_retry_delay = HEADSET_RETRY_MIN_DELAY
+        self.emit_time = 0.0
+
+        # supervised reconnect: what to restore after an outage
+        self.loaded_profile = ''
+        self.resume_streams = set()
+        self.recovering = False
+        self.outage_cause = ''
+        self.outage_start = 0.0
+        self.outage_request_count = 0
+        self.recovery_times = []
+
+        # readiness of the session steps
+        self.session_ready = threading.Event()
+        self.subscribed = threading.Event()
+
+        # default decoders, replaced by column-aware ones once subscribed
+        self.stream_decoders = {}
+        for stream_name in STREAM_DECODER_FACTORIES:
+            self.register_stream_decoder(stream_name)
+
+    def timed_emit(self, name, *args, **kwargs):
+        # Dispatcher.emit, timing the listeners of the event. Bound as emit with metrics on
+        start = time.perf_counter()
+        try:
+            return Dispatcher.emit(self, name, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.emit_time += elapsed
+            self.metrics.observe_handler(name, elapsed)
 
     def set_wanted_headset(self, headsetId):
         self.headset_id = headsetId
@@ -120,49 +363,62 @@ class Cortex(Dispatcher):
     def set_wanted_profile(self, profileName):
         self.profile_name = profileName
 
-    def on_open(self, *args, **kwargs):
-        print("websocket opened")
-        self.do_prepare_steps()
-
-    def on_error(self, *args):
-        if len(args) == 2:
-            print(str(args[1]))
-
-    def on_close(self, *args, **kwargs):
-        print("on_close")
-        print(args[1])
-
-    def handle_result(self, recv_dic):
-        if self.debug:
-            print(recv_dic)
+    def wait_ready(self, timeout=None):
+        # wait until at least one stream is subscribed. Returns False on timeout
+        return self.subscribed.wait(timeout)
 
-        req_id = recv_dic['id']
-        result_dic = recv_dic['result']
+    def clear_session_state(self):
+        self.cortex.sessions_by_sid.pop(self.session_id, None)
+        self.session_id = ''
+        self.creating_session = False
+        self.subscribed_streams.clear()
+        self.session_ready.clear()
+        self.subscribed.clear()
 
-        if req_id == HAS_ACCESS_RIGHT_ID:
-            access_granted = result_dic['accessGranted']
-            if access_granted == True:
-                # authorize
-                self.authorize()
-            else:
-                # request access
-                self.request_access()
-        elif req_id == REQUEST_ACCESS_ID:
-            access_granted = result_dic['accessGranted']
-
-            if access_granted == True:
-                # authorize
-                self.authorize()
-            else:
-                # wait approve from Emotiv Launcher
-                msg = result_dic['message']
-                warnings.warn(msg)
-        elif req_id == AUTHORIZE_ID:
-            print("Authorize successfully.")
-            self.auth = result_dic['cortexToken']
-            # query headsets
+    def begin_recovery(self, cause):
+        """
+        To start restoring the session after an outage. The token is reused,
+        createSession goes straight to the known headset (falling back to
+        queryHeadsets with backoff if that fails), then the loaded profile and
+        all remembered streams are restored with one setupProfile and one
+        subscribe sent together. Nothing is emitted for these steps, so the
+        callbacks of the first start do not run again; session_recovered is
+        emitted at the end with the recovery time.
+        """
+        if self.recovering:
+            return
+        self.log.warning('start recovery', cause=cause)
+        self.recovering = True
+        self.outage_cause = cause
+        self.outage_start = time.monotonic()
+        self.outage_request_count = self.cortex.request_count
+
+    def resume_session(self):
+        if self.headset_id != '':
+            self.create_session()
+        else:
             self.query_headset()
-        elif req_id == QUERY_HEADSET_ID:
+
+    def restore_session_state(self):
+        if self.loaded_profile != '':
+            self.setup_profile(self.loaded_profile, 'load')
+        if self.resume_streams:
+            self.send_sub_request(sorted(self.resume_streams))
+        else:
+            self.finish_recovery()
+
+    def finish_recovery(self):
+        recovery_time = time.monotonic() - self.outage_start
+        requests = self.cortex.request_count - self.outage_request_count
+        self.recovering = False
+        self.recovery_times.append(recovery_time)
+        self.log.info('session recovered', cause=self.outage_cause, seconds=round(recovery_time, 3), requests=requests)
+        self.emit('session_recovered', data={'cause': self.outage_cause, 'recovery_time': recovery_time,
+                                             'requests': requests, 'session_id': self.session_id})
+
+    def handle_session_result(self, req_type, method, result_dic):
+        # the response to a request of this session, see Cortex.handle_result
+        if req_type == QUERY_HEADSET_ID:
             self.headset_list = result_dic
             found_headset = False
             headset_status = ''
@@ -170,67 +426,79 @@ class Cortex(Dispatcher):
                 hs_id = ele['id']
                 status = ele['status']
                 connected_by = ele['connectedBy']
-                print('headsetId: {0}, status: {1}, connected_by: {2}'.format(hs_id, status, connected_by))
+                self.log.info('headset', id=hs_id, status=status, connected_by=connected_by)
                 if self.headset_id != '' and self.headset_id == hs_id:
                     found_headset = True
                     headset_status = status
 
+            # headsets driven by the other sessions of the connection
+            claimed = set(s.headset_id for s in self.cortex.sessions if s is not self)
+            free_headsets = [ele for ele in self.headset_list if ele['id'] not in claimed]
+            if len(free_headsets) > 0 and self.headset_id == '':
+                # set first headset is default headset, its status is already in this response
+                self.headset_id = free_headsets[0]['id']
+                found_headset = True
+                headset_status = free_headsets[0]['status']
+            self.headset_info = next((ele for ele in self.headset_list if ele['id'] == self.headset_id), {})
+
             if len(self.headset_list) == 0:
                 warnings.warn("No headset available. Please turn on a headset.")
             elif self.headset_id == '':
-                # set first headset is default headset
-                self.headset_id = self.headset_list[0]['id']
-                # call query headet again
-                self.query_headset()
+                warnings.warn("Every headset is used by another session. Please turn on one more headset.")
             elif found_headset == False:
                 warnings.warn("Can not found the headset " + self.headset_id + ". Please make sure the id is correct.")
             elif found_headset == True:
                 if headset_status == 'connected':
                     # create session with the headset
+                    self.cancel_headset_retry()
                     self.create_session()
                 elif headset_status == 'discovered':
                     self.connect_headset(self.headset_id)
+                    # HEADSET_CONNECTED normally comes first, this is the fallback
+                    self.schedule_headset_retry()
                 elif headset_status == 'connecting':
-                    # wait 3 seconds and query headset again
-                    time.sleep(3)
-                    self.query_headset()
+                    # query headset again later, without blocking the websocket thread
+                    self.schedule_headset_retry()
                 else:
                     warnings.warn('query_headset resp: Invalid connection status ' + headset_status)
-        elif req_id == CREATE_SESSION_ID:
+        elif req_type == CREATE_SESSION_ID:
+            self.creating_session = False
             self.session_id = result_dic['id']
-            print("The session " + self.session_id + " is created successfully.")
-            self.emit('create_session_done', data=self.session_id)
-        elif req_id == SUB_REQUEST_ID:
-            # handle data label
+            self.cortex.sessions_by_sid[self.session_id] = self
+            self.log.info('session created', session=self.session_id, headset=self.headset_id)
+            self.session_ready.set()
+            if self.recovering:
+                self.restore_session_state()
+            else:
+                self.emit('create_session_done', data=self.session_id)
+        elif req_type == CLOSE_SESSION_ID:
+            self.log.info('session closed', session=self.session_id)
+            self.clear_session_state()
+        elif req_type == SUB_REQUEST_ID:
+            self.handle_sub_result(result_dic)
+        elif req_type == UNSUB_REQUEST_ID:
             for stream in result_dic['success']:
                 stream_name = stream['streamName']
-                stream_labels = stream['cols']
-                print('The data stream '+ stream_name + ' is subscribed successfully.')
-                # ignore com, fac and sys data label because they are handled in on_new_data
-                if stream_name != 'com' and stream_name != 'fac':
-                    self.extract_data_labels(stream_name, stream_labels)
+                self.log.info('unsubscribed', stream=stream_name)
+                self.subscribed_streams.discard(stream_name)
+                self.resume_streams.discard(stream_name)
+                self.flush_stream_blocks([stream_name])
 
-            for stream in result_dic['failure']:
-                stream_name = stream['streamName']
-                stream_msg = stream['message']
-                print('The data stream '+ stream_name + ' is subscribed unsuccessfully. Because: ' + stream_msg)
-        elif req_id == UNSUB_REQUEST_ID:
-            for stream in result_dic['success']:
-                stream_name = stream['streamName']
-                print('The data stream '+ stream_name + ' is unsubscribed successfully.')
+            if not self.subscribed_streams:
+                self.subscribed.clear()
 
             for stream in result_dic['failure']:
                 stream_name = stream['streamName']
                 stream_msg = stream['message']
-                print('The data stream '+ stream_name + ' is unsubscribed unsuccessfully. Because: ' + stream_msg)
+                self.log.warning('unsubscribe failed', stream=stream_name, reason=stream_msg)
 
-        elif req_id == QUERY_PROFILE_ID:
+        elif req_type == QUERY_PROFILE_ID:
             profile_list = []
             for ele in result_dic:
                 name = ele['name']
                 profile_list.append(name)
             self.emit('query_profile_done', data=profile_list)
-        elif req_id == SETUP_PROFILE_ID:
+        elif req_type == SETUP_PROFILE_ID:
             action = result_dic['action']
             if action == 'create':
                 profile_name = result_dic['name']
@@ -238,46 +506,50 @@ class Cortex(Dispatcher):
                     # load profile
                     self.setup_profile(profile_name, 'load')
             elif action == 'load':
-                print('load profile successfully')
-                self.emit('load_unload_profile_done', isLoaded=True)
+                self.log.info('profile loaded', profile=result_dic.get('name', self.profile_name))
+                self.loaded_profile = result_dic.get('name', self.profile_name)
+                if not self.recovering:
+                    self.emit('load_unload_profile_done', isLoaded=True)
             elif action == 'unload':
+                self.loaded_profile = ''
                 self.emit('load_unload_profile_done', isLoaded=False)
             elif action == 'save':
                 self.emit('save_profile_done')
-        elif req_id == GET_CURRENT_PROFILE_ID:
-            print(result_dic)
+        elif req_type == GET_CURRENT_PROFILE_ID:
+            self.log.debug('current profile', result=result_dic)
             name = result_dic['name']
             if name is None:
                 # no profile loaded with the headset
-                print('get_current_profile: no profile loaded with the headset ' + self.headset_id)
+                self.log.info('no profile loaded', headset=self.headset_id)
                 self.setup_profile(self.profile_name, 'load')
             else:
                 loaded_by_this_app = result_dic['loadedByThisApp']
-                print('get current profile rsp: ' + name + ", loadedByThisApp: " + str(loaded_by_this_app))
+                self.log.info('current profile', profile=name, loaded_by_this_app=loaded_by_this_app)
                 if name != self.profile_name:
                     warnings.warn("There is profile " + name + " is loaded for headset " + self.headset_id)
                 elif loaded_by_this_app == True:
+                    self.loaded_profile = name
                     self.emit('load_unload_profile_done', isLoaded=True)
                 else:
                     self.setup_profile(self.profile_name, 'unload')
                     # warnings.warn("The profile " + name + " is loaded by other applications")
-        elif req_id == DISCONNECT_HEADSET_ID:
-            print("Disconnect headset " + self.headset_id)
+        elif req_type == DISCONNECT_HEADSET_ID:
+            self.log.info('headset disconnected', headset=self.headset_id)
             self.headset_id = ''
-        elif req_id == MENTAL_COMMAND_ACTIVE_ACTION_ID:
+        elif req_type == MENTAL_COMMAND_ACTIVE_ACTION_ID:
             self.emit('get_mc_active_action_done', data=result_dic)
-        elif req_id == MENTAL_COMMAND_TRAINING_THRESHOLD:
+        elif req_type == MENTAL_COMMAND_TRAINING_THRESHOLD:
             self.emit('mc_training_threshold_done', data=result_dic)
-        elif req_id == MENTAL_COMMAND_BRAIN_MAP_ID:
+        elif req_type == MENTAL_COMMAND_BRAIN_MAP_ID:
             self.emit('mc_brainmap_done', data=result_dic)
-        elif req_id == SENSITIVITY_REQUEST_ID:
+        elif req_type == SENSITIVITY_REQUEST_ID:
             self.emit('mc_action_sensitivity_done', data=result_dic)
-        elif req_id == CREATE_RECORD_REQUEST_ID:
+        elif req_type == CREATE_RECORD_REQUEST_ID:
             self.record_id = result_dic['record']['uuid']
             self.emit('create_record_done', data=result_dic['record'])
-        elif req_id == STOP_RECORD_REQUEST_ID:
+        elif req_type == STOP_RECORD_REQUEST_ID:
             self.emit('stop_record_done', data=result_dic['record'])
-        elif req_id == EXPORT_RECORD_ID:
+        elif req_type == EXPORT_RECORD_ID:
             # handle data lable
             success_export = []
             for record in result_dic['success']:
@@ -287,249 +559,179 @@ class Cortex(Dispatcher):
             for record in result_dic['failure']:
                 record_id = record['recordId']
                 failure_msg = record['message']
-                print('export_record resp failure cases: '+ record_id + ":" + failure_msg)
+                self.log.warning('export record failed', record=record_id, reason=failure_msg)
 
             self.emit('export_record_done', data=success_export)
-        elif req_id == INJECT_MARKER_REQUEST_ID:
+        elif req_type == INJECT_MARKER_REQUEST_ID:
             self.emit('inject_marker_done', data=result_dic['marker'])
-        elif req_id == INJECT_MARKER_REQUEST_ID:
+        elif req_type == UPDATE_MARKER_REQUEST_ID:
             self.emit('update_marker_done', data=result_dic['marker'])
         else:
-            print('No handling for response of request ' + str(req_id))
-
-    def handle_error(self, recv_dic):
-        req_id = recv_dic['id']
-        print('handle_error: request Id ' + str(req_id))
-        self.emit('inform_error', error_data=recv_dic['error'])
-    
-    def handle_warning(self, warning_dic):
+            self.log.warning('no handling for response', method=method)
+
+    def handle_sub_result(self, result_dic):
+        # handle data label. Also called by SessionReplay, which has no pending request for it
+        for stream in result_dic['success']:
+            stream_name = stream['streamName']
+            stream_labels = stream['cols']
+            self.log.info('subscribed', stream=stream_name)
+            self.subscribed_streams.add(stream_name)
+            self.resume_streams.add(stream_name)
+            # ignore com, fac and sys data label because they are handled in on_new_data
+            if stream_name != 'com' and stream_name != 'fac':
+                self.extract_data_labels(stream_name, stream_labels)
+            self.register_stream_decoder(stream_name, stream_labels)
+
+        for stream in result_dic['failure']:
+            stream_name = stream['streamName']
+            stream_msg = stream['message']
+            self.log.warning('subscribe failed', stream=stream_name, reason=stream_msg)
+
+        if self.subscribed_streams:
+            self.subscribed.set()
+        if self.recovering and self.session_id != '':
+            self.finish_recovery()
+
+    def schedule_headset_retry(self):
+        # query headsets again after a delay that doubles on every retry, up to HEADSET_RETRY_MAX_DELAY
+        with self.cortex.pending_lock:
+            if self.headset_retry is not None or self.cortex.closing:
+                return
+            delay = self.headset_retry_delay
+            self.headset_retry_delay = min(delay * 2, HEADSET_RETRY_MAX_DELAY)
+            self.headset_retry = self.cortex.scheduler.call_later(delay, self.retry_query_headset)
+
+    def retry_query_headset(self):
+        with self.cortex.pending_lock:
+            self.headset_retry = None
+        if self.cortex.closing:
+            # due just as close() ran, the websocket is gone
+            return
+        self.query_headset()
+
+    def cancel_headset_retry(self):
+        with self.cortex.pending_lock:
+            if self.headset_retry is not None:
+                self.headset_retry.cancel()
+                self.headset_retry = None
+            self.headset_retry_delay = HEADSET_RETRY_MIN_DELAY
+
+    def on_headset_connected(self, headset_id):
+        # HEADSET_CONNECTED, headset_id is None if the warning does not name the headset
+        if headset_id is not None and self.headset_id not in ('', headset_id):
+            return
+        self.cancel_headset_retry()
+        if self.session_id == '' and self.cortex.authorized.is_set():
+            if headset_id == self.headset_id:
+                # the wanted headset is ready, create the session right away
+                self.create_session()
+            else:
+                # query headset again then create session
+                self.query_headset()
 
-        if self.debug:
-            print(warning_dic)
-        warning_code = warning_dic['code']
-        warning_msg = warning_dic['message']
-        if warning_code == ACCESS_RIGHT_GRANTED:
-            # call authorize again
-            self.authorize()
-        elif warning_code == HEADSET_CONNECTED:
-            # query headset again then create session
-            self.query_headset()
-        elif warning_code == CORTEX_AUTO_UNLOAD_PROFILE:
-            self.profile_name = ''
-        elif  warning_code == CORTEX_STOP_ALL_STREAMS:
-            # print(warning_msg['behavior'])
-            session_id = warning_msg['sessionId']
-            if session_id == self.session_id:
-                self.emit('warn_cortex_stop_all_sub', data=session_id)
-                self.session_id = ''
+    def on_streams_stopped(self):
+        # CORTEX_STOP_ALL_STREAMS for this session
+        session_id = self.session_id
+        self.flush_stream_blocks()
+        self.emit('warn_cortex_stop_all_sub', data=session_id)
+        self.clear_session_state()
+        if self.cortex.auto_reconnect and not self.cortex.closing:
+            self.begin_recovery('cortex_stop_all_streams')
+            self.resume_session()
+
+    def register_stream_decoder(self, stream_name, stream_cols=None):
+        factory = STREAM_DECODER_FACTORIES.get(stream_name)
+        if factory is None:
+            return
+        self.stream_decoders[stream_name] = factory(self.emit, stream_cols, self.buffers.get(stream_name),
+                                                    self.batchers.get(stream_name),
+                                                    self.shared_rings.get(stream_name))
 
     def handle_stream_data(self, result_dic):
-        if result_dic.get('com') != None:
-            com_data = {}
-            com_data['action'] = result_dic['com'][0]
-            com_data['power'] = result_dic['com'][1]
-            com_data['time'] = result_dic['time']
-            self.emit('new_com_data', data=com_data)
-        elif result_dic.get('fac') != None:
-            fe_data = {}
-            fe_data['eyeAct'] = result_dic['fac'][0]    #eye action
-            fe_data['uAct'] = result_dic['fac'][1]      #upper action
-            fe_data['uPow'] = result_dic['fac'][2]      #upper action power
-            fe_data['lAct'] = result_dic['fac'][3]      #lower action
-            fe_data['lPow'] = result_dic['fac'][4]      #lower action power
-            fe_data['time'] = result_dic['time']
-            self.emit('new_fe_data', data=fe_data)
-        elif result_dic.get('eeg') != None:
-            eeg_data = {}
-            eeg_data['eeg'] = result_dic['eeg']
-            eeg_data['eeg'].pop() # remove markers
-            eeg_data['time'] = result_dic['time']
-            self.emit('new_eeg_data', data=eeg_data)
-        elif result_dic.get('mot') != None:
-            mot_data = {}
-            mot_data['mot'] = result_dic['mot']
-            mot_data['time'] = result_dic['time']
-            self.emit('new_mot_data', data=mot_data)
-        elif result_dic.get('dev') != None:
-            dev_data = {}
-            dev_data['signal'] = result_dic['dev'][1]
-            dev_data['dev'] = result_dic['dev'][2]
-            dev_data['batteryPercent'] = result_dic['dev'][3]
-            dev_data['time'] = result_dic['time']
-            self.emit('new_dev_data', data=dev_data)
-        elif result_dic.get('met') != None:
-            met_data = {}
-            met_data['met'] = result_dic['met']
-            met_data['time'] = result_dic['time']
-            self.emit('new_met_data', data=met_data)
-        elif result_dic.get('pow') != None:
-            pow_data = {}
-            pow_data['pow'] = result_dic['pow']
-            pow_data['time'] = result_dic['time']
-            self.emit('new_pow_data', data=pow_data)
-        elif result_dic.get('sys') != None:
-            sys_data = result_dic['sys']
-            self.emit('new_sys_data', data=sys_data)
-        else :
-            print(result_dic)
+        # a data frame holds the stream key plus 'sid' and 'time', and Cortex puts
+        # the stream key first, so normally the first lookup hits
+        stream_name = next(iter(result_dic))
+        decoder = self.stream_decoders.get(stream_name)
+        if decoder is None:
+            for stream_name in result_dic:
+                decoder = self.stream_decoders.get(stream_name)
+                if decoder is not None:
+                    break
+            else:
+                self.log.warning('unknown stream data', data=result_dic)
+                return
+        if self.metrics is None:
+            decoder(result_dic)
+            return
+        # the listeners run inside the decoder, emit() adds their time to emit_time
+        self.emit_time = 0.0
+        start = time.perf_counter()
+        decoder(result_dic)
+        end = time.perf_counter()
+        self.metrics.observe_message(stream_name, end, end - start - self.emit_time)
 
-    def on_message(self, *args):
-        recv_dic = json.loads(args[1])
-        if 'sid' in recv_dic:
-            self.handle_stream_data(recv_dic)
-        elif 'result' in recv_dic:
-            self.handle_result(recv_dic)
-        elif 'error' in recv_dic:
-            self.handle_error(recv_dic)
-        elif 'warning' in recv_dic:
-            self.handle_warning(recv_dic['warning'])
-        else:
-            raise KeyError
+    def send_request(self, request_type, request, timeout=None):
+        # over the connection of the client, the response is handled by this session
+        return self.cortex.send_request(request_type, request, timeout, session=self)
 
     def query_headset(self):
-        print('query headset --------------------------------')
         query_headset_request = {
             "jsonrpc": "2.0", 
-            "id": QUERY_HEADSET_ID,
             "method": "queryHeadsets",
             "params": {}
         }
-        if self.debug:
-            print('queryHeadsets request \n', json.dumps(query_headset_request, indent=4))
 
-        self.ws.send(json.dumps(query_headset_request, indent=4))
+        return self.send_request(QUERY_HEADSET_ID, query_headset_request)
 
     def connect_headset(self, headset_id):
-        print('connect headset --------------------------------')
         connect_headset_request = {
             "jsonrpc": "2.0", 
-            "id": CONNECT_HEADSET_ID,
             "method": "controlDevice",
             "params": {
                 "command": "connect",
                 "headset": headset_id
             }
         }
-        if self.debug:
-            print('controlDevice request \n', json.dumps(connect_headset_request, indent=4))
-
-        self.ws.send(json.dumps(connect_headset_request, indent=4))
-
-    def request_access(self):
-        print('request access --------------------------------')
-        request_access_request = {
-            "jsonrpc": "2.0", 
-            "method": "requestAccess",
-            "params": {
-                "clientId": self.client_id, 
-                "clientSecret": self.client_secret
-            },
-            "id": REQUEST_ACCESS_ID
-        }
-
-        self.ws.send(json.dumps(request_access_request, indent=4))
-
-    def has_access_right(self):
-        print('check has access right --------------------------------')
-        has_access_request = {
-            "jsonrpc": "2.0", 
-            "method": "hasAccessRight",
-            "params": {
-                "clientId": self.client_id, 
-                "clientSecret": self.client_secret
-            },
-            "id": HAS_ACCESS_RIGHT_ID
-        }
-        self.ws.send(json.dumps(has_access_request, indent=4))
-
-    def authorize(self):
-        print('authorize --------------------------------')
-        authorize_request = {
-            "jsonrpc": "2.0",
-            "method": "authorize", 
-            "params": { 
-                "clientId": self.client_id, 
-                "clientSecret": self.client_secret, 
-                "license": self.license,
-                "debit": self.debit
-            },
-            "id": AUTHORIZE_ID
-        }
-
-        if self.debug:
-            print('auth request \n', json.dumps(authorize_request, indent=4))
 
-        self.ws.send(json.dumps(authorize_request))
+        return self.send_request(CONNECT_HEADSET_ID, connect_headset_request)
 
     def create_session(self):
         if self.session_id != '':
             warnings.warn("There is existed session " + self.session_id)
             return
+        if self.creating_session:
+            # a createSession request is already in flight
+            return
+        self.creating_session = True
 
-        print('create session --------------------------------')
         create_session_request = { 
             "jsonrpc": "2.0",
-            "id": CREATE_SESSION_ID,
             "method": "createSession",
             "params": {
-                "cortexToken": self.auth,
+                "cortexToken": self.cortex.auth,
                 "headset": self.headset_id,
                 "status": "active"
             }
         }
-        
-        if self.debug:
-            print('create session request \n', json.dumps(create_session_request, indent=4))
 
-        self.ws.send(json.dumps(create_session_request))
+        return self.send_request(CREATE_SESSION_ID, create_session_request)
 
     def close_session(self):
-        print('close session --------------------------------')
         close_session_request = { 
             "jsonrpc": "2.0",
-            "id": CREATE_SESSION_ID,
             "method": "updateSession",
             "params": {
-                "cortexToken": self.auth,
+                "cortexToken": self.cortex.auth,
                 "session": self.session_id,
                 "status": "close"
             }
         }
 
-        self.ws.send(json.dumps(close_session_request))
-
-    def get_cortex_info(self):
-        print('get cortex version --------------------------------')
-        get_cortex_info_request = {
-            "jsonrpc": "2.0",
-            "method": "getCortexInfo",
-            "id":GET_CORTEX_INFO_ID
-        }
-
-        self.ws.send(json.dumps(get_cortex_info_request))
-
-    """
-        Prepare steps include:
-        Step 1: check access right. If user has not granted for the application, requestAccess will be called
-        Step 2: authorize: to generate a Cortex access token which is required parameter of many APIs
-        Step 3: Connect a headset. If no wanted headet is set, the first headset in the list will be connected.
-                If you use EPOC Flex headset, you should connect the headset with a proper mappings via EMOTIV Launcher first 
-        Step 4: Create a working session with the connected headset
-        Returns
-        -------
-        None
-        """
-
-    def do_prepare_steps(self):
-        print('do_prepare_steps--------------------------------')
-        # check access right
-        self.has_access_right()
+        return self.send_request(CLOSE_SESSION_ID, close_session_request)
 
     def disconnect_headset(self):
-        print('disconnect headset --------------------------------')
         disconnect_headset_request = {
             "jsonrpc": "2.0", 
-            "id": DISCONNECT_HEADSET_ID,
             "method": "controlDevice",
             "params": {
                 "command": "disconnect",
@@ -537,41 +739,64 @@ class Cortex(Dispatcher):
             }
         }
 
-        self.ws.send(json.dumps(disconnect_headset_request))
+        return self.send_request(DISCONNECT_HEADSET_ID, disconnect_headset_request)
+
+    def sub_request(self, stream, batch_size=0, batch_interval_ms=0):
+        """
+        To subscribe to one or more data streams.
+        With batch_size or batch_interval_ms set, the numeric streams among them
+        ('eeg', 'mot', 'pow', 'met') emit one 'new_*_block' event per block, with
+        data={<stream>: 2-D float32 array, 'time': timestamp vector}, instead of
+        one 'new_*_data' event per sample. Pending samples are flushed on
+        unsubscribe and close().
+
+        Parameters
+        ----------
+        stream : list, required
+            list of streams. For example, ['eeg', 'pow']
+        batch_size : int, optional
+            emit a block once it holds this many samples
+        batch_interval_ms : int, optional
+            emit a block once it spans this many milliseconds of Cortex time
+
+        Returns
+        -------
+        None
+        """
+        for stream_name in stream:
+            if stream_name not in BUFFERED_STREAMS:
+                continue
+            if batch_size > 0 or batch_interval_ms > 0:
+                self.batch_settings[stream_name] = (batch_size, batch_interval_ms / 1000.0)
+            else:
+                self.batch_settings.pop(stream_name, None)
+        return self.send_sub_request(stream)
 
-    def sub_request(self, stream):
-        print('subscribe request --------------------------------')
+    def send_sub_request(self, stream):
         sub_request_json = {
             "jsonrpc": "2.0", 
             "method": "subscribe", 
             "params": { 
-                "cortexToken": self.auth,
+                "cortexToken": self.cortex.auth,
                 "session": self.session_id,
                 "streams": stream
             }, 
-            "id": SUB_REQUEST_ID
         }
-        if self.debug:
-            print('subscribe request \n', json.dumps(sub_request_json, indent=4))
 
-        self.ws.send(json.dumps(sub_request_json))
+        return self.send_request(SUB_REQUEST_ID, sub_request_json)
 
     def unsub_request(self, stream):
-        print('unsubscribe request --------------------------------')
         unsub_request_json = {
             "jsonrpc": "2.0", 
             "method": "unsubscribe", 
             "params": { 
-                "cortexToken": self.auth,
+                "cortexToken": self.cortex.auth,
                 "session": self.session_id,
                 "streams": stream
             }, 
-            "id": UNSUB_REQUEST_ID
         }
-        if self.debug:
-            print('unsubscribe request \n', json.dumps(unsub_request_json, indent=4))
 
-        self.ws.send(json.dumps(unsub_request_json))
+        return self.send_request(UNSUB_REQUEST_ID, unsub_request_json)
 
     def extract_data_labels(self, stream_name, stream_cols):
         labels = {}
@@ -588,94 +813,156 @@ class Cortex(Dispatcher):
             data_labels = stream_cols
 
         labels['labels'] = data_labels
-        print(labels)
+        self.log.info('data labels', stream=stream_name, labels=data_labels)
+        # create the buffer first so that new_data_labels listeners can pick it up
+        self.create_stream_buffer(stream_name, data_labels)
+        self.create_shared_ring(stream_name, data_labels)
+        self.create_stream_batcher(stream_name, data_labels)
         self.emit('new_data_labels', data=labels)
 
+    def create_stream_buffer(self, stream_name, data_labels):
+        if stream_name not in BUFFERED_STREAMS:
+            return
+        buffer_capacity = self.cortex.buffer_capacity
+        if isinstance(buffer_capacity, dict):
+            capacity = buffer_capacity.get(stream_name, 0)
+        else:
+            capacity = buffer_capacity
+        buffer = self.buffers.get(stream_name)
+        if buffer is not None and buffer.labels == list(data_labels):
+            # resubscribed with the same columns: keep the buffer readers already hold
+            return
+        if capacity > 0:
+            self.buffers[stream_name] = StreamRingBuffer(capacity, data_labels)
+
+    def create_shared_ring(self, stream_name, data_labels):
+        prefix = self.cortex.shared_prefix
+        if stream_name not in BUFFERED_STREAMS or not prefix:
+            return
+        shared_capacity = self.cortex.shared_capacity
+        if isinstance(shared_capacity, dict):
+            capacity = shared_capacity.get(stream_name, 0)
+        else:
+            capacity = shared_capacity
+        ring = self.shared_rings.get(stream_name)
+        if ring is not None:
+            if ring.labels == list(data_labels):
+                # resubscribed with the same columns: readers keep reading the same segment
+                return
+            # readers see the old segment closed and attach to the new one
+            self.shared_rings.pop(stream_name).close()
+        if capacity > 0:
+            name = segment_name(prefix, stream_name, '' if self.cortex is self else self.headset_id)
+            self.shared_rings[stream_name] = SharedStreamRing(name, capacity, data_labels)
+            self.log.info('shared stream', stream=stream_name, segment=name, capacity=capacity)
+
+    def close_shared_rings(self):
+        # unlink the segments, the decoders stop writing to them
+        for stream_name in list(self.shared_rings):
+            self.shared_rings.pop(stream_name).close()
+            self.register_stream_decoder(stream_name)
+
+    def create_stream_batcher(self, stream_name, data_labels):
+        settings = self.batch_settings.get(stream_name)
+        if settings is None:
+            self.batchers.pop(stream_name, None)
+            return
+        event_name = 'new_{}_block'.format(stream_name)
+        def on_block(times, samples):
+            self.emit(event_name, data={stream_name: samples, 'time': times})
+        batch_size, batch_interval = settings
+        self.batchers[stream_name] = batcher = StreamBlockBatcher(batch_size, batch_interval, data_labels, on_block)
+        if self.metrics is not None:
+            gauge = stream_name + '_block_fill'
+            if self.cortex is not self:
+                gauge = self.headset_id + '/' + gauge
+            self.metrics.register_gauge(gauge, batcher.__len__)
+
+    def flush_stream_blocks(self, streams=None):
+        # emit the pending samples of the batched streams and stop batching them
+        if streams is None:
+            streams = list(self.batchers)
+        for stream_name in streams:
+            batcher = self.batchers.pop(stream_name, None)
+            if batcher is not None:
+                batcher.flush()
+                self.register_stream_decoder(stream_name)
+
+    def get_stream_buffer(self, stream_name):
+        # None if the stream is not subscribed or not buffered
+        return self.buffers.get(stream_name)
+
+    def get_shared_ring(self, stream_name):
+        # None if the stream is not subscribed or not shared
+        return self.shared_rings.get(stream_name)
+
+    def get_sampling_rate(self, stream_name='eeg'):
+        # samples per second of 'eeg' or 'mot' from the headset settings, None if not reported
+        key = {'eeg': 'eegRate', 'mot': 'memsRate'}.get(stream_name)
+        rate = self.headset_info.get('settings', {}).get(key)
+        return float(rate) if rate else None
+
     def query_profile(self):
-        print('query profile --------------------------------')
         query_profile_json = {
             "jsonrpc": "2.0",
             "method": "queryProfile",
             "params": {
-              "cortexToken": self.auth,
+              "cortexToken": self.cortex.auth,
             },
-            "id": QUERY_PROFILE_ID
         }
 
-        if self.debug:
-            print('query profile request \n', json.dumps(query_profile_json, indent=4))
-            print('\n')
-
-        self.ws.send(json.dumps(query_profile_json))
+        return self.send_request(QUERY_PROFILE_ID, query_profile_json)
 
     def get_current_profile(self):
-        print('get current profile:')
         get_profile_json = {
             "jsonrpc": "2.0",
             "method": "getCurrentProfile",
             "params": {
-              "cortexToken": self.auth,
+              "cortexToken": self.cortex.auth,
               "headset": self.headset_id,
             },
-            "id": GET_CURRENT_PROFILE_ID
         }
-        
-        if self.debug:
-            print('get current profile json:\n', json.dumps(get_profile_json, indent=4))
-            print('\n')
 
-        self.ws.send(json.dumps(get_profile_json))
+        return self.send_request(GET_CURRENT_PROFILE_ID, get_profile_json)
 
     def setup_profile(self, profile_name, status):
-        print('setup profile: ' + status + ' -------------------------------- ')
         setup_profile_json = {
             "jsonrpc": "2.0",
             "method": "setupProfile",
             "params": {
-              "cortexToken": self.auth,
+              "cortexToken": self.cortex.auth,
               "headset": self.headset_id,
               "profile": profile_name,
               "status": status
             },
-            "id": SETUP_PROFILE_ID
         }
-        
-        if self.debug:
-            print('setup profile json:\n', json.dumps(setup_profile_json, indent=4))
-            print('\n')
 
-        self.ws.send(json.dumps(setup_profile_json))
+        return self.send_request(SETUP_PROFILE_ID, setup_profile_json)
 
     def train_request(self, detection, action, status):
-        print('train request --------------------------------')
         train_request_json = {
             "jsonrpc": "2.0", 
             "method": "training", 
             "params": {
-              "cortexToken": self.auth,
+              "cortexToken": self.cortex.auth,
               "detection": detection,
               "session": self.session_id,
               "action": action,
               "status": status
             }, 
-            "id": TRAINING_ID
         }
-        if self.debug:
-            print('training request:\n', json.dumps(train_request_json, indent=4))
-            print('\n')
 
-        self.ws.send(json.dumps(train_request_json))
+        return self.send_request(TRAINING_ID, train_request_json)
 
     def create_record(self, title, **kwargs):
-        print('create record --------------------------------')
 
         if (len(title) == 0):
             warnings.warn('Empty record_title. Please fill the record_title before running script.')
             # close socket
-            self.close()
+            self.cortex.close()
             return
 
-        params_val = {"cortexToken": self.auth, "session": self.session_id, "title": title}
+        params_val = {"cortexToken": self.cortex.auth, "session": self.session_id, "title": title}
 
         for key, value in kwargs.items():
             params_val.update({key: value})
@@ -684,40 +971,32 @@ class Cortex(Dispatcher):
             "jsonrpc": "2.0", 
             "method": "createRecord",
             "params": params_val, 
-            "id": CREATE_RECORD_REQUEST_ID
         }
-        if self.debug:
-            print('create record request:\n', json.dumps(create_record_request, indent=4))
 
-        self.ws.send(json.dumps(create_record_request))
+        return self.send_request(CREATE_RECORD_REQUEST_ID, create_record_request)
 
     def stop_record(self):
-        print('stop record --------------------------------')
         stop_record_request = {
             "jsonrpc": "2.0", 
             "method": "stopRecord",
             "params": {
-                "cortexToken": self.auth,
+                "cortexToken": self.cortex.auth,
                 "session": self.session_id
             }, 
 
-            "id": STOP_RECORD_REQUEST_ID
         }
-        if self.debug:
-            print('stop record request:\n', json.dumps(stop_record_request, indent=4))
-        self.ws.send(json.dumps(stop_record_request))
+        return self.send_request(STOP_RECORD_REQUEST_ID, stop_record_request)
 
     def export_record(self, folder, stream_types, export_format, record_ids,
                       version, **kwargs):
-        print('export record --------------------------------: ')
         #validate destination folder
         if (len(folder) == 0):
             warnings.warn('Invalid folder parameter. Please set a writable destination folder for exporting data.')
             # close socket
-            self.close()
+            self.cortex.close()
             return
 
-        params_val = {"cortexToken": self.auth, 
+        params_val = {"cortexToken": self.cortex.auth, 
                       "folder": folder,
                       "format": export_format,
                       "streamTypes": stream_types,
@@ -731,20 +1010,14 @@ class Cortex(Dispatcher):
 
         export_record_request = {
             "jsonrpc": "2.0",
-            "id":EXPORT_RECORD_ID,
             "method": "exportRecord", 
             "params": params_val
         }
 
-        if self.debug:
-            print('export record request \n',
-                json.dumps(export_record_request, indent=4))
-        
-        self.ws.send(json.dumps(export_record_request))
+        return self.send_request(EXPORT_RECORD_ID, export_record_request)
 
     def inject_marker_request(self, time, value, label, **kwargs):
-        print('inject marker --------------------------------')
-        params_val = {"cortexToken": self.auth, 
+        params_val = {"cortexToken": self.cortex.auth, 
                       "session": self.session_id, 
                       "time": time,
                       "value": value,
@@ -755,17 +1028,13 @@ class Cortex(Dispatcher):
 
         inject_marker_request = {
             "jsonrpc": "2.0",
-            "id": INJECT_MARKER_REQUEST_ID,
             "method": "injectMarker", 
             "params": params_val
         }
-        if self.debug:
-            print('inject marker request \n', json.dumps(inject_marker_request, indent=4))
-        self.ws.send(json.dumps(inject_marker_request))
+        return self.send_request(INJECT_MARKER_REQUEST_ID, inject_marker_request)
 
     def update_marker_request(self, markerId, time, **kwargs):
-        print('update marker --------------------------------')
-        params_val = {"cortexToken": self.auth, 
+        params_val = {"cortexToken": self.cortex.auth, 
                       "session": self.session_id,
                       "markerId": markerId,
                       "time": time}
@@ -775,117 +1044,662 @@ class Cortex(Dispatcher):
 
         update_marker_request = {
             "jsonrpc": "2.0",
-            "id": UPDATE_MARKER_REQUEST_ID,
             "method": "updateMarker", 
             "params": params_val
         }
-        if self.debug:
-            print('update marker request \n', json.dumps(update_marker_request, indent=4))
-        self.ws.send(json.dumps(update_marker_request))
+        return self.send_request(UPDATE_MARKER_REQUEST_ID, update_marker_request)
 
     def get_mental_command_action_sensitivity(self, profile_name):
-        print('get mental command sensitivity ------------------')
         sensitivity_request = {
-            "id": SENSITIVITY_REQUEST_ID,
             "jsonrpc": "2.0",
             "method": "mentalCommandActionSensitivity",
             "params": {
-                "cortexToken": self.auth,
+                "cortexToken": self.cortex.auth,
                 "profile": profile_name,
                 "status": "get"
             }
         }
-        if self.debug:
-            print('get mental command sensitivity \n', json.dumps(sensitivity_request, indent=4))
 
-        self.ws.send(json.dumps(sensitivity_request))
+        return self.send_request(SENSITIVITY_REQUEST_ID, sensitivity_request)
 
     def set_mental_command_action_sensitivity(self, profile_name, values):
-        print('set mental command sensitivity ------------------')
         sensitivity_request = {
-                                "id": SENSITIVITY_REQUEST_ID,
                                 "jsonrpc": "2.0",
                                 "method": "mentalCommandActionSensitivity",
                                 "params": {
-                                    "cortexToken": self.auth,
+                                    "cortexToken": self.cortex.auth,
                                     "profile": profile_name,
                                     "session": self.session_id,
                                     "status": "set",
                                     "values": values
                                 }
                             }
-        if self.debug:
-            print('set mental command sensitivity \n', json.dumps(sensitivity_request, indent=4))
             
-        self.ws.send(json.dumps(sensitivity_request))
+        return self.send_request(SENSITIVITY_REQUEST_ID, sensitivity_request)
 
     def get_mental_command_active_action(self, profile_name):
-        print('get mental command active action ------------------')
         command_active_request = {
-            "id": MENTAL_COMMAND_ACTIVE_ACTION_ID,
             "jsonrpc": "2.0",
             "method": "mentalCommandActiveAction",
             "params": {
-                "cortexToken": self.auth,
+                "cortexToken": self.cortex.auth,
                 "profile": profile_name,
                 "status": "get"
             }
         }
-        if self.debug:
-            print('get mental command active action \n', json.dumps(command_active_request, indent=4))
 
-        self.ws.send(json.dumps(command_active_request))
+        return self.send_request(MENTAL_COMMAND_ACTIVE_ACTION_ID, command_active_request)
 
     def set_mental_command_active_action(self, actions):
-        print('set mental command active action ------------------')
         command_active_request = {
-            "id": SET_MENTAL_COMMAND_ACTIVE_ACTION_ID,
             "jsonrpc": "2.0",
             "method": "mentalCommandActiveAction",
             "params": {
-                "cortexToken": self.auth,
+                "cortexToken": self.cortex.auth,
                 "session": self.session_id,
                 "status": "set",
                 "actions": actions
             }
         }
 
-        if self.debug:
-            print('set mental command active action \n', json.dumps(command_active_request, indent=4))
-
-        self.ws.send(json.dumps(command_active_request))
+        return self.send_request(SET_MENTAL_COMMAND_ACTIVE_ACTION_ID, command_active_request)
 
     def get_mental_command_brain_map(self, profile_name):
-        print('get mental command brain map ------------------')
         brain_map_request = {
-            "id": MENTAL_COMMAND_BRAIN_MAP_ID,
             "jsonrpc": "2.0",
             "method": "mentalCommandBrainMap",
             "params": {
-                "cortexToken": self.auth,
+                "cortexToken": self.cortex.auth,
                 "profile": profile_name,
                 "session": self.session_id
             }
         }
-        if self.debug:
-            print('get mental command brain map \n', json.dumps(brain_map_request, indent=4))
-        self.ws.send(json.dumps(brain_map_request))
+        return self.send_request(MENTAL_COMMAND_BRAIN_MAP_ID, brain_map_request)
 
     def get_mental_command_training_threshold(self, profile_name):
-        print('get mental command training threshold -------------')
         training_threshold_request = {
-            "id": MENTAL_COMMAND_TRAINING_THRESHOLD,
             "jsonrpc": "2.0",
             "method": "mentalCommandTrainingThreshold",
             "params": {
-                "cortexToken": self.auth,
+                "cortexToken": self.cortex.auth,
                 "session": self.session_id
             }
         }
-        if self.debug:
-            print('get mental command training threshold \n', json.dumps(training_threshold_request, indent=4))
-        self.ws.send(json.dumps(training_threshold_request))
+        return self.send_request(MENTAL_COMMAND_TRAINING_THRESHOLD, training_threshold_request)
+
+
+class Cortex(CortexSession):
+    """
+    A client of the Cortex service: the websocket, the authorization and the
+    pending requests, and the session of the wanted headset (see
+    CortexSession). More headsets are driven over the same connection with
+    add_session().
+    """
+    def __init__(self, client_id, client_secret, debug_mode=False, **kwargs):
+        
+        self.url = CORTEX_URL
+        self.auth = ''
+        self.debug = debug_mode
+        self.log = telemetry.get_logger('cortex', telemetry.DEBUG if debug_mode else None)
+        self.debit = 10
+        self.license = ''
+        self.buffer_capacity = 0
+        self.shared_prefix = ''
+        self.shared_capacity = DEFAULT_SHARED_CAPACITY
+        self.request_timeout = 0
+        self.request_ids = itertools.count(1)
+        self.pending_requests = {}
+        self.pending_lock = threading.Lock()
+        self.token_cache = None
+        self.auth_from_cache = False
+        self.scheduler = Scheduler()
+
+        # supervised reconnect
+        self.auto_reconnect = False
+        self.closing = False
+        self.open_count = 0
+        self.request_count = 0
+        self.recorder = None
+
+        # hot path counters and timers, see stats(). Off by default: they time every frame
+        # and every event, which bench_stream_decode measures at about 2.5 us per frame,
+        # roughly 30% of a dispatch. metrics=True, or a metrics_dump file, turns them on
+        self.metrics = CortexMetrics() if kwargs.get('metrics', bool(kwargs.get('metrics_dump'))) else None
+        self.metrics_dump = ''
+        self.metrics_interval = DEFAULT_METRICS_INTERVAL
+
+        # readiness of the prepare steps, for callers that do not block in open()
+        self.connected = threading.Event()
+        self.authorized = threading.Event()
+
+        # the client is the session of its own headset, add_session() adds more.
+        # Stream frames are routed to their session by 'sid'
+        CortexSession.__init__(self, self)
+        self.sessions = [self]
+        self.sessions_by_sid = {}
+
+        if client_id == '':
+            raise ValueError('Empty your_app_client_id. Please fill in your_app_client_id before running the example.')
+        else:
+            self.client_id = client_id
+
+        if client_secret == '':
+            raise ValueError('Empty your_app_client_secret. Please fill in your_app_client_secret before running the example.')
+        else:
+            self.client_secret = client_secret
+
+        for key, value in kwargs.items():
+            self.log.info('init', option=key, value=value)
+            if key == 'license':
+                self.license = value
+            elif key == 'debit':
+                self.debit == value
+            elif  key == 'headset_id':
+                self.headset_id = value
+            elif key == 'url':
+                self.url = value
+            elif key == 'request_timeout':
+                # seconds, 0 for none. A number for every request, or a dict of method -> seconds
+                self.request_timeout = value
+            elif key == 'auto_reconnect':
+                self.auto_reconnect = value
+            elif key == 'token_cache':
+                # path of a TokenCache file, or a TokenCache
+                self.token_cache = value if isinstance(value, TokenCache) else TokenCache(value)
+            elif key == 'buffer_capacity':
+                # int for every numeric stream, or a dict of stream name -> capacity
+                self.buffer_capacity = value
+            elif key == 'shared_streams':
+                # prefix of the shared memory segments of the numeric streams, True for DEFAULT_BUS_PREFIX.
+                # Other processes read them with stream_bus.SharedStreamReader
+                self.shared_prefix = DEFAULT_BUS_PREFIX if value is True else (value or '')
+            elif key == 'shared_capacity':
+                # int for every shared stream, or a dict of stream name -> capacity
+                self.shared_capacity = value
+            elif key == 'metrics':
+                # True to turn the counters and timers on, read above before the session is set up
+                pass
+            elif key == 'metrics_dump':
+                # file the metrics are written to every metrics_interval seconds, .prom for Prometheus text
+                self.metrics_dump = value
+            elif key == 'metrics_interval':
+                self.metrics_interval = value
+            elif key == 'record':
+                # path of a session log, or a SessionRecorder, receiving every incoming frame
+                self.recorder = value if isinstance(value, SessionRecorder) else SessionRecorder(value)
+
+        if self.metrics is not None:
+            self.metrics.register_gauge('pending_requests', self.pending_requests.__len__)
+            # the scheduler is replaced when the client is opened again after close()
+            self.metrics.register_gauge('scheduled_callbacks', lambda: len(self.scheduler))
+            if self.metrics_dump:
+                self.scheduler.call_later(self.metrics_interval, self.dump_metrics)
+
+    def open(self, block=True):
+        """
+        To open the websocket and start the prepare steps.
+
+        Parameters
+        ----------
+        block : bool, optional
+            If True, wait until the websocket is closed. If False, return at once
+            and let the caller wait on the readiness events connected, authorized,
+            session_ready and subscribed, e.g. c.subscribed.wait(10). The
+            websocket thread is then a daemon thread.
+
+        With auto_reconnect=True, a dropped websocket is reopened with backoff
+        until close() is called, and the session, loaded profile and
+        subscriptions are restored (see begin_recovery).
+
+        Returns
+        -------
+        None
+        """
+        # websocket.enableTrace(True)
+        self.ws = websocket.WebSocketApp(self.url, 
+                                        on_message=self.on_message,
+                                        on_open = self.on_open,
+                                        on_error=self.on_error,
+                                        on_close=self.on_close)
+        threadName = "WebsockThread:-{:%Y%m%d%H%M%S}".format(datetime.utcnow())
+        
+        # As default, a Emotiv self-signed certificate is required.
+        # If you don't want to use the certificate, please replace by the below line  by sslopt={"cert_reqs": ssl.CERT_NONE}
+        sslopt = {"cert_reqs": ssl.CERT_NONE}
+        
+        if self.closing:
+            # opened again after close(), which stopped the scheduler
+            self.scheduler = Scheduler()
+            if self.metrics is not None and self.metrics_dump:
+                self.scheduler.call_later(self.metrics_interval, self.dump_metrics)
+        self.closing = False
+        self.websock_thread  = threading.Thread(target=self.run_websocket, args=(sslopt,), name=threadName)
+        self.websock_thread.daemon = not block
+        self.websock_thread .start()
+        if block:
+            self.websock_thread.join()
+
+    def run_websocket(self, sslopt):
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            open_count = self.open_count
+            # without pings, ping_timeout only bounds the wait for a frame, so the
+            # thread sees close() even though the closed socket is never readable
+            self.ws.run_forever(None, sslopt, ping_timeout=CLOSE_POLL_INTERVAL)
+            if not self.auto_reconnect or self.closing:
+                return
+            if self.open_count != open_count:
+                # the connection was up, start again from the shortest delay
+                delay = RECONNECT_MIN_DELAY
+            self.log.warning('websocket closed, reconnecting', delay=delay)
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def close(self):
+        self.closing = True
+        self.ws.close()
+        # the decoders run on the websocket thread: let it finish the frame it is
+        # handling before the blocks, rings and recorder it writes to are closed
+        thread = getattr(self, 'websock_thread', None)
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(CLOSE_TIMEOUT)
+        for session in self.sessions:
+            session.cancel_headset_retry()
+            session.flush_stream_blocks()
+            session.close_shared_rings()
+        # drop the request timeouts and metrics dumps still queued
+        self.scheduler.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.metrics is not None and self.metrics_dump:
+            self.metrics.dump(self.metrics_dump)
+
+    def stats(self):
+        """
+        To get a snapshot of the counters and timers: messages and rate per
+        stream, decode time per stream, listener time per event, round-trip
+        time, errors and timeouts per JSON-RPC method, and queue depths.
+        Times are in seconds.
+
+        Returns
+        -------
+        dict
+            empty unless the client was created with metrics=True or a metrics_dump file
+        """
+        if self.metrics is None:
+            return {}
+        return self.metrics.stats()
+
+    def dump_metrics(self):
+        # runs on the scheduler thread every metrics_interval seconds until close()
+        if self.closing:
+            return
+        try:
+            self.metrics.dump(self.metrics_dump)
+        except OSError as e:
+            self.log.error('dump_metrics failed', error=e)
+        self.scheduler.call_later(self.metrics_interval, self.dump_metrics)
+
+    def add_session(self, headset_id, profile_name=''):
+        """
+        To drive one more headset over this connection and cortexToken. The
+        session is created as soon as the client is authorized, or right away
+        if it already is, and is restored with the others after an outage.
+
+        Parameters
+        ----------
+        headset_id : str, required
+            the headset of the session, not used by another session of the client
+        profile_name : str, optional
+            the profile of the session, see CortexSession.set_wanted_profile
+
+        Returns
+        -------
+        CortexSession
+            bind the listeners of the headset to it
+        """
+        if headset_id == '':
+            raise ValueError('Empty headset_id. A session added to the client needs the id of its headset.')
+        for session in self.sessions:
+            if session.headset_id == headset_id:
+                raise ValueError('There is already a session for the headset ' + headset_id)
+        session = CortexSession(self, headset_id, profile_name)
+        self.sessions.append(session)
+        if self.authorized.is_set():
+            session.query_headset()
+        return session
+
+    def remove_session(self, session):
+        """
+        To stop driving the headset of a session added with add_session: its
+        pending stream blocks are emitted, its shared stream segments unlinked
+        and the Cortex session is closed.
+
+        Returns
+        -------
+        None
+        """
+        if session is self:
+            raise ValueError('The session of the client itself can not be removed, close() the client instead.')
+        self.sessions.remove(session)
+        session.cancel_headset_retry()
+        session.flush_stream_blocks()
+        session.close_shared_rings()
+        session.resume_streams.clear()
+        session.recovering = False
+        if session.session_id != '':
+            session.close_session()
+
+    def start_sessions(self):
+        # once authorized: create the sessions that do not exist, restoring the ones lost in an outage
+        for session in list(self.sessions):
+            if session.session_id != '':
+                continue
+            if session.recovering:
+                session.resume_session()
+            else:
+                session.query_headset()
+
+    def on_open(self, *args, **kwargs):
+        self.log.info('websocket opened', url=self.url)
+        self.open_count += 1
+        self.connected.set()
+        self.do_prepare_steps()
+
+    def on_error(self, *args):
+        if len(args) == 2:
+            self.log.error('websocket error', error=args[1])
+
+    def on_close(self, *args, **kwargs):
+        self.log.info('websocket closed', status=args[1])
+        self.connected.clear()
+        self.authorized.clear()
+        self.fail_pending_requests('websocket closed')
+        for session in self.sessions:
+            if self.auto_reconnect and not self.closing and session.session_id != '':
+                session.begin_recovery('websocket_closed')
+            session.cancel_headset_retry()
+            session.clear_session_state()
+
+    def handle_result(self, recv_dic):
+        self.log.debug('result', response=recv_dic)
+
+        req_id = recv_dic['id']
+        result_dic = recv_dic['result']
+
+        pending = self.pop_pending_request(req_id)
+        if pending is None:
+            self.log.warning('no pending request for response', id=req_id)
+            return
+        if self.metrics is not None:
+            self.metrics.observe_rtt(pending.method, time.perf_counter() - pending.sent_time)
+        req_type = pending.request_type
+
+        try:
+            if req_type == HAS_ACCESS_RIGHT_ID:
+                access_granted = result_dic['accessGranted']
+                if access_granted == True:
+                    # authorize
+                    self.authorize()
+                else:
+                    # request access
+                    self.request_access()
+            elif req_type == REQUEST_ACCESS_ID:
+                access_granted = result_dic['accessGranted']
+
+                if access_granted == True:
+                    # authorize
+                    self.authorize()
+                else:
+                    # wait approve from Emotiv Launcher
+                    msg = result_dic['message']
+                    warnings.warn(msg)
+            elif req_type == AUTHORIZE_ID:
+                self.log.info('authorized')
+                self.auth = result_dic['cortexToken']
+                self.auth_from_cache = False
+                if self.token_cache is not None:
+                    self.token_cache.store(self.client_id, self.license, self.auth)
+                self.authorized.set()
+                # query headsets, for every session
+                self.start_sessions()
+            else:
+                pending.session.handle_session_result(req_type, pending.method, result_dic)
+        finally:
+            # resolved even if a handler or listener raises, so that no caller waits for the timeout
+            pending.future.set_result(result_dic)
+
+    def handle_error(self, recv_dic):
+        req_id = recv_dic['id']
+        self.log.warning('error response', id=req_id, error=recv_dic['error'])
+        pending = self.pop_pending_request(req_id)
+        if pending is not None and self.metrics is not None:
+            self.metrics.observe_rtt(pending.method, time.perf_counter() - pending.sent_time)
+            self.metrics.observe_error(pending.method)
+        error_code = recv_dic['error'].get('code')
+        token_rejected = error_code in (ERR_INVALID_CORTEX_TOKEN, ERR_CORTEX_TOKEN_EXPIRED)
+        # the error is reported by the session that sent the request
+        session = self if pending is None else pending.session
+        if pending is not None and pending.request_type == CREATE_SESSION_ID:
+            session.creating_session = False
+            if session.recovering and not token_rejected:
+                # the headset may be gone or reconnecting: query it again with backoff
+                session.schedule_headset_retry()
+
+        try:
+            if self.auth_from_cache and token_rejected:
+                # the reused token was rejected: drop it and run the full prepare steps
+                self.log.warning('cached cortexToken rejected, authorize again')
+                self.auth_from_cache = False
+                self.authorized.clear()
+                if self.token_cache is not None:
+                    self.token_cache.clear(self.client_id, self.license)
+                self.has_access_right()
+            else:
+                session.emit('inform_error', error_data=recv_dic['error'])
+        finally:
+            # failed even if a listener raises
+            if pending is not None:
+                pending.future.set_exception(CortexError(pending.method, recv_dic['error']))
+
+    def send_request(self, request_type, request, timeout=None, session=None):
+        """
+        To send a JSON-RPC request with a new id and track it until its response arrives.
+        Several requests of the same type can be in flight at once.
+
+        Parameters
+        ----------
+        request_type : int, required
+            one of the request type constants, used by handle_result to handle the response
+        request : dict, required
+            the request without "id"
+        timeout : float, optional
+            seconds to wait for the response. If None, request_timeout is used.
+            On timeout, inform_error is emitted with code ERR_REQUEST_TIMEOUT
+        session : CortexSession, optional
+            the session that handles the response and emits its events, the client itself if None
+
+        Returns
+        -------
+        concurrent.futures.Future
+            resolved with the 'result' of the response, or failed with CortexError, TimeoutError,
+            or ConnectionError if the websocket closes first
+        """
+        method = request['method']
+        if timeout is None:
+            if isinstance(self.request_timeout, dict):
+                timeout = self.request_timeout.get(method, 0)
+            else:
+                timeout = self.request_timeout
+
+        req_id = next(self.request_ids)
+        request['id'] = req_id
+        self.request_count += 1
+        future = Future()
+        with self.pending_lock:
+            timeout_handle = None
+            if timeout:
+                timeout_handle = self.scheduler.call_later(timeout, self.on_request_timeout, req_id, timeout)
+            self.pending_requests[req_id] = PendingRequest(request_type, method, future, timeout_handle,
+                                                           time.perf_counter(), session or self)
+        self.log.info('request', method=method, id=req_id)
+        self.log.debug('request body', request=request)
+        self.ws.send(json.dumps(request))
+        return future
+
+    def pop_pending_request(self, req_id):
+        with self.pending_lock:
+            pending = self.pending_requests.pop(req_id, None)
+        if pending is not None and pending.timeout_handle is not None:
+            pending.timeout_handle.cancel()
+        return pending
+
+    def fail_pending_requests(self, reason):
+        # the responses of a closed connection never arrive: fail every request still waiting
+        with self.pending_lock:
+            pending_requests = list(self.pending_requests.items())
+            self.pending_requests.clear()
+        for req_id, pending in pending_requests:
+            if pending.timeout_handle is not None:
+                pending.timeout_handle.cancel()
+            message = '{0} request {1} failed: {2}'.format(pending.method, req_id, reason)
+            pending.future.set_exception(ConnectionError(message))
+        if pending_requests:
+            self.log.warning('pending requests failed', count=len(pending_requests), reason=reason)
+
+    def on_request_timeout(self, req_id, timeout):
+        pending = self.pop_pending_request(req_id)
+        if pending is None:
+            return
+        if self.metrics is not None:
+            self.metrics.observe_timeout(pending.method)
+        message = '{0} request {1} timed out after {2} s'.format(pending.method, req_id, timeout)
+        self.log.error('request timed out', method=pending.method, id=req_id, timeout=timeout)
+        pending.session.emit('inform_error', error_data={'code': ERR_REQUEST_TIMEOUT, 'message': message})
+        pending.future.set_exception(TimeoutError(message))
+    
+    def handle_warning(self, warning_dic):
+
+        self.log.debug('warning', warning=warning_dic)
+        warning_code = warning_dic['code']
+        warning_msg = warning_dic['message']
+        if warning_code == ACCESS_RIGHT_GRANTED:
+            # call authorize again
+            self.authorize()
+        elif warning_code == HEADSET_CONNECTED:
+            headset_id = warning_msg.get('headsetId') if isinstance(warning_msg, dict) else None
+            for session in list(self.sessions):
+                session.on_headset_connected(headset_id)
+        elif warning_code == CORTEX_AUTO_UNLOAD_PROFILE:
+            headset_id = warning_msg.get('headsetId') if isinstance(warning_msg, dict) else None
+            for session in self.sessions:
+                # the session of the headset, the client's own if the warning does not name it
+                if session.headset_id == headset_id or (headset_id is None and session is self):
+                    session.profile_name = ''
+                    session.loaded_profile = ''
+        elif  warning_code == CORTEX_STOP_ALL_STREAMS:
+            # print(warning_msg['behavior'])
+            session = self.sessions_by_sid.get(warning_msg['sessionId'])
+            if session is not None:
+                session.on_streams_stopped()
+
+    def on_message(self, *args):
+        if self.recorder is not None:
+            self.recorder.record(args[1])
+        recv_dic = json.loads(args[1])
+        if 'sid' in recv_dic:
+            # frames of an unknown session, e.g. of a replayed log, go to the client's own
+            self.sessions_by_sid.get(recv_dic['sid'], self).handle_stream_data(recv_dic)
+        elif 'result' in recv_dic:
+            self.handle_result(recv_dic)
+        elif 'error' in recv_dic:
+            self.handle_error(recv_dic)
+        elif 'warning' in recv_dic:
+            self.handle_warning(recv_dic['warning'])
+        else:
+            raise KeyError
+
+    def request_access(self):
+        request_access_request = {
+            "jsonrpc": "2.0", 
+            "method": "requestAccess",
+            "params": {
+                "clientId": self.client_id, 
+                "clientSecret": self.client_secret
+            },
+        }
+
+        return self.send_request(REQUEST_ACCESS_ID, request_access_request)
+
+    def has_access_right(self):
+        has_access_request = {
+            "jsonrpc": "2.0", 
+            "method": "hasAccessRight",
+            "params": {
+                "clientId": self.client_id, 
+                "clientSecret": self.client_secret
+            },
+        }
+        return self.send_request(HAS_ACCESS_RIGHT_ID, has_access_request)
+
+    def authorize(self):
+        authorize_request = {
+            "jsonrpc": "2.0",
+            "method": "authorize", 
+            "params": { 
+                "clientId": self.client_id, 
+                "clientSecret": self.client_secret, 
+                "license": self.license,
+                "debit": self.debit
+            },
+        }
+
+        return self.send_request(AUTHORIZE_ID, authorize_request)
+
+    def get_cortex_info(self):
+        get_cortex_info_request = {
+            "jsonrpc": "2.0",
+            "method": "getCortexInfo",
+        }
+
+        return self.send_request(GET_CORTEX_INFO_ID, get_cortex_info_request)
+
+    """
+        Prepare steps include:
+        Step 1: check access right. If user has not granted for the application, requestAccess will be called
+        Step 2: authorize: to generate a Cortex access token which is required parameter of many APIs
+                Steps 1 and 2 are skipped when a token_cache holds a valid token. If Cortex
+                rejects that token, the steps are run again from step 1
+        Step 3: Connect a headset. If no wanted headet is set, the first headset in the list will be connected.
+                If you use EPOC Flex headset, you should connect the headset with a proper mappings via EMOTIV Launcher first 
+        Step 4: Create a working session with the connected headset
+                Steps 3 and 4 are run for every session of the client, see add_session
+        Returns
+        -------
+        None
+        """
+
+    def do_prepare_steps(self):
+        if self.auth != '' and any(session.recovering for session in self.sessions):
+            # the token outlives the websocket
+            self.log.info('reuse cortexToken')
+            self.auth_from_cache = True
+            self.authorized.set()
+            self.start_sessions()
+            return
+        if self.token_cache is not None:
+            token = self.token_cache.load(self.client_id, self.license)
+            if token is not None:
+                self.log.info('reuse cached cortexToken')
+                self.auth = token
+                self.auth_from_cache = True
+                self.authorized.set()
+                self.start_sessions()
+                return
+        # check access right
+        self.has_access_right()
+
 
 # -------------------------------------------------------------------
 # -------------------------------------------------------------------
-# -------------------------------------------------------------------
+# -------------------------------------------------------------------
\ No newline at end of file
@@ -0,0 +1,236 @@
+import json
+import os
+import time
+import numpy as np
+
+
+# number of recent samples kept per timer for the quantiles
+TIMER_WINDOW = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class TimerStat():
+    """
+    Count, sum and max of a duration, plus the last TIMER_WINDOW samples for
+    quantiles. add() writes into a preallocated array and allocates nothing.
+    """
+    __slots__ = ('count', 'total', 'max', '_window', '_idx')
+
+    def __init__(self, window=TIMER_WINDOW):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._window = np.zeros(window, dtype=np.float64)
+        self._idx = 0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self._window[self._idx] = seconds
+        self._idx = self._idx + 1 if self._idx + 1 < len(self._window) else 0
+
+    def snapshot(self):
+        filled = self._window[:min(self.count, len(self._window))]
+        stats = {'count': self.count, 'sum': self.total, 'max': self.max,
+                 'mean': self.total / self.count if self.count else 0.0}
+        for q in QUANTILES:
+            stats['p{:g}'.format(q * 100)] = float(np.quantile(filled, q)) if len(filled) else 0.0
+        return stats
+
+
+class RateCounter():
+    """
+    A message counter that also keeps the number of messages of the last
+    complete second, as the current rate.
+    """
+    __slots__ = ('count', 'rate', '_second', '_in_second')
+
+    def __init__(self):
+        self.count = 0
+        self.rate = 0
+        self._second = 0
+        self._in_second = 0
+
+    def add(self, now):
+        self.count += 1
+        second = int(now)
+        if second != self._second:
+            # a gap of more than a second means nothing arrived in the last one
+            self.rate = self._in_second if second == self._second + 1 else 0
+            self._second = second
+            self._in_second = 0
+        self._in_second += 1
+
+    def current_rate(self, now):
+        second = int(now)
+        if second == self._second + 1:
+            return self._in_second
+        if second == self._second:
+            return self.rate
+        return 0
+
+
+class CortexMetrics():
+    """
+    Counters and timers of the Cortex hot paths, so that the time spent per
+    stream, event and request can be seen under real load without a profiler.
+
+    Updates come from the websocket and scheduler threads without locking: a
+    snapshot taken while they run may mix values from neighbouring messages,
+    which is fine for monitoring.
+
+    Attributes
+    ----------
+    streams : dict
+        stream name -> RateCounter of data messages
+    decode : dict
+        stream name -> TimerStat of the decode time, without the listeners
+    handlers : dict
+        event name -> TimerStat of the time spent in its listeners per emit
+    rtt : dict
+        JSON-RPC method -> TimerStat of the round-trip time
+    errors : dict
+        JSON-RPC method -> number of error responses
+    timeouts : dict
+        JSON-RPC method -> number of timed out requests
+    gauges : dict
+        queue name -> callable returning its current depth
+
+    Methods
+    -------
+    stats():
+        To get a snapshot of everything as a dict
+    to_prometheus():
+        To format the snapshot in the Prometheus text format
+    dump(path):
+        To write the snapshot to a JSON or Prometheus (.prom) file
+    """
+    def __init__(self):
+        self.start_time = time.monotonic()
+        self.streams = {}
+        self.decode = {}
+        self.handlers = {}
+        self.rtt = {}
+        self.errors = {}
+        self.timeouts = {}
+        self.gauges = {}
+
+    def observe_message(self, stream_name, now, decode_seconds):
+        counter = self.streams.get(stream_name)
+        if counter is None:
+            counter = self.streams[stream_name] = RateCounter()
+            self.decode[stream_name] = TimerStat()
+        counter.add(now)
+        self.decode[stream_name].add(decode_seconds)
+
+    def observe_handler(self, event_name, seconds):
+        stat = self.handlers.get(event_name)
+        if stat is None:
+            stat = self.handlers[event_name] = TimerStat()
+        stat.add(seconds)
+
+    def observe_rtt(self, method, seconds):
+        stat = self.rtt.get(method)
+        if stat is None:
+            stat = self.rtt[method] = TimerStat()
+        stat.add(seconds)
+
+    def observe_error(self, method):
+        self.errors[method] = self.errors.get(method, 0) + 1
+
+    def observe_timeout(self, method):
+        self.timeouts[method] = self.timeouts.get(method, 0) + 1
+
+    def register_gauge(self, name, depth):
+        # depth() is called on every snapshot
+        self.gauges[name] = depth
+
+    def stats(self):
+        now = time.perf_counter()
+        rpc = {}
+        for method in set(self.rtt) | set(self.errors) | set(self.timeouts):
+            stat = self.rtt.get(method)
+            rpc[method] = {'rtt': stat.snapshot() if stat is not None else None,
+                           'errors': self.errors.get(method, 0),
+                           'timeouts': self.timeouts.get(method, 0)}
+        queues = {}
+        for name, depth in list(self.gauges.items()):
+            try:
+                queues[name] = depth()
+            except Exception:
+                queues[name] = None
+        return {
+            'uptime': time.monotonic() - self.start_time,
+            'streams': {name: {'messages': counter.count, 'rate': counter.current_rate(now),
+                               'decode': self.decode[name].snapshot()}
+                        for name, counter in list(self.streams.items())},
+            'events': {name: stat.snapshot() for name, stat in list(self.handlers.items())},
+            'rpc': rpc,
+            'queues': queues,
+        }
+
+    def to_prometheus(self, stats=None):
+        if stats is None:
+            stats = self.stats()
+        lines = []
+
+        def summary(metric, label, values, help_text):
+            lines.append('# HELP {0} {1}'.format(metric, help_text))
+            lines.append('# TYPE {0} summary'.format(metric))
+            for key, stat in sorted(values.items()):
+                if stat is None:
+                    continue
+                for q in QUANTILES:
+                    lines.append('{0}{{{1}="{2}",quantile="{3:g}"}} {4!r}'.format(
+                        metric, label, key, q, stat['p{:g}'.format(q * 100)]))
+                lines.append('{0}_sum{{{1}="{2}"}} {3!r}'.format(metric, label, key, stat['sum']))
+                lines.append('{0}_count{{{1}="{2}"}} {3}'.format(metric, label, key, stat['count']))
+
+        def scalar(metric, kind, label, values, help_text):
+            lines.append('# HELP {0} {1}'.format(metric, help_text))
+            lines.append('# TYPE {0} {1}'.format(metric, kind))
+            for key, value in sorted(values.items()):
+                if value is not None:
+                    lines.append('{0}{{{1}="{2}"}} {3}'.format(metric, label, key, value))
+
+        streams = stats['streams']
+        scalar('cortex_stream_messages_total', 'counter', 'stream',
+               {name: s['messages'] for name, s in streams.items()}, 'Data messages received per stream.')
+        scalar('cortex_stream_rate', 'gauge', 'stream',
+               {name: s['rate'] for name, s in streams.items()}, 'Data messages in the last complete second.')
+        summary('cortex_stream_decode_seconds', 'stream', {name: s['decode'] for name, s in streams.items()},
+                'Decode time per data message, without the listeners.')
+        summary('cortex_event_handler_seconds', 'event', stats['events'], 'Time spent in the listeners per emit.')
+        rpc = stats['rpc']
+        summary('cortex_rpc_rtt_seconds', 'method', {m: r['rtt'] for m, r in rpc.items()},
+                'Round-trip time of JSON-RPC requests.')
+        scalar('cortex_rpc_errors_total', 'counter', 'method', {m: r['errors'] for m, r in rpc.items()},
+               'Error responses per method.')
+        scalar('cortex_rpc_timeouts_total', 'counter', 'method', {m: r['timeouts'] for m, r in rpc.items()},
+               'Timed out requests per method.')
+        scalar('cortex_queue_depth', 'gauge', 'queue', stats['queues'], 'Current depth of the client queues.')
+        lines.append('# TYPE cortex_uptime_seconds gauge')
+        lines.append('cortex_uptime_seconds {!r}'.format(stats['uptime']))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """
+        To write a snapshot to path, atomically. Files ending in .prom get the
+        Prometheus text format (e.g. for the node_exporter textfile collector),
+        all others JSON.
+
+        Returns
+        -------
+        None
+        """
+        stats = self.stats()
+        if path.endswith('.prom'):
+            text = self.to_prometheus(stats)
+        else:
+            text = json.dumps(stats, indent=2)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
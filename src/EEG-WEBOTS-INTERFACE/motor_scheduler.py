@@ -0,0 +1,204 @@
+import heapq
+import itertools
+from collections import namedtuple
+import numpy as np
+
+import peak_value_hook
+
+
+# a velocity pair (rad/s) held from start_step for duration steps (None: until replaced),
+# reached linearly over ramp steps
+MotorAction = namedtuple('MotorAction', ['left', 'right', 'start_step', 'duration', 'ramp'])
+
+LOG_COLUMNS = ('step', 'commanded_left', 'commanded_right', 'actual_left', 'actual_right')
+
+# default number of steps kept in the velocity log, about 9 minutes at 32 ms
+DEFAULT_LOG_CAPACITY = 16384
+
+
+class MotorScheduler():
+    """
+    Runs timed motor actions of a differential-drive Webots robot against the
+    simulation clock instead of busy stepping the simulation.
+
+    Call tick() once after every robot.step(). Actions are started when their
+    start step is reached, a running action is replaced by the next one that
+    becomes due, and when a timed action ends with nothing after it the
+    motors ramp down to a stop. Nothing here blocks.
+
+    Every tick records the step, the commanded velocities of the step that
+    just ran and, with position sensors, the actual wheel velocities into a
+    preallocated array. Once it is full the oldest rows are overwritten.
+
+    The scheduler is not thread-safe: schedule and tick from the thread that
+    steps the simulation.
+
+    Attributes
+    ----------
+    step : int
+        current simulation step, counted by tick()
+    current : MotorAction
+        the running action, or None when idle
+
+    Methods
+    -------
+    schedule(left, right, duration, ramp, start_step):
+        To queue an action
+    preempt(left, right, duration, ramp):
+        To drop the queue and start an action at the next tick
+    clear():
+        To drop the queued actions
+    tick():
+        To advance one simulation step
+    log():
+        To get the recorded velocities
+    """
+    def __init__(self, left_motor, right_motor, time_step, left_sensor=None, right_sensor=None,
+                 log_capacity=DEFAULT_LOG_CAPACITY):
+        self.left_motor = left_motor
+        self.right_motor = right_motor
+        self.time_step = time_step
+        self.left_sensor = left_sensor
+        self.right_sensor = right_sensor
+        self.step = 0
+        self.current = None
+
+        self._queue = []
+        self._seq = itertools.count()
+        self._queue_end = 0
+        self._commanded = (0.0, 0.0)
+        self._ramp_from = (0.0, 0.0)
+        self._ramp_start = 0
+        self._prev_position = (np.nan, np.nan)
+
+        self._log = np.full((log_capacity, len(LOG_COLUMNS)), np.nan, dtype=np.float64)
+        self._log_count = 0
+
+    def schedule(self, left, right, duration=None, ramp=0, start_step=None):
+        """
+        To queue a motor action.
+
+        Parameters
+        ----------
+        left : float, required
+            left wheel velocity in rad/s
+        right : float, required
+            right wheel velocity in rad/s
+        duration : int, optional
+            number of steps to hold the velocities. None holds them until the next action starts
+        ramp : int, optional
+            number of steps to reach the velocities from the commanded ones
+        start_step : int, optional
+            step to start at. None starts after the last queued timed action, or at the next tick
+
+        Returns
+        -------
+        MotorAction
+        """
+        if start_step is None:
+            start_step = max(self._queue_end, self.step + 1)
+        action = MotorAction(left, right, start_step, duration, ramp)
+        heapq.heappush(self._queue, (start_step, next(self._seq), action))
+        end = start_step + duration if duration is not None else start_step
+        self._queue_end = max(self._queue_end, end)
+        return action
+
+    def preempt(self, left, right, duration=None, ramp=0):
+        self.clear()
+        return self.schedule(left, right, duration, ramp, self.step + 1)
+
+    def clear(self):
+        self._queue.clear()
+        self._queue_end = self.step + 1
+
+    def tick(self):
+        """
+        To advance one simulation step: record the step that just ran, start
+        the due actions and set the motor velocities for the next step.
+
+        Returns
+        -------
+        None
+        """
+        self._record()
+        self.step += 1
+        step = self.step
+
+        while self._queue and self._queue[0][0] <= step:
+            self._begin(heapq.heappop(self._queue)[2])
+
+        current = self.current
+        if current is not None and current.duration is not None and step >= current.start_step + current.duration:
+            # timed action over and nothing due: ramp down to a stop
+            self._begin(MotorAction(0.0, 0.0, step, None, current.ramp))
+            current = self.current
+
+        if current is None:
+            return
+        elapsed = step - self._ramp_start
+        if elapsed < current.ramp:
+            frac = (elapsed + 1) / current.ramp
+            left = self._ramp_from[0] + (current.left - self._ramp_from[0]) * frac
+            right = self._ramp_from[1] + (current.right - self._ramp_from[1]) * frac
+        else:
+            left, right = current.left, current.right
+
+        if (left, right) != self._commanded:
+            self.left_motor.setVelocity(left)
+            self.right_motor.setVelocity(right)
+            self._commanded = (left, right)
+
+    def _begin(self, action):
+        self.current = action
+        self._ramp_from = self._commanded
+        self._ramp_start = self.step
+
+    def _record(self):
+        if self.left_sensor is not None and self.right_sensor is not None:
+            position = (self.left_sensor.getValue(), self.right_sensor.getValue())
+            dt = self.time_step / 1000.0
+            actual = ((position[0] - self._prev_position[0]) / dt, (position[1] - self._prev_position[1]) / dt)
+            self._prev_position = position
+        else:
+            actual = (np.nan, np.nan)
+
+        row = self._log[self._log_count % len(self._log)]
+        row[0] = self.step
+        row[1], row[2] = self._commanded
+        row[3], row[4] = actual
+        self._log_count += 1
+
+    def log(self):
+        """
+        To get the recorded velocities, oldest first.
+
+        Returns
+        -------
+        numpy array of shape (n, len(LOG_COLUMNS))
+            a copy, one row per tick
+        """
+        capacity = len(self._log)
+        if self._log_count <= capacity:
+            return self._log[:self._log_count].copy()
+        return np.roll(self._log, -(self._log_count % capacity), axis=0)
+
+
+class ScheduledMotorActuator():
+    """
+    A PeakValueHook actuator that turns each decision into a MotorScheduler
+    action, so the wheels ramp to the new velocities instead of jumping.
+    """
+    __slots__ = ('scheduler', 'speed', 'ramp')
+
+    def __init__(self, scheduler, speed=3.0, ramp=0):
+        self.scheduler = scheduler
+        self.speed = speed
+        self.ramp = ramp
+
+    def actuate(self, decision, value):
+        if decision == peak_value_hook.LEFT:
+            self.scheduler.preempt(-self.speed, self.speed, ramp=self.ramp)
+        elif decision == peak_value_hook.RIGHT:
+            self.scheduler.preempt(self.speed, -self.speed, ramp=self.ramp)
+        else:
+            self.scheduler.preempt(self.speed, self.speed, ramp=self.ramp)
@@ -0,0 +1,250 @@
+import numpy as np
+
+
+# decisions
+FORWARD = 'forward'
+LEFT = 'left'
+RIGHT = 'right'
+
+
+class PeakValueHook():
+    """
+    The decision rule of the Peak-Value-Hook control method, as a streaming
+    engine that both controllers share.
+
+    With hold_peak=True (the Hunter method) the hook keeps the peak of the
+    mental command power and decides when the power falls back to
+    release_power:
+        peak > high_threshold  -> high_decision  (default LEFT)
+        peak < low_threshold   -> low_decision   (default FORWARD)
+        otherwise              -> mid_decision   (default RIGHT)
+    then the peak is reset. With inclusive_high=True a peak equal to
+    high_threshold gives high_decision too.
+
+    With hold_peak=False (the Webots method) every packet is decided on its
+    own: neutral_action gives neutral_decision, an action in turn_actions is
+    classified by its power with the same thresholds, and other actions are
+    ignored.
+
+    Every decision is passed to actuator.actuate(decision, value). update()
+    keeps no per-packet state besides a few floats, so it allocates nothing.
+
+    Attributes
+    ----------
+    peak : float
+        the current peak (hold_peak=True)
+    last_value : float
+        the peak or power that triggered the last decision
+    last_decision : str
+        the last decision, or None
+
+    Methods
+    -------
+    update(power, action):
+        To feed one 'com' packet, returns the decision or None
+    decide(value):
+        To decide on a peak measured elsewhere, e.g. a blink
+    reset():
+        To drop the current peak without deciding
+    run_offline(powers, actions):
+        To run the same rule over recorded power values in one call
+    """
+    __slots__ = ('high_threshold', 'low_threshold', 'inclusive_high', 'release_power', 'hold_peak',
+                 'high_decision', 'mid_decision', 'low_decision', 'neutral_action',
+                 'neutral_decision', 'turn_actions', 'actuator', 'peak', 'last_value', 'last_decision')
+
+    def __init__(self, high_threshold=0.7, low_threshold=0.3, release_power=0.0, hold_peak=True,
+                 high_decision=LEFT, mid_decision=RIGHT, low_decision=FORWARD,
+                 neutral_action='neutral', neutral_decision=FORWARD, turn_actions=('left',),
+                 actuator=None, inclusive_high=False):
+        if low_threshold > high_threshold:
+            raise ValueError('low_threshold must not be greater than high_threshold.')
+
+        self.high_threshold = high_threshold
+        self.low_threshold = low_threshold
+        self.inclusive_high = inclusive_high
+        self.release_power = release_power
+        self.hold_peak = hold_peak
+        self.high_decision = high_decision
+        self.mid_decision = mid_decision
+        self.low_decision = low_decision
+        self.neutral_action = neutral_action
+        self.neutral_decision = neutral_decision
+        self.turn_actions = tuple(turn_actions)
+        self.actuator = actuator if actuator is not None else NullActuator()
+        self.peak = 0.0
+        self.last_value = 0.0
+        self.last_decision = None
+
+    def classify(self, value):
+        if value > self.high_threshold or (self.inclusive_high and value == self.high_threshold):
+            return self.high_decision
+        if value < self.low_threshold:
+            return self.low_decision
+        return self.mid_decision
+
+    def update(self, power, action=None):
+        """
+        To feed the power (and action) of one 'com' packet.
+
+        Parameters
+        ----------
+        power : float, required
+            mental command power
+        action : str, optional
+            mental command action, only used with hold_peak=False
+
+        Returns
+        -------
+        the decision taken on this packet, or None
+        """
+        if self.hold_peak:
+            # the release is checked first, a release_power above the peak is not a new peak
+            if power != self.release_power:
+                if power > self.peak:
+                    self.peak = power
+                return None
+            value = self.peak
+            decision = self.classify(value)
+            self.peak = 0.0
+        elif action == self.neutral_action:
+            value = power
+            decision = self.neutral_decision
+        elif action in self.turn_actions:
+            value = power
+            decision = self.classify(value)
+        else:
+            return None
+
+        self.last_value = value
+        self.last_decision = decision
+        self.actuator.actuate(decision, value)
+        return decision
+
+    def decide(self, value):
+        """
+        To decide on a peak measured elsewhere, e.g. the amplitude of a
+        detected blink scaled to 0.0 - 1.0, with the same thresholds and
+        actuator as update(). The held peak is reset.
+
+        Returns
+        -------
+        the decision
+        """
+        decision = self.classify(value)
+        self.peak = 0.0
+        self.last_value = value
+        self.last_decision = decision
+        self.actuator.actuate(decision, value)
+        return decision
+
+    def reset(self):
+        self.peak = 0.0
+
+    def run_offline(self, powers, actions=None):
+        """
+        To run the decision rule over a whole recording at once, vectorized with
+        NumPy. The hook state and the actuator are not touched, and the
+        recording is assumed to start right after a reset.
+
+        Parameters
+        ----------
+        powers : array_like, required
+            mental command power of each packet
+        actions : array_like, optional
+            mental command action of each packet, required with hold_peak=False
+
+        Returns
+        -------
+        (indices, values, decisions) : tuple of numpy arrays
+            packet index, triggering peak or power, and decision of every decision taken
+        """
+        powers = np.asarray(powers, dtype=np.float64)
+
+        if self.hold_peak:
+            indices = np.flatnonzero(powers == self.release_power)
+            # the peak at a release is the max of the packets since the previous release
+            starts = np.concatenate(([0], indices[:-1] + 1))
+            values = np.zeros(len(indices))
+            non_empty = starts < indices
+            if non_empty.any():
+                bounds = np.stack((starts[non_empty], indices[non_empty]), axis=1).ravel()
+                values[non_empty] = np.maximum.reduceat(powers, bounds)[::2]
+            np.maximum(values, 0.0, out=values)
+            decisions = self._classify_array(values)
+            return indices, values, decisions
+
+        if actions is None:
+            raise ValueError('run_offline needs the actions when hold_peak is False.')
+        actions = np.asarray(actions)
+        neutral = actions == self.neutral_action
+        turn = np.isin(actions, self.turn_actions) & ~neutral
+        indices = np.flatnonzero(neutral | turn)
+        values = powers[indices]
+        decisions = np.where(neutral[indices], self.neutral_decision, self._classify_array(values))
+        return indices, values, decisions
+
+    def _classify_array(self, values):
+        high = values >= self.high_threshold if self.inclusive_high else values > self.high_threshold
+        return np.where(high, self.high_decision,
+                        np.where(values < self.low_threshold, self.low_decision, self.mid_decision))
+
+
+class NullActuator():
+    """
+    An actuator that only counts decisions, for offline runs and benchmarks.
+    """
+    __slots__ = ('count',)
+
+    def __init__(self):
+        self.count = 0
+
+    def actuate(self, decision, value):
+        self.count += 1
+
+
+class TwistActuator():
+    """
+    Drives a ROS robot by handing each decision to submit(linear_x, angular_z, ticks),
+    for example CommandExecutor.submit of the Hunter controller.
+    """
+    __slots__ = ('submit', 'linear_speed', 'turn_speed', 'turn_ticks', 'forward_ticks')
+
+    def __init__(self, submit, linear_speed=0.2, turn_speed=1.0, turn_ticks=30, forward_ticks=1):
+        self.submit = submit
+        self.linear_speed = linear_speed
+        self.turn_speed = turn_speed
+        self.turn_ticks = turn_ticks
+        self.forward_ticks = forward_ticks
+
+    def actuate(self, decision, value):
+        if decision == LEFT:
+            self.submit(self.linear_speed, self.turn_speed, self.turn_ticks)
+        elif decision == RIGHT:
+            self.submit(self.linear_speed, -self.turn_speed, self.turn_ticks)
+        else:
+            self.submit(self.linear_speed, 0.0, self.forward_ticks)
+
+
+class MotorActuator():
+    """
+    Drives a differential-drive Webots robot by setting the wheel velocities of
+    its left and right motors.
+    """
+    __slots__ = ('left_motor', 'right_motor', 'speed')
+
+    def __init__(self, left_motor, right_motor, speed=3.0):
+        self.left_motor = left_motor
+        self.right_motor = right_motor
+        self.speed = speed
+
+    def actuate(self, decision, value):
+        if decision == LEFT:
+            self.left_motor.setVelocity(-self.speed)
+            self.right_motor.setVelocity(self.speed)
+        elif decision == RIGHT:
+            self.left_motor.setVelocity(self.speed)
+            self.right_motor.setVelocity(-self.speed)
+        else:
+            self.left_motor.setVelocity(self.speed)
+            self.right_motor.setVelocity(self.speed)
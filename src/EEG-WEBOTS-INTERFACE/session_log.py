@@ -0,0 +1,157 @@
+import json
+import struct
+import threading
+import time
+
+
+# file layout: MAGIC, then one record per frame:
+# monotonic receive time (float64), payload length (uint32), UTF-8 payload
+MAGIC = b'CTXLOG\x01\n'
+RECORD_HEADER = struct.Struct('<dI')
+
+
+class SessionRecorder():
+    """
+    Writes every frame received from Cortex to a compact binary log, with the
+    monotonic time it was received at. Pass it (or a path) to Cortex with the
+    record keyword, e.g. Cortex(id, secret, record='session.ctxlog').
+
+    Attributes
+    ----------
+    path : str
+        log file
+    count : int
+        number of frames written
+
+    Methods
+    -------
+    record(message):
+        To write one frame
+    close():
+        To flush and close the file
+    """
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+
+    def record(self, message, recv_time=None):
+        if recv_time is None:
+            recv_time = time.monotonic()
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(RECORD_HEADER.pack(recv_time, len(message)))
+            self._file.write(message)
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_frames(path):
+    """
+    To read a log written by SessionRecorder.
+
+    Parameters
+    ----------
+    path : str, required
+        log file
+
+    Returns
+    -------
+    generator of (recv_time, message) tuples, message being a str
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path + ' is not a Cortex session log.')
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                # end of file, or a record cut short by a crash
+                return
+            recv_time, length = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield recv_time, payload.decode('utf-8')
+
+
+class SessionReplay():
+    """
+    Feeds the frames of a recorded session back into Cortex.on_message (or
+    any on_message(ws, message) callable), so the controllers can be tested
+    and benchmarked without a headset or a Cortex service.
+
+    Responses to requests of the live session have no pending request in the
+    replaying Cortex, so they are dropped with a note, except subscribe
+    results: they are passed to Cortex.handle_sub_result so that the stream
+    columns, buffers and decoders are set up as they were live.
+
+    Attributes
+    ----------
+    path : str
+        log file
+
+    Methods
+    -------
+    replay(target, speed):
+        To feed the frames at real-time (speed=1), scaled or maximum speed (speed=0)
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def replay(self, target, speed=1.0, limit=None):
+        """
+        To feed the recorded frames on the calling thread.
+
+        Parameters
+        ----------
+        target : Cortex or callable, required
+            a Cortex, or a callable taking (ws, message) like Cortex.on_message
+        speed : float, optional
+            1.0 keeps the recorded timing, 2.0 plays twice as fast, 0 plays as fast as possible
+        limit : int, optional
+            maximum number of frames
+
+        Returns
+        -------
+        int
+            number of frames fed
+        """
+        if callable(target):
+            on_message, on_sub_result = target, None
+        else:
+            on_message, on_sub_result = target.on_message, target.handle_sub_result
+
+        count = 0
+        start = time.monotonic()
+        first = None
+        for recv_time, message in read_frames(self.path):
+            if limit is not None and count >= limit:
+                break
+            if speed > 0:
+                if first is None:
+                    first = recv_time
+                # pace against the start so that sleep overshoot does not add up
+                wait = start + (recv_time - first) / speed - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+
+            if on_sub_result is not None and '"cols"' in message:
+                recv_dic = json.loads(message)
+                result_dic = recv_dic.get('result')
+                if isinstance(result_dic, dict) and 'success' in result_dic:
+                    on_sub_result(result_dic)
+                    count += 1
+                    continue
+            on_message(None, message)
+            count += 1
+        return count
@@ -0,0 +1,195 @@
+import numpy as np
+
+
+class StreamRingBuffer():
+    """
+    A fixed-capacity ring buffer of float32 samples for one numeric Cortex stream
+    ('eeg', 'mot', 'pow' or 'met'). The columns follow the labels sent with the
+    'new_data_labels' event.
+
+    Every sample is written twice, at idx and idx + capacity, so any window of
+    the newest samples is one contiguous slice and can be returned as a view
+    without copying. A view stays valid until another capacity - n samples are
+    appended, after which it starts showing newer data.
+
+    The buffer has a single writer, the websocket thread. Readers on other
+    threads get a consistent window as long as they are done with it before
+    the writer wraps around it.
+
+    Attributes
+    ----------
+    capacity : int
+        maximum number of samples kept
+    labels : list
+        column labels, in order
+    count : int
+        total number of samples appended so far
+
+    Methods
+    -------
+    append(time, values):
+        To add one sample
+    latest(n):
+        To get views of the newest n samples
+    since(t):
+        To get views of the samples newer than time t
+    """
+    def __init__(self, capacity, labels):
+        if capacity <= 0:
+            raise ValueError('The capacity of a stream buffer must be positive.')
+
+        self.capacity = capacity
+        self.labels = list(labels)
+        self.count = 0
+        self._idx = 0
+        self._data = np.full((2 * capacity, len(self.labels)), np.nan, dtype=np.float32)
+        self._times = np.zeros(2 * capacity, dtype=np.float64)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, time, values):
+        """
+        To add one sample, overwriting the oldest one once the buffer is full.
+
+        Parameters
+        ----------
+        time : float, required
+            Cortex timestamp of the sample
+        values : list, required
+            one value per label. None (e.g. an inactive 'met' detection) is stored as NaN
+
+        Returns
+        -------
+        None
+        """
+        idx = self._idx
+        try:
+            self._data[idx] = values
+        except TypeError:
+            values = [np.nan if v is None else v for v in values]
+            self._data[idx] = values
+        self._data[idx + self.capacity] = self._data[idx]
+        self._times[idx] = time
+        self._times[idx + self.capacity] = time
+        self._idx = idx + 1 if idx + 1 < self.capacity else 0
+        self.count += 1
+
+    def latest(self, n=None):
+        """
+        To get the newest n samples, oldest first, without copying.
+
+        Parameters
+        ----------
+        n : int, optional
+            number of samples. All buffered samples are returned if n is None
+            or larger than the number of buffered samples
+
+        Returns
+        -------
+        (times, samples) : tuple of numpy arrays
+            views of shape (n,) and (n, len(labels))
+        """
+        size = len(self)
+        if n is None or n > size:
+            n = size
+        end = self._idx + self.capacity
+        return self._times[end - n:end], self._data[end - n:end]
+
+    def since(self, t):
+        """
+        To get the samples with a timestamp greater than t, oldest first, without copying.
+
+        Parameters
+        ----------
+        t : float, required
+            Cortex timestamp
+
+        Returns
+        -------
+        (times, samples) : tuple of numpy arrays
+            views of shape (n,) and (n, len(labels))
+        """
+        times, samples = self.latest()
+        start = np.searchsorted(times, t, side='right')
+        return times[start:], samples[start:]
+
+
+class StreamBlockBatcher():
+    """
+    Collects samples of one numeric Cortex stream into blocks and hands each
+    block to a callback, so listeners get one call per block instead of one
+    per sample.
+
+    A block is handed over once it holds block_size samples or once it spans
+    interval seconds of Cortex time, whichever comes first. Every block is a
+    fresh array, so the receiver may keep it.
+
+    Attributes
+    ----------
+    block_size : int
+        maximum number of samples per block, 0 for no limit
+    interval : float
+        maximum time span of a block in seconds, 0 for no limit
+    labels : list
+        column labels, in order
+
+    Methods
+    -------
+    append(time, values):
+        To add one sample
+    flush():
+        To hand over the samples collected so far
+    """
+    # initial rows of a block that is only bounded by time
+    GROW_CHUNK = 256
+
+    def __init__(self, block_size, interval, labels, on_block):
+        if block_size <= 0 and interval <= 0:
+            raise ValueError('A block batcher needs a block size or an interval.')
+
+        self.block_size = max(block_size, 0)
+        self.interval = max(interval, 0)
+        self.labels = list(labels)
+        self.on_block = on_block
+        self._new_block()
+
+    def __len__(self):
+        return self._n
+
+    def _new_block(self):
+        rows = self.block_size or self.GROW_CHUNK
+        self._data = np.empty((rows, len(self.labels)), dtype=np.float32)
+        self._times = np.empty(rows, dtype=np.float64)
+        self._n = 0
+
+    def append(self, time, values):
+        n = self._n
+        if n == len(self._times):
+            # only happens when the block is bounded by time alone
+            self._data = np.concatenate((self._data, np.empty_like(self._data)))
+            self._times = np.concatenate((self._times, np.empty_like(self._times)))
+        try:
+            self._data[n] = values
+        except TypeError:
+            self._data[n] = [np.nan if v is None else v for v in values]
+        self._times[n] = time
+        self._n = n + 1
+
+        if self._n == self.block_size or (self.interval and time - self._times[0] >= self.interval):
+            self.flush()
+
+    def flush(self):
+        """
+        To hand over the samples collected so far. Nothing happens if the block is empty.
+
+        Returns
+        -------
+        None
+        """
+        n = self._n
+        if n == 0:
+            return
+        times, samples = self._times[:n], self._data[:n]
+        self._new_block()
+        self.on_block(times, samples)
@@ -0,0 +1,234 @@
+import atexit
+import collections
+import json
+import sys
+import threading
+import time
+
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+DEFAULT_CAPACITY = 4096
+DEFAULT_FLUSH_INTERVAL = 0.1
+
+
+class Telemetry():
+    """
+    The shared back end of all TelemetryLogger objects: events are appended to
+    an in-memory queue by the logging thread and written out by a background
+    flusher thread, so logging on the websocket thread never waits for stdout.
+
+    The flusher moves every event into a ring buffer of the last capacity
+    events, which dump() returns when something goes wrong. If the flusher
+    falls behind by more than capacity events, the oldest are dropped and
+    counted in dropped.
+
+    Attributes
+    ----------
+    level : int
+        minimum level of the loggers that do not set their own
+    sink : file
+        where formatted events are written, None to only keep them in the ring buffer
+    fmt : str
+        'text' or 'json' (one JSON object per line)
+    dropped : int
+        events dropped because the flusher fell behind
+
+    Methods
+    -------
+    flush():
+        To write out the queued events now
+    dump(n, file):
+        To get or write the last n events
+    close():
+        To flush and stop the flusher thread
+    """
+    def __init__(self, level=INFO, sink=sys.stdout, capacity=DEFAULT_CAPACITY,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, fmt='text'):
+        self.level = level
+        self.sink = sink
+        self.fmt = fmt
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue = collections.deque(maxlen=capacity)
+        self._ring = collections.deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopped = False
+
+    def append(self, record):
+        # the only work done on the logging thread
+        queue = self._queue
+        if len(queue) == queue.maxlen:
+            self.dropped += 1
+        queue.append(record)
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None or self._stopped:
+                return
+            self._thread = threading.Thread(target=self._run, name='TelemetryFlusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            lines = []
+            queue = self._queue
+            while queue:
+                record = queue.popleft()
+                self._ring.append(record)
+                if self.sink is not None:
+                    lines.append(self.format(record))
+            if lines:
+                try:
+                    self.sink.write('\n'.join(lines) + '\n')
+                    self.sink.flush()
+                except (OSError, ValueError):
+                    # sink closed, e.g. at interpreter exit
+                    pass
+
+    def format(self, record):
+        created, level, name, event, fields = record
+        if self.fmt == 'json':
+            entry = {'time': created, 'level': LEVEL_NAMES.get(level, level), 'logger': name, 'event': event}
+            entry.update(fields)
+            return json.dumps(entry, default=str)
+        stamp = time.strftime('%H:%M:%S', time.localtime(created)) + '.{:03d}'.format(int(created % 1 * 1000))
+        text = '{0} {1:<7} {2} {3}'.format(stamp, LEVEL_NAMES.get(level, level), name, event)
+        if fields:
+            text += ' ' + ' '.join('{0}={1}'.format(key, value) for key, value in fields.items())
+        return text
+
+    def dump(self, n=None, file=None):
+        """
+        To get the last n events, oldest first, including those not flushed yet.
+
+        Parameters
+        ----------
+        n : int, optional
+            number of events, all buffered events if None
+        file : file, optional
+            if given, the events are written to it as well
+
+        Returns
+        -------
+        list of str
+            the formatted events
+        """
+        self.flush()
+        with self._lock:
+            records = list(self._ring)
+        if n is not None:
+            records = records[-n:]
+        lines = [self.format(record) for record in records]
+        if file is not None:
+            file.write('\n'.join(lines) + '\n')
+            file.flush()
+        return lines
+
+    def close(self):
+        self._stopped = True
+        self._wakeup.set()
+        self.flush()
+
+
+class TelemetryLogger():
+    """
+    A named, level-gated logger. Events are a short message plus key=value
+    fields, e.g. log.info('decision', action='left', peak=0.82). Below the
+    level a call returns at once; otherwise it only appends a tuple, and the
+    formatting is done later on the flusher thread, so the fields must not be
+    changed after logging them.
+
+    Attributes
+    ----------
+    name : str
+        shown with every event
+    level : int
+        minimum level, None to follow the shared Telemetry level
+    """
+    __slots__ = ('name', 'level', 'telemetry')
+
+    def __init__(self, name, level=None, telemetry=None):
+        self.name = name
+        self.level = level
+        self.telemetry = telemetry if telemetry is not None else get_telemetry()
+
+    def is_enabled(self, level):
+        return level >= (self.level if self.level is not None else self.telemetry.level)
+
+    def log(self, level, event, **fields):
+        if level >= (self.level if self.level is not None else self.telemetry.level):
+            self.telemetry.append((time.time(), level, self.name, event, fields))
+
+    # the level methods repeat the check of log() to save a call per event
+    def debug(self, event, **fields):
+        if DEBUG >= (self.level if self.level is not None else self.telemetry.level):
+            self.telemetry.append((time.time(), DEBUG, self.name, event, fields))
+
+    def info(self, event, **fields):
+        if INFO >= (self.level if self.level is not None else self.telemetry.level):
+            self.telemetry.append((time.time(), INFO, self.name, event, fields))
+
+    def warning(self, event, **fields):
+        self.log(WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(ERROR, event, **fields)
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+
+def get_telemetry():
+    # the process-wide Telemetry, created on first use and flushed at exit
+    global _telemetry
+    if _telemetry is None:
+        with _telemetry_lock:
+            if _telemetry is None:
+                _telemetry = Telemetry()
+                atexit.register(_telemetry.close)
+    return _telemetry
+
+
+def configure(level=None, sink=False, fmt=None, flush_interval=None):
+    """
+    To change the process-wide Telemetry, e.g. configure(level=telemetry.DEBUG)
+    or configure(sink=open('run.log', 'w'), fmt='json'). sink=None keeps the
+    events in the ring buffer only.
+    """
+    telemetry = get_telemetry()
+    if level is not None:
+        telemetry.level = level
+    if sink is not False:
+        telemetry.flush()
+        telemetry.sink = sink
+    if fmt is not None:
+        telemetry.fmt = fmt
+    if flush_interval is not None:
+        telemetry.flush_interval = flush_interval
+    return telemetry
+
+
+def get_logger(name, level=None):
+    return TelemetryLogger(name, level)
+
+
+def dump(n=None, file=None):
+    # the last n events of the process-wide Telemetry
+    return get_telemetry().dump(n, file)
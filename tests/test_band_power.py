@@ -0,0 +1,85 @@
+"""BandPowerEngine of the 'eeg' stream against a Welch PSD of the whole window.
+
+Run from the repository root:
+    python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'EEG-HUNTER-INTERFACE'))
+
+from band_power import BANDS, BandPowerEngine
+
+
+RATE = 128
+LABELS = ['COUNTER', 'INTERPOLATED', 'AF3', 'O1', 'RAW_CQ']
+
+
+def fixed_signal(n):
+    # a 10 Hz sine on AF3 and a 20 Hz sine on O1, with a little deterministic noise
+    t = np.arange(n) / float(RATE)
+    noise = np.random.default_rng(0).normal(0.0, 1.0, (n, 2))
+    samples = np.zeros((n, len(LABELS)))
+    samples[:, 0] = np.arange(n)
+    samples[:, 2] = 4200.0 + 20.0 * np.sin(2 * np.pi * 10.0 * t) + noise[:, 0]
+    samples[:, 3] = 4200.0 + 10.0 * np.sin(2 * np.pi * 20.0 * t) + noise[:, 1]
+    return t, samples
+
+
+def welch_band_powers(x, nperseg, step):
+    # Welch PSD of the whole window (periodic Hann, constant detrend, one-sided density),
+    # integrated over each band
+    taper = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(nperseg) / nperseg)
+    starts = range(0, len(x) - nperseg + 1, step)
+    psd = 0.0
+    for start in starts:
+        seg = x[start:start + nperseg]
+        seg = seg - seg.mean(axis=0)
+        psd = psd + np.abs(np.fft.rfft(seg * taper[:, np.newaxis], axis=0)) ** 2
+    psd = psd / len(starts) / (RATE * np.sum(taper ** 2))
+    psd[1:-1] *= 2.0
+    freqs = np.fft.rfftfreq(nperseg, 1.0 / RATE)
+    df = freqs[1] - freqs[0]
+    return np.array([[psd[(freqs >= low) & (freqs < high), ch].sum() * df for _, low, high in BANDS]
+                     for ch in range(x.shape[1])])
+
+
+def test_engine_matches_a_full_window_welch():
+    times, samples = fixed_signal(4 * RATE)
+    updates = []
+    engine = BandPowerEngine(LABELS, sampling_rate=RATE, window=2.0, segment=1.0, overlap=0.875,
+                             update_rate=8.0, on_features=lambda t, powers: updates.append((t, powers.copy())))
+    for t, row in zip(times, samples.tolist()):
+        engine.append(t, row)
+
+    window = 2 * RATE
+    hop = RATE // 8
+    assert engine.channels == ['AF3', 'O1']
+    assert len(updates) == 1 + (len(times) - window) // hop
+    for n, (t, powers) in enumerate(updates):
+        end = window + n * hop
+        assert t == times[end - 1]
+        reference = welch_band_powers(samples[end - window:end, 2:4], RATE, engine.step)
+        np.testing.assert_allclose(powers, reference, rtol=1e-9)
+
+    # the sines land in their bands
+    alpha, beta = 2, 3
+    assert np.argmax(updates[-1][1][0]) == alpha
+    assert np.argmax(updates[-1][1][1]) == beta
+
+
+def test_blocks_match_samples():
+    times, samples = fixed_signal(4 * RATE)
+    by_sample, by_block = [], []
+    engine = BandPowerEngine(LABELS, sampling_rate=RATE, on_features=lambda t, p: by_sample.append(p.copy()))
+    block_engine = BandPowerEngine(LABELS, sampling_rate=RATE, on_features=lambda t, p: by_block.append(p.copy()))
+    for t, row in zip(times, samples.tolist()):
+        engine.append(t, row)
+    # uneven blocks, some completing several segments at once
+    for start in range(0, len(times), 37):
+        block_engine.append_block(times[start:start + 37], samples[start:start + 37])
+
+    assert len(by_block) == len(by_sample)
+    np.testing.assert_allclose(by_block, by_sample, rtol=1e-9)
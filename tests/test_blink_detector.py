@@ -0,0 +1,70 @@
+"""BlinkDetector bound to a Cortex: the sampling rate from the headset settings, and 'blink' events.
+
+Run from the repository root:
+    python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src', 'EEG-HUNTER-INTERFACE'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import telemetry
+from blink_detector import BlinkDetector
+from cortex import Cortex
+from mock_cortex import STREAM_COLS
+
+LABELS = STREAM_COLS['eeg'][:-1]
+
+
+class Listener():
+    def __init__(self):
+        self.events = []
+
+    def on_blink(self, *args, **kwargs):
+        self.events.append(kwargs.get('data'))
+
+
+def subscribe_eeg(c):
+    c.handle_sub_result({'success': [{'streamName': 'eeg', 'cols': STREAM_COLS['eeg'], 'sid': 'test'}],
+                         'failure': []})
+
+
+def test_unknown_rate_disables_the_detector():
+    telemetry.configure(sink=None)
+    c = Cortex('test_client_id', 'test_client_secret')
+    detector = BlinkDetector()
+    detector.bind(c)
+    # no settings in the headset info: logged, not raised on the websocket thread
+    subscribe_eeg(c)
+    assert detector.labels is None
+    c.handle_stream_data({'eeg': [0.0] * len(LABELS) + [[]], 'sid': 'test', 'time': 0.0})
+    assert detector.count == 0
+
+
+def test_rate_from_headset_and_blink_event():
+    telemetry.configure(sink=None)
+    rate = 256
+    c = Cortex('test_client_id', 'test_client_secret')
+    c.headset_info = {'id': 'test', 'settings': {'eegRate': rate}}
+    detector = BlinkDetector()
+    detector.bind(c)
+    listener = Listener()
+    c.bind(blink=listener.on_blink)
+    subscribe_eeg(c)
+    assert detector.sampling_rate == rate
+
+    # 3 s of baseline, then a 0.2 s blink of 150 uV on AF3 and AF4
+    n = 4 * rate
+    t = np.arange(n) / float(rate)
+    blink = np.where((t >= 3.0) & (t < 3.2), 150.0 * np.sin(np.pi * (t - 3.0) / 0.2), 0.0)
+    for k in range(n):
+        values = [4200.0] * len(LABELS)
+        for ch in ('AF3', 'AF4'):
+            values[LABELS.index(ch)] += blink[k]
+        c.handle_stream_data({'eeg': values + [[]], 'sid': 'test', 'time': float(t[k])})
+    assert len(listener.events) == 1
+    assert 3.0 <= listener.events[0].start < 3.1
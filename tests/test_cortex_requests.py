@@ -0,0 +1,104 @@
+"""Pending requests and headset retries of a Cortex whose websocket closes, against benchmarks/mock_cortex.py.
+
+Run from the repository root:
+    python -m pytest tests
+"""
+import json
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src', 'EEG-HUNTER-INTERFACE'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import cortex
+import telemetry
+from cortex import Cortex
+from mock_cortex import MockCortex
+
+
+@pytest.fixture
+def mock():
+    telemetry.configure(sink=None)
+    # the connection is dropped 1 s after createSession
+    mock = MockCortex(disconnect_after=1.0)
+    mock.url = mock.start_in_thread()
+    yield mock
+    mock.stop()
+
+
+def test_close_fails_pending_requests(mock):
+    c = Cortex('test_client_id', 'test_client_secret', url=mock.url, metrics=False)
+    c.open(block=False)
+    assert c.session_ready.wait(10)
+
+    # never answered, with no timeout of its own: only the disconnect can end it
+    mock.drop_rate = 1.0
+    future = c.query_headset()
+    assert c.pending_requests
+
+    with pytest.raises(ConnectionError):
+        future.result(10)
+    assert c.pending_requests == {}
+    c.close()
+
+
+def test_close_cancels_headset_retries():
+    telemetry.configure(sink=None)
+    # the headset stays 'connecting', so queryHeadsets is retried with backoff
+    mock = MockCortex(connecting_queries=1000)
+    url = mock.start_in_thread()
+    try:
+        c = Cortex('test_client_id', 'test_client_secret', url=url, metrics=False)
+        c.open(block=False)
+        deadline = time.monotonic() + 10
+        while mock.requests.get('queryHeadsets', 0) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert mock.requests.get('queryHeadsets', 0) >= 2
+        c.close()
+        queries = mock.requests.get('queryHeadsets', 0)
+        assert c.headset_retry is None
+        assert len(c.scheduler) == 0
+
+        # longer than the next backoff delay
+        time.sleep(2 * cortex.HEADSET_RETRY_MIN_DELAY + 1.0)
+        assert mock.requests.get('queryHeadsets', 0) == queries
+    finally:
+        mock.stop()
+
+
+class StubSocket():
+    # the websocket of a client that is never opened, keeping what it sends
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+class RaisingListener():
+    def on_event(self, *args, **kwargs):
+        raise RuntimeError('listener failed')
+
+
+def test_future_resolved_when_a_listener_raises():
+    telemetry.configure(sink=None)
+    c = Cortex('test_client_id', 'test_client_secret')
+    c.ws = StubSocket()
+    listener = RaisingListener()
+    c.bind(create_session_done=listener.on_event, inform_error=listener.on_event)
+
+    future = c.create_session()
+    result = {'id': 'test-session', 'status': 'activated'}
+    with pytest.raises(RuntimeError):
+        c.handle_result({'id': c.ws.sent[-1]['id'], 'result': result})
+    assert future.result(0) == result
+
+    future = c.query_headset()
+    with pytest.raises(RuntimeError):
+        c.handle_error({'id': c.ws.sent[-1]['id'], 'error': {'code': -32004, 'message': 'no headset'}})
+    with pytest.raises(cortex.CortexError):
+        future.result(0)
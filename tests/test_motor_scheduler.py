@@ -0,0 +1,65 @@
+"""MotorScheduler of the Webots controller.
+
+Run from the repository root:
+    python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'EEG-WEBOTS-INTERFACE'))
+
+from motor_scheduler import MotorScheduler
+
+
+class FakeMotor():
+    # records every velocity it is set to
+    def __init__(self):
+        self.velocities = []
+
+    def setVelocity(self, velocity):
+        self.velocities.append(velocity)
+
+
+def make_scheduler():
+    left, right = FakeMotor(), FakeMotor()
+    return MotorScheduler(left, right, 32), left, right
+
+
+def test_timed_action_ramps_down_to_a_stop():
+    scheduler, left, right = make_scheduler()
+    scheduler.schedule(2.0, -2.0, duration=3, ramp=2)
+    for _ in range(8):
+        scheduler.tick()
+    # ramp up over 2 steps, hold, then ramp down over 2 steps once the 3 steps are over
+    assert left.velocities == [1.0, 2.0, 1.0, 0.0]
+    assert right.velocities == [-1.0, -2.0, -1.0, 0.0]
+    assert scheduler.current.duration is None
+    assert (scheduler.current.left, scheduler.current.right) == (0.0, 0.0)
+
+
+def test_preempt_drops_the_queue():
+    scheduler, left, right = make_scheduler()
+    scheduler.schedule(1.0, 1.0, duration=10)
+    scheduler.schedule(2.0, 2.0, duration=10)
+    scheduler.tick()
+    scheduler.tick()
+    assert left.velocities == [1.0]
+
+    scheduler.preempt(-3.0, 3.0)
+    for _ in range(30):
+        scheduler.tick()
+    # the preempting action starts at the next tick and, being untimed, is never replaced
+    assert left.velocities == [1.0, -3.0]
+    assert right.velocities == [1.0, 3.0]
+    assert scheduler.current.start_step == 3
+
+
+def test_log_records_the_commanded_velocities():
+    scheduler, left, right = make_scheduler()
+    scheduler.schedule(1.0, 1.0, duration=2)
+    for _ in range(4):
+        scheduler.tick()
+    log = scheduler.log()
+    # each row holds what was commanded during the step that just ran
+    assert list(log[:, 0]) == [0, 1, 2, 3]
+    assert list(log[:, 1]) == [0.0, 1.0, 1.0, 0.0]
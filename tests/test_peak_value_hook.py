@@ -0,0 +1,46 @@
+"""The Peak-Value-Hook decision rule shared by both controllers.
+
+Run from the repository root:
+    python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'EEG-HUNTER-INTERFACE'))
+
+import peak_value_hook
+from peak_value_hook import PeakValueHook
+
+
+def webots_hook():
+    # the per-packet rule of the Webots controller (T7_controller.py)
+    return PeakValueHook(high_threshold=0.7, low_threshold=0.0, hold_peak=False,
+                         high_decision=peak_value_hook.RIGHT, mid_decision=peak_value_hook.LEFT,
+                         inclusive_high=True)
+
+
+def test_webots_turn_threshold_is_inclusive():
+    # the original controller turned right on power >= 0.7
+    hook = webots_hook()
+    assert hook.update(0.7, 'left') == peak_value_hook.RIGHT
+    assert hook.update(0.69, 'left') == peak_value_hook.LEFT
+    assert hook.update(0.71, 'left') == peak_value_hook.RIGHT
+    _, _, decisions = hook.run_offline([0.69, 0.7, 0.71], ['left', 'left', 'left'])
+    assert list(decisions) == [peak_value_hook.LEFT, peak_value_hook.RIGHT, peak_value_hook.RIGHT]
+
+
+def test_update_matches_run_offline_with_release_power():
+    rng = np.random.default_rng(0)
+    release_power = 0.2
+    powers = np.round(rng.uniform(0.0, 1.0, 2000), 1)
+    hook = PeakValueHook(release_power=release_power)
+    indices, values, decisions = hook.run_offline(powers)
+    assert len(indices)
+
+    streamed = [(n, hook.peak, hook.update(power)) for n, power in enumerate(powers)]
+    streamed = [(n, value, decision) for n, value, decision in streamed if decision is not None]
+    assert [n for n, _, _ in streamed] == list(indices)
+    assert [decision for _, _, decision in streamed] == list(decisions)
+    assert np.allclose([value for _, value, _ in streamed], values)
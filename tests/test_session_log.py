@@ -0,0 +1,67 @@
+"""SessionRecorder, read_frames and SessionReplay of the session logs.
+
+Run from the repository root:
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'EEG-HUNTER-INTERFACE'))
+
+from session_log import SessionRecorder, SessionReplay, read_frames
+
+
+FRAMES = [
+    (1.5, '{"id": 1, "result": {}}'),
+    (1.75, '{"eeg": [1, 2.5, "x"], "sid": "s", "time": 2.0}'),
+    # non-ASCII and bytes payloads round trip as str
+    (2.0, '{"warning": {"message": "déconnecté"}}'),
+    (2.25, b'{"com": ["push", 0.8]}'),
+]
+
+
+def write_log(path, frames):
+    recorder = SessionRecorder(str(path))
+    for recv_time, message in frames:
+        recorder.record(message, recv_time)
+    recorder.close()
+    return recorder
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'session.ctxlog'
+    recorder = write_log(path, FRAMES)
+    assert recorder.count == len(FRAMES)
+    # writes after close are dropped
+    recorder.record('{}', 3.0)
+
+    frames = list(read_frames(str(path)))
+    assert [t for t, _ in frames] == [t for t, _ in FRAMES]
+    assert [m for _, m in frames] == [m.decode('utf-8') if isinstance(m, bytes) else m for _, m in FRAMES]
+
+
+def test_truncated_record_is_skipped(tmp_path):
+    path = tmp_path / 'session.ctxlog'
+    write_log(path, FRAMES)
+    # cut the last payload short, as a crash while writing would
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 3)
+    assert len(list(read_frames(str(path)))) == len(FRAMES) - 1
+
+
+def test_not_a_session_log(tmp_path):
+    path = tmp_path / 'other.bin'
+    path.write_bytes(b'not a log')
+    with pytest.raises(ValueError):
+        list(read_frames(str(path)))
+
+
+def test_replay_feeds_every_frame(tmp_path):
+    path = tmp_path / 'session.ctxlog'
+    write_log(path, FRAMES)
+    received = []
+    count = SessionReplay(str(path)).replay(lambda ws, message: received.append(message), speed=0, limit=3)
+    assert count == 3
+    assert received == [m for _, m in FRAMES[:3]]
@@ -0,0 +1,113 @@
+"""StreamRingBuffer and StreamBlockBatcher of the numeric streams.
+
+Run from the repository root:
+    python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'EEG-HUNTER-INTERFACE'))
+
+from stream_buffer import StreamBlockBatcher, StreamRingBuffer
+
+
+def filled_buffer(capacity, count):
+    # sample n holds n in every column at time n / 10
+    buffer = StreamRingBuffer(capacity, ['a', 'b'])
+    for n in range(count):
+        buffer.append(n / 10.0, [n, n])
+    return buffer
+
+
+def test_ring_wraps_around():
+    buffer = filled_buffer(8, 21)
+    assert buffer.count == 21
+    assert len(buffer) == 8
+    times, samples = buffer.latest()
+    # the newest 8 samples, oldest first, in one contiguous view
+    assert list(samples[:, 0]) == list(range(13, 21))
+    assert np.allclose(times, np.arange(13, 21) / 10.0)
+    assert samples.base is not None
+
+
+def test_latest_and_since_views():
+    buffer = filled_buffer(8, 5)
+    times, samples = buffer.latest(3)
+    assert list(samples[:, 1]) == [2, 3, 4]
+    times, samples = buffer.latest(100)
+    assert list(samples[:, 0]) == [0, 1, 2, 3, 4]
+
+    buffer = filled_buffer(8, 20)
+    times, samples = buffer.since(15 / 10.0)
+    assert list(samples[:, 0]) == [16, 17, 18, 19]
+    times, samples = buffer.since(0.0)
+    assert list(samples[:, 0]) == list(range(12, 20))
+    # a view of n samples holds for capacity - n more appends, then shows newer data
+    times, samples = buffer.latest(2)
+    for n in range(20, 26):
+        buffer.append(n / 10.0, [n, n])
+    assert list(samples[:, 0]) == [18, 19]
+    buffer.append(2.6, [26, 26])
+    assert samples[0, 0] == 26
+
+
+def test_none_stored_as_nan():
+    buffer = StreamRingBuffer(4, ['a', 'b'])
+    buffer.append(0.0, [1.0, None])
+    _, samples = buffer.latest()
+    assert samples[0, 0] == 1.0 and np.isnan(samples[0, 1])
+
+
+class Blocks():
+    def __init__(self):
+        self.blocks = []
+
+    def on_block(self, times, samples):
+        self.blocks.append((times, samples))
+
+
+def test_batcher_cuts_by_size():
+    blocks = Blocks()
+    batcher = StreamBlockBatcher(4, 0, ['a'], blocks.on_block)
+    for n in range(10):
+        batcher.append(n / 128.0, [n])
+    assert [list(samples[:, 0]) for _, samples in blocks.blocks] == [[0, 1, 2, 3], [4, 5, 6, 7]]
+    assert len(batcher) == 2
+    batcher.flush()
+    assert list(blocks.blocks[-1][1][:, 0]) == [8, 9]
+    # blocks are fresh arrays the receiver may keep
+    assert blocks.blocks[0][1][0, 0] == 0
+    batcher.flush()
+    assert len(blocks.blocks) == 3
+
+
+def test_batcher_cuts_by_interval():
+    blocks = Blocks()
+    # bounded by time only, past GROW_CHUNK samples per block
+    batcher = StreamBlockBatcher(0, 3.0, ['a'], blocks.on_block)
+    count = StreamBlockBatcher.GROW_CHUNK * 2 + 10
+    for n in range(count):
+        batcher.append(n / 100.0, [n])
+    # a block is handed over with the first sample interval seconds after its first one
+    sizes = [len(times) for times, _ in blocks.blocks]
+    assert sizes == [301] * (count // 301)
+    for times, _ in blocks.blocks:
+        assert np.isclose(times[-1] - times[0], 3.0)
+
+
+def test_batcher_cuts_at_the_first_bound():
+    blocks = Blocks()
+    batcher = StreamBlockBatcher(5, 1.0, ['a'], blocks.on_block)
+    for n in range(8):
+        # 0.5 s apart: the interval is reached after 3 samples, before the size
+        batcher.append(n * 0.5, [n])
+    assert [len(times) for times, _ in blocks.blocks] == [3, 3]
+
+    blocks = Blocks()
+    batcher = StreamBlockBatcher(5, 1.0, ['a'], blocks.on_block)
+    for n in range(12):
+        # 0.1 s apart: the size is reached first
+        batcher.append(n * 0.1, [n])
+    assert [len(times) for times, _ in blocks.blocks] == [5, 5]
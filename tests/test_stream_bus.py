@@ -0,0 +1,118 @@
+"""SharedStreamRing and SharedStreamReader of the shared memory stream bus.
+
+Run from the repository root:
+    python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'EEG-HUNTER-INTERFACE'))
+
+import stream_bus
+from stream_bus import SharedStreamReader, SharedStreamRing
+
+
+@pytest.fixture
+def bus(request):
+    # a segment name of its own per test and process
+    name = 'cortex_test_{0}_{1}'.format(os.getpid(), request.node.name)[:30]
+    ring = SharedStreamRing(name, 8, ['a', 'b'])
+    reader = SharedStreamReader(name)
+    yield ring, reader
+    reader.close()
+    ring.close()
+
+
+def fill(ring, count):
+    # sample n holds n in every column at time n / 10
+    for n in range(ring.count, ring.count + count):
+        ring.append(n / 10.0, [n, n])
+
+
+def test_reader_sees_the_labels_and_count(bus):
+    ring, reader = bus
+    assert reader.labels == ['a', 'b']
+    assert reader.capacity == 8
+    fill(ring, 3)
+    assert reader.count == 3
+    start, times, samples = reader.latest()
+    assert start == 0
+    assert list(samples[:, 0]) == [0, 1, 2]
+    assert list(times) == pytest.approx([0.0, 0.1, 0.2])
+    del times, samples
+
+
+def test_views_after_a_wrap(bus):
+    ring, reader = bus
+    fill(ring, 21)
+    start, times, samples = reader.latest()
+    # the newest 8 samples, oldest first, in one contiguous view
+    assert start == 13
+    assert list(samples[:, 0]) == list(range(13, 21))
+    start, times, samples = reader.latest(3)
+    assert start == 18
+    assert list(samples[:, 1]) == [18, 19, 20]
+    # a cursor more than capacity behind starts at the oldest sample left
+    start, times, samples = reader.since(4)
+    assert start == 13
+    assert len(samples) == 8
+    start, times, samples = reader.since(19)
+    assert start == 19
+    assert list(samples[:, 0]) == [19, 20]
+    assert list(times) == pytest.approx([1.9, 2.0])
+    start, times, samples = reader.since(21)
+    assert len(times) == 0
+    del times, samples
+
+
+def test_window_is_invalid_once_overwritten(bus):
+    ring, reader = bus
+    fill(ring, 8)
+    start, times, samples = reader.latest()
+    assert reader.valid(start)
+
+    # a sample being written already counts against the window
+    ring._header[stream_bus.SEQ_IDX] = 2 * ring.count + 1
+    assert not reader.valid(start)
+    ring._header[stream_bus.SEQ_IDX] = 2 * ring.count
+
+    # the oldest sample of the view is overwritten by the next append
+    fill(ring, 1)
+    assert not reader.valid(start)
+    assert samples[0, 0] == 8
+    # a shorter window lasts as many appends as it is short of capacity
+    start, _, _ = reader.latest(5)
+    fill(ring, 3)
+    assert reader.valid(start)
+    fill(ring, 1)
+    assert not reader.valid(start)
+    del times, samples
+
+
+def test_read_returns_copies(bus):
+    ring, reader = bus
+    fill(ring, 5)
+    start, times, samples = reader.read(2)
+    assert start == 2
+    assert list(samples[:, 0]) == [2, 3, 4]
+    fill(ring, 10)
+    # the copies keep what was read while the ring moved on
+    assert list(samples[:, 0]) == [2, 3, 4]
+    assert list(times) == pytest.approx([0.2, 0.3, 0.4])
+    assert samples.dtype == np.float32
+
+
+def test_none_is_stored_as_nan_and_close_is_seen(bus):
+    ring, reader = bus
+    ring.append(0.0, [None, 1.0])
+    start, times, samples = reader.read(0)
+    assert np.isnan(samples[0, 0]) and samples[0, 1] == 1.0
+    assert not reader.closed
+    ring.close()
+    assert reader.closed
+    # appends after close are dropped
+    ring.append(0.1, [1.0, 1.0])
+    assert ring.count == 1